@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# fake_onedrive.py
+
+# Stand-in for the `onedrive` client used by the benchmark harness. It prints a configurable amount of
+# output, optionally mutates metadata.db like a download would, and exits with a configurable code.
+#
+# Environment:
+#   FAKE_ONEDRIVE_DB            metadata.db to mutate.
+#   FAKE_ONEDRIVE_EVENTS        File to which "mutation <time>" lines are appended.
+#   FAKE_ONEDRIVE_STATE         File counting the runs, used by FAKE_ONEDRIVE_MUTATE_EVERY.
+#   FAKE_ONEDRIVE_LINES         Lines of output per run (default 100).
+#   FAKE_ONEDRIVE_EXIT_CODE     Exit code (default 0).
+#   FAKE_ONEDRIVE_MUTATE_EVERY  Mutate metadata.db on every Nth run, 0 to never mutate (default 1).
+#   FAKE_ONEDRIVE_MUTATE_BOOKS  Books whose last_modified is bumped per mutation (default 10).
+#   FAKE_ONEDRIVE_MONITOR_INTERVAL  Seconds between mutations in --monitor mode (default 5).
+
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def next_run_number():
+    state_path = os.environ.get("FAKE_ONEDRIVE_STATE")
+    if not state_path:
+        return 1
+    try:
+        with open(state_path) as state:
+            run = int(state.read() or 0) + 1
+    except FileNotFoundError:
+        run = 1
+    with open(state_path, "w") as state:
+        state.write(str(run))
+    return run
+
+def print_output(lines):
+    for index in range(lines):
+        print(f"Processing ./Calibre Library/Author {index % 97}/Book {index} ({index})/cover.jpg", flush=False)
+    sys.stdout.flush()
+
+def mutate_library():
+    db_path = os.environ["FAKE_ONEDRIVE_DB"]
+    books = env_int("FAKE_ONEDRIVE_MUTATE_BOOKS", 10)
+    connection = sqlite3.connect(db_path)
+    try:
+        with connection:
+            timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(sep=" ")
+            connection.execute("UPDATE books SET last_modified = ? WHERE id IN (SELECT id FROM books ORDER BY RANDOM() LIMIT ?)", (timestamp, books))
+            cursor = connection.execute("INSERT INTO books (title, sort, author_sort, path, last_modified, has_cover) VALUES ('New', 'New', 'Bench', 'Bench/New', ?, 0)", (timestamp,))
+            connection.execute("UPDATE books SET path = ? WHERE id = ?", (f"Bench/New ({cursor.lastrowid})", cursor.lastrowid))
+    finally:
+        connection.close()
+    events_path = os.environ.get("FAKE_ONEDRIVE_EVENTS")
+    if events_path:
+        with open(events_path, "a") as events:
+            events.write(f"mutation {time.time()}\n")
+    print(f"Downloading file ./Calibre Library/{os.path.basename(db_path)} ... done.", flush=True)
+
+def synchronize():
+    run = next_run_number()
+    print_output(env_int("FAKE_ONEDRIVE_LINES", 100))
+    mutate_every = env_int("FAKE_ONEDRIVE_MUTATE_EVERY", 1)
+    if mutate_every and run % mutate_every == 0:
+        mutate_library()
+    return env_int("FAKE_ONEDRIVE_EXIT_CODE", 0)
+
+def monitor():
+    interval = float(os.environ.get("FAKE_ONEDRIVE_MONITOR_INTERVAL", 5))
+    print("Initializing monitor for local path changes", flush=True)
+    while True:
+        time.sleep(interval)
+        print_output(env_int("FAKE_ONEDRIVE_LINES", 100))
+        mutate_library()
+
+if __name__ == "__main__":
+    if "--monitor" in sys.argv:
+        monitor()
+    sys.exit(synchronize())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# replay_cycles.py
+
+# Replays sync cycles recorded with CYCLE_RECORD_PATH through the real OneDriveServer pipeline, offline.
+# The recorded onedrive output is fed back with its original timing, scaled by --speed, against a scratch
+# copy of metadata.db that is modified wherever the recorded fingerprints show the real one changed.
+# Calibre-Web is replaced by a stand-in answering each reconnect after the recorded delay. Settings come
+# from the environment as for the daemon, so detection and scheduling strategies can be compared on the
+# same trace. The report gives the recorded and replayed result and duration of every cycle, and the delay
+# the configured scheduler would have chosen next against the recorded gap.
+#
+# Usage:
+#   CHANGE_DETECTION=hash python benchmarks/replay_cycles.py cycles.jsonl --speed 10 --output replay_report.json
+#   python -m cProfile -s cumtime benchmarks/replay_cycles.py cycles.jsonl --speed 0
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from run_benchmark import create_library, summarize
+from main import build_library
+from src.cycle_recorder import load_recording
+from src.default_config import default_config
+from src.metrics import Metrics
+from src.onedrive_parser import OneDriveOutputParser
+from src.sync_scheduler import SyncJob, SyncScheduler
+from src.utils import Utils
+
+class ReplayCalibreServer:
+
+    # Stand-in for the CalibreServer answering each reconnect after the delay recorded for it.
+
+    def __init__(self, speed):
+
+        # :param speed: Replay speed factor; 0 answers at once.
+
+        self.speed = speed
+        self.reconnects = []  # Recorded [offset, duration, succeeded] of the cycle being replayed, consumed in order
+
+    def reconnect(self):
+
+        # :return: Whether the recorded reconnect succeeded; True for reconnects the recording does not have.
+
+        if not self.reconnects:
+            return True
+        _, duration, succeeded = self.reconnects.pop(0)
+        if self.speed:
+            time.sleep(duration / self.speed)
+        return succeeded
+
+class CycleReplay:
+
+    # Stand-in for OneDriveServer._execute printing the recorded output of one cycle.
+
+    def __init__(self, db_path, speed):
+
+        # :param db_path: The scratch metadata.db modified when the recorded one changed.
+        # :param speed: Replay speed factor; 0 replays without waiting.
+
+        self.db_path = db_path
+        self.speed = speed
+        self.parser = OneDriveOutputParser()
+        self.cycle = None  # The cycle record being replayed
+        self.mutations = 0
+
+    def execute(self, cmd, timeout=None):
+
+        # Yields the recorded output lines at their recorded times, then fails the way onedrive did.
+
+        started = time.monotonic()
+        changed = self.cycle["fingerprint_after"] != self.cycle["fingerprint_before"]
+        for offset, line in self.cycle["output"]:
+            if self.speed:
+                time.sleep(max(started + offset / self.speed - time.monotonic(), 0))
+            event = self.parser.parse(line)
+            if changed and event is not None and event.is_metadata_db and event.action == "download" and not event.failed:
+                # Change the database where onedrive reported downloading it.
+                self.mutate()
+                changed = False
+            yield line
+        if changed:
+            self.mutate()
+        if self.cycle["timed_out"]:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if self.cycle["exit_code"] is None:
+            raise OSError("onedrive did not run in the recorded cycle")
+        if self.cycle["exit_code"] != 0:
+            raise subprocess.CalledProcessError(self.cycle["exit_code"], cmd)
+
+    def mutate(self):
+
+        # Modifies a book like a downloaded metadata.db would, so every change detection strategy sees a change.
+
+        self.mutations += 1
+        connection = sqlite3.connect(self.db_path)
+        try:
+            with connection:
+                connection.execute("UPDATE books SET last_modified = datetime('now', ?) || '+00:00' WHERE id = (SELECT MIN(id) FROM books)",
+                                   (f"+{self.mutations} seconds",))
+        finally:
+            connection.close()
+
+def replay(cycles, args, workdir):
+
+    # Replays the cycles of one library.
+
+    # :param cycles: Cycle records of the library.
+    # :param args: Parsed command line.
+    # :param workdir: Scratch directory for the library and its state files.
+    # :return: The report as a dict.
+
+    library_dir = os.path.join(workdir, "Calibre Library")
+    os.makedirs(library_dir)
+    db_path = os.path.join(library_dir, "metadata.db")
+    if args.db:
+        shutil.copyfile(args.db, db_path)
+    else:
+        create_library(db_path, args.books)
+
+    config = copy.copy(default_config)
+    config.LibraryName = cycles[0]["library"]
+    config.LibrariesPath = ""
+    config.MetadataDBPath = db_path
+    config.StagingMetadataDBPath = ""
+    config.BookIndexPath = os.path.join(workdir, "book_index.db") if config.BookIndexPath else ""
+    # Nothing is persisted, recorded again, uploaded or rendered while replaying.
+    config.StatePath = ""
+    config.CycleRecordPath = ""
+    config.GenerateSyncList = False
+    config.LibraryIndexPath = ""
+    config.ThumbnailCacheDir = ""
+    config.BookChangeWebhookURL = ""
+    config.MetricsSummaryPath = ""
+
+    util = Utils(config)
+    calibre_server = ReplayCalibreServer(args.speed)
+    onedrive_server = build_library(config, util, Metrics(config), calibre_server)
+    cycle_replay = CycleReplay(db_path, args.speed)
+    onedrive_server._execute = cycle_replay.execute
+    scheduler = SyncScheduler(util=util, config=config)
+    job = SyncJob(config.LibraryName, None, config.TimeCheckOneDriveSecond, min_interval=config.SyncMinIntervalSecond,
+                  max_interval=max(config.SyncMaxIntervalSecond, config.TimeCheckOneDriveSecond))
+
+    # Start from an accepted database like the recorded daemon, unless its first cycle reloaded an unchanged
+    # database, which is what a daemon without a previous state does.
+    first = cycles[0]
+    if not (first["result"] and first["fingerprint_before"] == first["fingerprint_after"]):
+        onedrive_server._check_and_reload_calibre()
+    report = []
+    for index, cycle in enumerate(cycles):
+        cycle_replay.cycle = cycle
+        calibre_server.reconnects = list(cycle["reconnects"])
+        started = time.monotonic()
+        result = onedrive_server.call_onedrive(onFinish=lambda: None)
+        gap = None
+        if index + 1 < len(cycles):
+            gap = round(cycles[index + 1]["started"] - cycle["started"] - cycle["duration"], 4)
+        report.append({
+            "started": cycle["started"],
+            "recorded": {"result": cycle["result"], "duration": cycle["duration"], "reconnects": len(cycle["reconnects"]), "next_gap": gap},
+            "replayed": {"result": result, "duration": round(time.monotonic() - started, 4),
+                         "next_delay": round(scheduler._next_delay(job, result), 4)},
+        })
+        if gap and args.speed:
+            time.sleep(max(gap, 0) / args.speed)
+
+    scheduler.stop()
+    if onedrive_server.book_index is not None:
+        onedrive_server.book_index.close()
+    return {
+        "library": config.LibraryName,
+        "cycles": len(report),
+        "recorded_reloads": sum(1 for cycle in cycles if cycle["result"]),
+        "replayed_reloads": sum(1 for entry in report if entry["replayed"]["result"]),
+        "result_mismatches": sum(1 for entry in report if entry["recorded"]["result"] != entry["replayed"]["result"]),
+        "recorded_duration": summarize([entry["recorded"]["duration"] for entry in report]),
+        "replayed_duration": summarize([entry["replayed"]["duration"] for entry in report]),
+        "recorded_gap": summarize([entry["recorded"]["next_gap"] for entry in report if entry["recorded"]["next_gap"] is not None]),
+        "scheduled_delay": summarize([entry["replayed"]["next_delay"] for entry in report[:-1]]),
+        "speed": args.speed,
+        "cycle_details": report,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded sync cycles through the CalibreOneDriveSync pipeline.")
+    parser.add_argument("recording", help="JSON lines file written with CYCLE_RECORD_PATH.")
+    parser.add_argument("--library", help="Library whose cycles are replayed. Defaults to every library, one after the other.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor; 10 is ten times faster, 0 does not wait at all.")
+    parser.add_argument("--db", help="metadata.db to replay against. Defaults to a synthetic library.")
+    parser.add_argument("--books", type=int, default=1000, help="Size of the synthetic library.")
+    parser.add_argument("--output", default="replay_report.json", help="Path of the JSON report.")
+    args = parser.parse_args()
+
+    cycles = load_recording(args.recording, args.library)
+    if not cycles:
+        parser.error(f"No recorded cycles in {args.recording}")
+    libraries = list(dict.fromkeys(cycle["library"] for cycle in cycles))
+
+    reports = []
+    for library in libraries:
+        with tempfile.TemporaryDirectory() as workdir:
+            reports.append(replay([cycle for cycle in cycles if cycle["library"] == library], args, workdir))
+    with open(args.output, "w") as output:
+        json.dump(reports, output, indent=2)
+    for report in reports:
+        print(f"{report['library']}: {report['cycles']} cycles, {report['replayed_reloads']} reloads replayed "
+              f"({report['recorded_reloads']} recorded), {report['result_mismatches']} results differ. Report: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# run_benchmark.py
+
+# End-to-end benchmark of the sync loop. For each library size it builds a synthetic metadata.db, runs
+# main.py with a fake `onedrive` on the PATH and a stub Calibre-Web as CPS_PATH, and measures cycle time,
+# change-to-reconnect latency, CPU time and RSS of the daemon. The results are written as JSON.
+#
+# Usage:
+#   python benchmarks/run_benchmark.py --books 1000,10000,100000 --cycles 5 --output benchmark_report.json
+
+import argparse
+import datetime
+import json
+import os
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+def create_library(db_path, books):
+
+    # Creates a metadata.db with the books and data tables Calibre uses, filled with synthetic books.
+
+    # :param db_path: Path of the database to create.
+    # :param books: Number of books.
+
+    connection = sqlite3.connect(db_path)
+    connection.executescript("""
+        CREATE TABLE books (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL DEFAULT 'Unknown', sort TEXT,
+                            timestamp TIMESTAMP, pubdate TIMESTAMP, series_index REAL NOT NULL DEFAULT 1.0, author_sort TEXT,
+                            isbn TEXT DEFAULT '', lccn TEXT DEFAULT '', path TEXT NOT NULL DEFAULT '', flags INTEGER NOT NULL DEFAULT 1,
+                            uuid TEXT, has_cover BOOL DEFAULT 0, last_modified TIMESTAMP NOT NULL DEFAULT '2000-01-01 00:00:00+00:00');
+        CREATE TABLE data (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, format TEXT NOT NULL COLLATE NOCASE,
+                           uncompressed_size INTEGER NOT NULL, name TEXT NOT NULL, UNIQUE(book, format));
+        CREATE TABLE authors (id INTEGER PRIMARY KEY, name TEXT NOT NULL, sort TEXT, link TEXT NOT NULL DEFAULT '');
+        CREATE TABLE books_authors_link (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, author INTEGER NOT NULL, UNIQUE(book, author));
+    """)
+    modified = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc).isoformat(sep=" ")
+    connection.executemany("INSERT INTO authors (id, name, sort) VALUES (?, ?, ?)",
+                           ((author, f"Author {author}", f"{author}, Author") for author in range(1, 1001)))
+    connection.executemany(
+        "INSERT INTO books (id, title, sort, author_sort, path, uuid, has_cover, last_modified) VALUES (?, ?, ?, ?, ?, ?, 1, ?)",
+        ((book, f"Book {book}", f"Book {book}", f"Author {book % 1000 + 1}", f"Author {book % 1000 + 1}/Book {book} ({book})", f"uuid-{book}", modified)
+         for book in range(1, books + 1)))
+    connection.executemany("INSERT INTO data (book, format, uncompressed_size, name) VALUES (?, 'EPUB', ?, ?)",
+                           ((book, 200000 + book, f"Book {book} - Author {book % 1000 + 1}") for book in range(1, books + 1)))
+    connection.executemany("INSERT INTO books_authors_link (book, author) VALUES (?, ?)",
+                           ((book, book % 1000 + 1) for book in range(1, books + 1)))
+    connection.commit()
+    connection.close()
+
+def write_wrapper(path, script):
+
+    # Writes an executable shell wrapper running a Python script with the current interpreter.
+
+    # :param path: Path of the wrapper.
+    # :param script: Python script to run.
+
+    with open(path, "w") as wrapper:
+        wrapper.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+    os.chmod(path, 0o755)
+
+def free_port():
+
+    # :return: A TCP port that is currently free on localhost.
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def sample_process(pid):
+
+    # Reads CPU time and RSS of a process from /proc.
+
+    # :param pid: Process id.
+    # :return: (cpu seconds, rss bytes), or None if the process is gone.
+
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as status:
+            rss = next((int(line.split()[1]) * 1024 for line in status if line.startswith("VmRSS:")), 0)
+    except OSError:
+        return None
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat; the split above starts at field 3.
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, rss
+
+def read_events(path):
+
+    # :param path: Events file written by the fake onedrive and the stub Calibre-Web.
+    # :return: (mutation times, reconnect times), both sorted.
+
+    mutations, reconnects = [], []
+    if os.path.exists(path):
+        with open(path) as events:
+            for line in events:
+                kind, _, value = line.partition(" ")
+                (mutations if kind == "mutation" else reconnects).append(float(value))
+    return sorted(mutations), sorted(reconnects)
+
+def change_latencies(mutations, reconnects):
+
+    # Pairs every mutation with the first reconnect after it.
+
+    # :return: List of latencies in seconds, one per mutation that was followed by a reconnect.
+
+    latencies = []
+    index = 0
+    for mutation in mutations:
+        while index < len(reconnects) and reconnects[index] < mutation:
+            index += 1
+        if index < len(reconnects):
+            latencies.append(reconnects[index] - mutation)
+    return latencies
+
+def summarize(values):
+
+    # :return: Count, mean, p50, p95 and max of the values, or None if empty.
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 4),
+        "p50": round(ordered[len(ordered) // 2], 4),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+        "max": round(ordered[-1], 4),
+    }
+
+def run_scenario(books, args):
+
+    # Runs main.py against a synthetic library until the requested number of cycles completed.
+
+    # :param books: Number of books in the synthetic library.
+    # :param args: Parsed command line arguments.
+    # :return: Dict with the measurements of this scenario.
+
+    with tempfile.TemporaryDirectory(prefix="calibre-onedrive-bench-") as workdir:
+        library_dir = os.path.join(workdir, "library")
+        bin_dir = os.path.join(workdir, "bin")
+        os.makedirs(library_dir)
+        os.makedirs(bin_dir)
+        db_path = os.path.join(library_dir, "metadata.db")
+
+        started = time.monotonic()
+        create_library(db_path, books)
+        setup_seconds = time.monotonic() - started
+
+        write_wrapper(os.path.join(bin_dir, "onedrive"), os.path.join(BENCHMARK_DIR, "fake_onedrive.py"))
+        cps_path = os.path.join(bin_dir, "cps")
+        write_wrapper(cps_path, os.path.join(BENCHMARK_DIR, "stub_calibre_web.py"))
+
+        events_path = os.path.join(workdir, "events")
+        summary_path = os.path.join(workdir, "cycles.jsonl")
+        env = dict(os.environ)
+        env.update({
+            "PATH": bin_dir + os.pathsep + env.get("PATH", ""),
+            "METADATA_DB_PATH": db_path,
+            "CPS_PATH": cps_path,
+            "PORT_CALIBRE_WEB": str(free_port()),
+            "TIME_CHECK_ONEDRIVE_SECOND": str(args.interval),
+            # A fixed interval keeps the cycles of different runs comparable.
+            "SYNC_MIN_INTERVAL_SECOND": str(args.interval),
+            "SYNC_MAX_INTERVAL_SECOND": str(args.interval),
+            "SYNC_JITTER_RATIO": "0",
+            "ONEDRIVE_MODE": "synchronize",
+            "LOG_PATH": os.path.join(workdir, "sync.log"),
+            "LOG_LEVEL": "INFO",
+            "BOOK_INDEX_PATH": os.path.join(workdir, "book_index.db"),
+            "STATE_PATH": os.path.join(workdir, "sync_state.db"),
+            "METRICS_SUMMARY_PATH": summary_path,
+            "METRICS_PORT": "0",
+            "CLEAR_PORT_ON_START": "False",
+            "FAKE_ONEDRIVE_DB": db_path,
+            "FAKE_ONEDRIVE_EVENTS": events_path,
+            "FAKE_ONEDRIVE_STATE": os.path.join(workdir, "onedrive_runs"),
+            "FAKE_ONEDRIVE_LINES": str(args.lines),
+            "FAKE_ONEDRIVE_EXIT_CODE": str(args.exit_code),
+            "FAKE_ONEDRIVE_MUTATE_EVERY": str(args.mutate_every),
+            "STUB_RECONNECT_LATENCY": str(args.reconnect_latency),
+            "STUB_EVENTS": events_path,
+        })
+        env.update(dict(item.split("=", 1) for item in args.env))
+
+        daemon = subprocess.Popen([sys.executable, "main.py"], cwd=REPO_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        cpu_seconds, max_rss = 0.0, 0
+        deadline = time.monotonic() + args.timeout
+        try:
+            while time.monotonic() < deadline and daemon.poll() is None:
+                sample = sample_process(daemon.pid)
+                if sample:
+                    cpu_seconds, rss = sample
+                    max_rss = max(max_rss, rss)
+                if os.path.exists(summary_path):
+                    with open(summary_path) as summary:
+                        if sum(1 for _ in summary) >= args.cycles:
+                            break
+                time.sleep(0.1)
+        finally:
+            # SIGTERM lets the daemon stop the stub Calibre-Web it started.
+            os.killpg(daemon.pid, signal.SIGTERM)
+            try:
+                daemon.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                os.killpg(daemon.pid, signal.SIGKILL)
+                daemon.wait()
+
+        cycles = []
+        if os.path.exists(summary_path):
+            with open(summary_path) as summary:
+                cycles = [json.loads(line) for line in summary]
+        mutations, reconnects = read_events(events_path)
+        return {
+            "books": books,
+            "setup_seconds": round(setup_seconds, 3),
+            "cycles": len(cycles),
+            "failed_cycles": sum(1 for cycle in cycles if cycle["failed"]),
+            "cycle_seconds": summarize([cycle["duration_seconds"] for cycle in cycles]),
+            "change_to_reconnect_seconds": summarize(change_latencies(mutations, reconnects)),
+            "mutations": len(mutations),
+            "reconnects": len(reconnects),
+            "cpu_seconds": round(cpu_seconds, 3),
+            "max_rss_mb": round(max_rss / (1024 * 1024), 1),
+            "timed_out": len(cycles) < args.cycles,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the CalibreOneDriveSync loop.")
+    parser.add_argument("--books", default="1000,10000,100000", help="Comma-separated library sizes.")
+    parser.add_argument("--cycles", type=int, default=5, help="Sync cycles to measure per library size.")
+    parser.add_argument("--interval", type=int, default=1, help="TIME_CHECK_ONEDRIVE_SECOND for the daemon.")
+    parser.add_argument("--lines", type=int, default=100, help="Lines printed by the fake onedrive per run.")
+    parser.add_argument("--exit-code", type=int, default=0, help="Exit code of the fake onedrive.")
+    parser.add_argument("--mutate-every", type=int, default=1, help="Mutate metadata.db on every Nth run (0 never).")
+    parser.add_argument("--reconnect-latency", type=float, default=0.0, help="Seconds the stub /reconnect takes.")
+    parser.add_argument("--timeout", type=float, default=300, help="Maximum seconds per library size.")
+    parser.add_argument("--env", action="append", default=[], help="Extra NAME=VALUE passed to the daemon, e.g. CHANGE_DETECTION=hash.")
+    parser.add_argument("--output", default="benchmark_report.json", help="Path of the JSON report.")
+    args = parser.parse_args()
+
+    report = {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "parameters": {key: value for key, value in vars(args).items() if key != "output"},
+        "scenarios": [],
+    }
+    for books in (int(size) for size in args.books.split(",")):
+        print(f"Benchmarking {books} books...", flush=True)
+        scenario = run_scenario(books, args)
+        print(json.dumps(scenario), flush=True)
+        report["scenarios"].append(scenario)
+
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
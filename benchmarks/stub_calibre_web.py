@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# stub_calibre_web.py
+
+# Stand-in for Calibre-Web (`cps -r`) used by the benchmark harness. Answers the readiness probe on / and
+# serves /reconnect after a configurable delay, appending "reconnect <time>" to an events file.
+#
+# Environment:
+#   PORT_CALIBRE_WEB          Port to listen on (default 8083).
+#   STUB_RECONNECT_LATENCY    Seconds /reconnect takes to answer (default 0).
+#   STUB_EVENTS               File to which "reconnect <time>" lines are appended.
+
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith("/reconnect"):
+            received = time.time()
+            time.sleep(float(os.environ.get("STUB_RECONNECT_LATENCY", 0)))
+            events_path = os.environ.get("STUB_EVENTS")
+            if events_path:
+                with open(events_path, "a") as events:
+                    events.write(f"reconnect {received}\n")
+            body = b"{}"
+        elif self.path == "/":
+            body = b"ok"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", int(os.environ.get("PORT_CALIBRE_WEB", 8083))), Handler)
+    server.daemon_threads = True
+    server.serve_forever()
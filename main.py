@@ -1,12 +1,30 @@
 # main.py
 
-import sched
+import logging
+import signal
+import sys
+import threading
 import time
 import subprocess
 
 from src.utils import Utils
 from src.calibre_server import CalibreServer
 from src.onedrive_server import OneDriveServer
+from src.onedrive_parser import OneDriveOutputParser
+from src.db_watcher import DBWatcher
+from src.change_detector import ChangeDetector
+from src.book_index import BookIndex, ChangesetLogger, ChangesetWebhook
+from src.settle_gate import SettleGate
+from src.snapshot_publisher import SnapshotPublisher
+from src.state_store import StateStore
+from src.sync_list import SyncListGenerator
+from src.library_index import LibraryIndex
+from src.cycle_recorder import CycleRecorder
+from src.local_push import LocalChangePusher
+from src.thumbnails import CoverThumbnailer
+from src.metrics import Metrics, MetricsServer
+from src.control_server import ControlServer
+from src.sync_scheduler import SyncScheduler
 from src.default_config import default_config
 
 def kill_process_at_port(portnumber):
@@ -17,40 +35,158 @@ def kill_process_at_port(portnumber):
     
     subprocess.call(["fuser", "-k", f"{portnumber}/tcp"])
 
+def build_library(config, util, metrics, calibre_server):
+    
+    # Builds the OneDrive sync pipeline of one library.
+
+    # :param config: Configuration of the library.
+    # :param util: Instance of the Utils class for logging.
+    # :param metrics: The shared Metrics registry.
+    # :param calibre_server: The CalibreServer serving this library.
+    # :return: The OneDriveServer of the library.
+    
+    # The database OneDrive writes to; Calibre-Web reads MetadataDBPath, which differs only when publishing snapshots.
+    synced_db_path = config.StagingMetadataDBPath or config.MetadataDBPath
+    publisher = None
+    if config.StagingMetadataDBPath:
+        publisher = SnapshotPublisher(util=util, config=config)
+    change_detector = None
+    if config.ChangeDetection != "mtime":
+        change_detector = ChangeDetector(util=util, config=config, db_path=synced_db_path)
+    book_index = None
+    if config.BookIndexPath:
+        book_index = BookIndex(util=util, config=config)
+        book_index.add_consumer(ChangesetLogger(util))
+        if config.BookChangeWebhookURL:
+            book_index.add_consumer(ChangesetWebhook(util, config.BookChangeWebhookURL))
+        if config.ThumbnailCacheDir:
+            if not CoverThumbnailer.is_available():
+                util.log("THUMBNAIL_CACHE_DIR is set but Pillow is not installed. Not rendering thumbnails.", logging.WARNING)
+            elif not config.CalibreWebAppDBPath:
+                util.log("THUMBNAIL_CACHE_DIR is set but CALIBRE_WEB_APP_DB_PATH is not. Not rendering thumbnails.", logging.WARNING)
+            else:
+                book_index.add_consumer(CoverThumbnailer(util=util, config=config, db_path=synced_db_path))
+    settle_gate = None
+    if config.SettleWindowSecond > 0 or config.SettleQuickCheck:
+        settle_gate = SettleGate(util=util, config=config, db_path=synced_db_path)
+    state_store = None
+    if config.StatePath:
+        state_store = StateStore(util=util, config=config)
+    sync_list = None
+    if config.GenerateSyncList:
+        sync_list = SyncListGenerator(util=util, config=config, db_path=synced_db_path)
+    library_index = None
+    if config.LibraryIndexPath:
+        library_index = LibraryIndex(util=util, config=config, db_path=synced_db_path)
+    recorder = None
+    if config.CycleRecordPath:
+        recorder = CycleRecorder(util=util, config=config)
+    return OneDriveServer(util=util, config=config, calibre_server=calibre_server,
+                          change_detector=change_detector, book_index=book_index,
+                          settle_gate=settle_gate, publisher=publisher, metrics=metrics,
+                          parser=OneDriveOutputParser(history=config.OneDriveOutputHistory), state_store=state_store,
+                          sync_list=sync_list, library_index=library_index, recorder=recorder)
+
 def main():
     
     # Entry point of the application. Initializes components and starts the synchronization scheduler.
     
-    print(f"Start, clearing process at port {default_config.PortCalibreWeb}")
-    kill_process_at_port(default_config.PortCalibreWeb)
+    libraries = default_config.libraries()
+    ports = sorted({library.PortCalibreWeb for library in libraries})
+    if default_config.ClearPortOnStart:
+        for port in ports:
+            print(f"Start, clearing process at port {port}")
+            kill_process_at_port(port)
     
     # Initialize utility, Calibre server, and OneDrive server instances.
     my_utils = Utils(default_config)
-    my_calibre_server = CalibreServer(util=my_utils, config=default_config)
-    my_onedrive_server = OneDriveServer(util=my_utils, config=default_config, calibre_server=my_calibre_server)
-    my_calibre_server.start_server()
-    
-    def scheduled_task(schedule):
-        #Task scheduled to run at regular intervals. Handles OneDrive synchronization and checks for updates in the Calibre metadata database.
+    my_utils.open_log()
+    my_metrics = Metrics(default_config)
+    my_metrics.describe("log_messages_dropped_total", "counter", "Log messages dropped because the log queue was full.")
+    my_metrics.add_collector(lambda metrics: metrics.set("log_messages_dropped_total", my_utils.queue_handler.dropped_total if my_utils.queue_handler else 0))
+    if default_config.MetricsPort:
+        MetricsServer(util=my_utils, config=default_config, metrics=my_metrics).start()
 
-        #:param schedule: The scheduler instance managing task timings.
+    # Libraries served on the same port share one Calibre-Web process.
+    my_calibre_servers = {}
+    for library in libraries:
+        if library.PortCalibreWeb not in my_calibre_servers:
+            my_calibre_servers[library.PortCalibreWeb] = CalibreServer(util=my_utils, config=library, metrics=my_metrics)
+    my_onedrive_servers = []
+    for library in libraries:
+        library_utils = my_utils.for_library(library.LibraryName) if len(libraries) > 1 else my_utils
+        my_onedrive_servers.append(build_library(library, library_utils, my_metrics, my_calibre_servers[library.PortCalibreWeb]))
+
+    for my_calibre_server in my_calibre_servers.values():
+        my_calibre_server.start_server()
+        if default_config.CalibreHealthCheckSecond > 0:
+            my_calibre_server.supervise()
+
+    my_scheduler = SyncScheduler(util=my_utils, config=default_config)
+    my_control_server = None
+    if default_config.ControlPort:
+        my_control_server = ControlServer(util=my_utils, config=default_config, scheduler=my_scheduler,
+                                          onedrive_servers={library.LibraryName: server for library, server in zip(libraries, my_onedrive_servers)})
+
+    def shutdown(signum, frame):
         
-        def schedule_next_process():
-            
-            # Schedules the next execution of the scheduled_task after a specified interval.
-            
-            my_utils.close_log()
-            schedule.enter(default_config.TimeCheckOneDriveSecond, 1, scheduled_task, (schedule,))
-    
-        if default_config.Log:
-            my_utils.open_log()
-    
-        my_onedrive_server.call_onedrive(onFinish=schedule_next_process)
-    
-    # Start the scheduler
-    my_scheduler = sched.scheduler(time.time, time.sleep)
-    # Schedule the first execution of the scheduled_task
-    my_scheduler.enter(default_config.TimeCheckOneDriveSecond, 1, scheduled_task, (my_scheduler,))
+        # Stops the sync jobs and OneDrive monitors and shuts Calibre-Web down gracefully on SIGTERM/SIGINT.
+        
+        my_utils.log(f"Received signal {signum}, shutting down...")
+        if my_control_server is not None:
+            my_control_server.stop()
+        for my_onedrive_server in my_onedrive_servers:
+            my_onedrive_server.stop()
+            if my_onedrive_server.book_index is not None:
+                my_onedrive_server.book_index.close()
+        my_scheduler.stop(wait=False)
+        for my_calibre_server in my_calibre_servers.values():
+            my_calibre_server.shutdown()
+        my_utils.close_log()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for library, my_onedrive_server in zip(libraries, my_onedrive_servers):
+        # In inotify mode, reload Calibre-Web as soon as metadata.db settles instead of waiting for the next sync cycle.
+        if library.WatchMode == "inotify":
+            my_watcher = DBWatcher(util=my_onedrive_server.util, config=library, on_change=my_onedrive_server._check_and_reload_calibre,
+                                   db_path=my_onedrive_server.db_path)
+            if not my_watcher.start():
+                my_onedrive_server.util.log("Falling back to checking metadata.db after each sync.", logging.WARNING)
+
+        if library.OneDriveMode == "monitor":
+            # A long-running `onedrive --monitor` process replaces the periodic sync of this library.
+            if library.PushLocalChanges:
+                my_onedrive_server.util.log("onedrive --monitor uploads local changes itself. Ignoring PUSH_LOCAL_CHANGES.", logging.WARNING)
+            threading.Thread(target=my_onedrive_server.run_monitor, name=f"monitor-{library.LibraryName}", daemon=True).start()
+        else:
+            # Resume the schedule of the previous run rather than waiting a full interval after every restart.
+            delay = library.TimeCheckOneDriveSecond
+            if my_onedrive_server.state_store is not None:
+                last_sync_time = my_onedrive_server.state_store.get("last_sync_time")
+                if last_sync_time is not None:
+                    delay = min(max(last_sync_time + delay - time.time(), 0), delay)
+            # Each library is synced on its own adaptive schedule; the scheduler runs them on a bounded pool.
+            my_scheduler.add_job(library.LibraryName, lambda server=my_onedrive_server: server.call_onedrive(onFinish=lambda: None),
+                                 library.TimeCheckOneDriveSecond, delay=delay, min_interval=library.SyncMinIntervalSecond,
+                                 max_interval=max(library.SyncMaxIntervalSecond, library.TimeCheckOneDriveSecond))
+
+            # Edits made through Calibre-Web are pushed as soon as they are seen instead of waiting for the next sync.
+            if library.PushLocalChanges:
+                if library.StagingMetadataDBPath or my_onedrive_server.change_detector is None:
+                    my_onedrive_server.util.log("Pushing local changes needs CHANGE_DETECTION other than 'mtime' and no STAGING_METADATA_DB_PATH. Not pushing.", logging.WARNING)
+                elif library.WatchMode == "inotify":
+                    # The watcher would accept local edits as changes to reload before the pusher sees them.
+                    my_onedrive_server.util.log("Pushing local changes does not work with WATCH_MODE=inotify. Not pushing.", logging.WARNING)
+                else:
+                    my_pusher = LocalChangePusher(util=my_onedrive_server.util, config=library, onedrive_server=my_onedrive_server,
+                                                  change_detector=my_onedrive_server.change_detector, book_index=my_onedrive_server.book_index)
+                    my_scheduler.add_job(f"{library.LibraryName}-push", my_pusher.push, library.PushCheckSecond)
+
+    if my_control_server is not None:
+        my_control_server.start()
     my_scheduler.run()
 
 if __name__ == "__main__":
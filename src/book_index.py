@@ -0,0 +1,227 @@
+# book_index.py
+
+import logging
+import sqlite3
+import urllib.parse
+
+import requests
+
+class Changeset:
+
+    # Books added, removed and modified between two snapshots of metadata.db.
+
+
+    def __init__(self, added, removed, modified, paths):
+
+        # Initializes the Changeset instance.
+
+        # :param added: Ids of books that are new.
+        # :param removed: Ids of books that no longer exist.
+        # :param modified: Ids of books whose last_modified, path or formats changed.
+        # :param paths: Mapping of every id above to its library-relative book folder.
+
+        self.added = added
+        self.removed = removed
+        self.modified = modified
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.modified)
+
+    def __repr__(self):
+        return f"Changeset(added={len(self.added)}, removed={len(self.removed)}, modified={len(self.modified)})"
+
+class BookIndex:
+
+    # Keeps a snapshot of (book id, last_modified, path, formats) in a small SQLite file and diffs it against
+    # metadata.db, so that downstream work is proportional to the number of changed books rather than the
+    # size of the library. The diff runs inside SQLite, so memory stays flat regardless of library size.
+
+
+    def __init__(self, util, config, db_path=None, index_path=None):
+
+        # Initializes the BookIndex instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param db_path: Path to the metadata.db to index. Defaults to config.MetadataDBPath.
+        # :param index_path: Path of the snapshot file. Defaults to config.BookIndexPath.
+
+        self.util = util
+        self.config = config
+        self.db_path = db_path or config.MetadataDBPath
+        self.index_path = index_path or config.BookIndexPath
+        self.consumers = []
+
+    def add_consumer(self, consumer):
+
+        # Registers a callable that receives every non-empty Changeset.
+
+        # :param consumer: Callable taking a Changeset.
+
+        self.consumers.append(consumer)
+
+    def close(self):
+
+        # Shuts down consumers that work in the background, such as the CoverThumbnailer.
+
+        for consumer in self.consumers:
+            shutdown = getattr(consumer, "shutdown", None)
+            if shutdown is not None:
+                shutdown()
+
+    def refresh(self):
+
+        # Diffs metadata.db against the stored snapshot, updates the snapshot and dispatches the changes.
+        # The first refresh only records a baseline.
+
+        # :return: The Changeset, or None if metadata.db could not be read or no baseline existed yet.
+
+        try:
+            changeset, baseline_size = self._update_snapshot()
+        except sqlite3.Error as e:
+            self.util.log(f"Error updating book index from {self.db_path}: {e}", logging.ERROR)
+            return None
+
+        if changeset is None:
+            self.util.log(f"Book index initialized with {baseline_size} books.")
+            return None
+
+        if len(changeset):
+            self._dispatch(changeset)
+        return changeset
+
+    def diff(self):
+
+        # Diffs metadata.db against the stored snapshot without updating it or dispatching anything, e.g. to
+        # find the books to upload before the change is recorded by refresh().
+
+        # :return: The Changeset, or None if metadata.db could not be read or no baseline exists yet.
+
+        try:
+            changeset, _ = self._update_snapshot(apply=False)
+        except sqlite3.Error as e:
+            self.util.log(f"Error reading book index changes from {self.db_path}: {e}", logging.ERROR)
+            return None
+        return changeset
+
+    def _update_snapshot(self, apply=True):
+
+        # Computes the diff between metadata.db and the snapshot and applies it to the snapshot.
+
+        # :param apply: Whether to apply the diff. Without it the snapshot is left as it is.
+        # :return: A tuple (Changeset or None if there was no baseline, number of books in the snapshot).
+
+        connection = sqlite3.connect(_sqlite_uri(self.index_path), uri=True)
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS book_snapshot (id INTEGER PRIMARY KEY, last_modified TEXT, path TEXT, formats TEXT)")
+            connection.execute("CREATE TABLE IF NOT EXISTS book_snapshot_meta (key TEXT PRIMARY KEY, value TEXT)")
+            has_baseline = connection.execute("SELECT 1 FROM book_snapshot_meta WHERE key = 'initialized'").fetchone() is not None
+
+            connection.execute("ATTACH DATABASE ? AS library", (_sqlite_uri(self.db_path, read_only=True),))
+            connection.execute("DROP TABLE IF EXISTS temp.current_books")
+            connection.execute("""
+                CREATE TEMP TABLE current_books AS
+                SELECT b.id AS id, b.last_modified AS last_modified, b.path AS path,
+                       (SELECT group_concat(format, ',') FROM (SELECT format FROM library.data WHERE book = b.id ORDER BY format)) AS formats
+                FROM library.books b
+            """)
+            connection.execute("DETACH DATABASE library")
+
+            changeset = None
+            if has_baseline:
+                added, removed, modified, paths = [], [], [], {}
+                for book_id, path in connection.execute("SELECT c.id, c.path FROM temp.current_books c LEFT JOIN book_snapshot s ON s.id = c.id WHERE s.id IS NULL"):
+                    added.append(book_id)
+                    paths[book_id] = path
+                for book_id, path in connection.execute("SELECT s.id, s.path FROM book_snapshot s LEFT JOIN temp.current_books c ON c.id = s.id WHERE c.id IS NULL"):
+                    removed.append(book_id)
+                    paths[book_id] = path
+                for book_id, path in connection.execute("""
+                    SELECT c.id, c.path FROM temp.current_books c JOIN book_snapshot s ON s.id = c.id
+                    WHERE s.last_modified IS NOT c.last_modified OR s.path IS NOT c.path OR s.formats IS NOT c.formats
+                """):
+                    modified.append(book_id)
+                    paths[book_id] = path
+                changeset = Changeset(added, removed, modified, paths)
+            if not apply:
+                return changeset, None
+
+            # Apply only the differences, so a refresh touches as few rows as changed.
+            with connection:
+                connection.execute("DELETE FROM book_snapshot WHERE id NOT IN (SELECT id FROM temp.current_books)")
+                connection.execute("""
+                    INSERT OR REPLACE INTO book_snapshot (id, last_modified, path, formats)
+                    SELECT c.id, c.last_modified, c.path, c.formats FROM temp.current_books c LEFT JOIN book_snapshot s ON s.id = c.id
+                    WHERE s.id IS NULL OR s.last_modified IS NOT c.last_modified OR s.path IS NOT c.path OR s.formats IS NOT c.formats
+                """)
+                connection.execute("INSERT OR REPLACE INTO book_snapshot_meta (key, value) VALUES ('initialized', '1')")
+            size = connection.execute("SELECT COUNT(*) FROM book_snapshot").fetchone()[0]
+            return changeset, size
+        finally:
+            connection.close()
+
+    def _dispatch(self, changeset):
+
+        # Hands the changeset to every consumer. A failing consumer does not prevent the others from running.
+
+        # :param changeset: The Changeset to dispatch.
+
+        for consumer in self.consumers:
+            try:
+                consumer(changeset)
+            except Exception as e:
+                self.util.log(f"Book change consumer {getattr(consumer, '__name__', consumer)} failed: {e}", logging.ERROR)
+
+class ChangesetLogger:
+
+    # Book change consumer that logs a summary of each changeset.
+
+
+    def __init__(self, util):
+
+        # :param util: Instance of the Utils class for logging.
+
+        self.util = util
+
+    def __call__(self, changeset):
+        self.util.log(f"Books changed: {len(changeset.added)} added, {len(changeset.removed)} removed, {len(changeset.modified)} modified.")
+
+class ChangesetWebhook:
+
+    # Book change consumer that POSTs each changeset as JSON to a URL.
+
+
+    def __init__(self, util, url, timeout=10):
+
+        # :param util: Instance of the Utils class for logging.
+        # :param url: URL receiving the changesets.
+        # :param timeout: Request timeout in seconds.
+
+        self.util = util
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, changeset):
+        payload = {
+            "added": changeset.added,
+            "removed": changeset.removed,
+            "modified": changeset.modified,
+            "paths": {str(book_id): path for book_id, path in changeset.paths.items()},
+        }
+        response = requests.post(self.url, json=payload, timeout=self.timeout)
+        if response.status_code >= 400:
+            self.util.log(f"Book change webhook returned status code {response.status_code}")
+
+def _sqlite_uri(path, read_only=False):
+
+    # Builds an SQLite URI for a file path (or ':memory:').
+
+    # :param path: File path.
+    # :param read_only: Whether to open the file read-only.
+    # :return: The URI string.
+
+    if path == ":memory:":
+        return "file::memory:"
+    uri = f"file:{urllib.parse.quote(path)}"
+    return uri + "?mode=ro" if read_only else uri
@@ -1,45 +1,267 @@
 # calibre_server.py
 
+import logging
+import random
 import subprocess
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 
 class CalibreServer:
     
     # Manages operations related to the Calibre server, including starting the server and reconnecting.
     
 
-    def __init__(self, util, config):
+    def __init__(self, util, config, metrics=None):
         
         # Initializes the CalibreServer instance.
 
         # :param util: Instance of the Utils class for logging.
         # :param config: Configuration object containing settings.
+        # :param metrics: Optional Metrics registry recording reconnects and the state of the cps process.
         
         self.util = util
         self.config = config
+        self.metrics = metrics
+        self.base_url = f"http://localhost:{self.config.PortCalibreWeb}"
+        self.timeout = (self.config.HTTPConnectTimeoutSecond, self.config.HTTPReadTimeoutSecond)
+        # One pooled session keeps the connection to Calibre-Web alive between requests.
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=self.config.HTTPPoolSize))
+        self.process = None  # Handle of the cps child process
+        self.started_at = None  # Time (seconds since the epoch) the current cps process was started
+        self.time_to_ready = None  # Seconds the current cps process took to answer its first probe
+        self.restart_count = 0  # Number of times cps was restarted by the supervisor
+        self.failed_probes = 0  # Consecutive failed health probes
+        self._supervisor_stop = threading.Event()
+        self._supervisor_thread = None
+        # Several libraries run one Calibre-Web each, told apart by their port.
+        self.metric_labels = {"port": str(self.config.PortCalibreWeb)}
+        if self.metrics is not None:
+            self.metrics.describe("calibre_reconnect_duration_seconds", "histogram", "Duration of reconnect requests to Calibre-Web, including retries.")
+            self.metrics.describe("calibre_reconnect_failures_total", "counter", "Reconnect requests to Calibre-Web that failed.")
+            self.metrics.describe("calibre_up", "gauge", "Whether the cps process is running.")
+            self.metrics.describe("calibre_start_time_seconds", "gauge", "Start time of the cps process in seconds since the epoch.")
+            self.metrics.describe("calibre_time_to_ready_seconds", "gauge", "Seconds the cps process took to answer its first probe.")
+            self.metrics.describe("calibre_restarts_total", "counter", "Restarts of the cps process by the supervisor.")
+            self.metrics.describe("calibre_rss_bytes", "gauge", "Resident memory of the cps process.")
+            self.metrics.add_collector(self.collect_metrics)
 
     def start_server(self):
         
-        # Starts the Calibre server using the provided CPS path.
+        # Starts the Calibre server using the provided CPS path and waits until it answers HTTP requests.
+
+        # :return: True if the server started and became ready, False otherwise.
         
         self.util.log("Starting Calibre server...")
+        started = time.monotonic()
         try:
             # Start the Calibre server subprocess.
-            subprocess.Popen([self.config.CPSPath, "-r"])
+            self.process = subprocess.Popen([self.config.CPSPath, "-r"])
+            self.started_at = time.time()
+            self.time_to_ready = None
+            self.failed_probes = 0
             self.util.log("Calibre server started.")
         except Exception as e:
-            self.util.log(f"Failed to start Calibre server: {e}")
+            self.util.log(f"Failed to start Calibre server: {e}", logging.ERROR)
+            return False
+
+        if not self.wait_until_ready(self.config.ReadyTimeoutSecond):
+            self.util.log(f"Calibre server did not become ready within {self.config.ReadyTimeoutSecond} seconds.", logging.WARNING)
+            return False
+        self.time_to_ready = time.monotonic() - started
+        self.util.log("Calibre server is ready.")
+        return True
+
+    def stop_server(self):
+        
+        # Stops the cps process gracefully with SIGTERM, killing it if it does not exit in time.
+        
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        self.util.log("Stopping Calibre server...")
+        process.terminate()
+        try:
+            process.wait(timeout=self.config.CalibreStopTimeoutSecond)
+        except subprocess.TimeoutExpired:
+            self.util.log("Calibre server did not stop in time. Killing it.", logging.WARNING)
+            process.kill()
+            process.wait()
+        self.util.log("Calibre server stopped.")
+
+    def restart_server(self, reason):
+        
+        # Restarts the cps process.
+
+        # :param reason: Why the server is restarted, for the log.
+        # :return: True if the restarted server became ready, False otherwise.
+        
+        self.util.log(f"Restarting Calibre server: {reason}", logging.WARNING)
+        self.restart_count += 1
+        self.stop_server()
+        return self.start_server()
+
+    def check_health(self):
+        
+        # Checks that the cps process is alive, answers probes in time and stays within its memory limit.
+
+        # :return: None if healthy, otherwise a description of the problem.
+        
+        if self.process is None:
+            return "not running"
+        returncode = self.process.poll()
+        if returncode is not None:
+            return f"process exited with code {returncode}"
+
+        rss_mb = self.rss_bytes() / (1024 * 1024)
+        if self.config.CalibreMaxRSSMB and rss_mb > self.config.CalibreMaxRSSMB:
+            return f"memory usage {rss_mb:.0f} MB exceeds {self.config.CalibreMaxRSSMB} MB"
+
+        started = time.monotonic()
+        ready = self.is_ready()
+        latency = time.monotonic() - started
+        if ready and latency <= self.config.CalibreMaxLatencySecond:
+            self.failed_probes = 0
+            return None
+        self.failed_probes += 1
+        if self.failed_probes >= self.config.CalibreMaxFailedProbes:
+            if ready:
+                return f"probe took {latency:.1f} seconds {self.failed_probes} times in a row"
+            return f"no answer to {self.failed_probes} probes in a row"
+        return None
+
+    def rss_bytes(self):
+        
+        # Reads the resident memory of the cps process from /proc.
+
+        # :return: Resident set size in bytes, or 0 if it cannot be determined.
+        
+        if self.process is None:
+            return 0
+        try:
+            with open(f"/proc/{self.process.pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        return 0
+
+    def supervise(self):
+        
+        # Starts a background thread that checks the cps process every CalibreHealthCheckSecond and restarts it when unhealthy.
+        
+        if self._supervisor_thread is not None:
+            return
+        self._supervisor_stop.clear()
+        self._supervisor_thread = threading.Thread(target=self._supervise_loop, name="calibre-supervisor", daemon=True)
+        self._supervisor_thread.start()
+
+    def shutdown(self):
+        
+        # Stops supervising and shuts the cps process down gracefully.
+        
+        self._supervisor_stop.set()
+        if self._supervisor_thread is not None and self._supervisor_thread is not threading.current_thread():
+            self._supervisor_thread.join()
+        self._supervisor_thread = None
+        self.stop_server()
+
+    def _supervise_loop(self):
+        
+        # Periodically checks the health of the cps process and restarts it on failure.
+        
+        while not self._supervisor_stop.wait(self.config.CalibreHealthCheckSecond):
+            reason = self.check_health()
+            if reason is not None and not self._supervisor_stop.is_set():
+                self.restart_server(reason)
 
     def reconnect(self):
         
         # Sends a request to the Calibre server to reconnect, typically after database changes.
+
+        # :return: True if the server confirmed the reconnect, False otherwise.
         
+        started = time.monotonic()
         try:
             self.util.log("Attempting to reconnect Calibre server...")
-            response = requests.get(f"http://localhost:{self.config.PortCalibreWeb}/reconnect")
+            response = self._get("/reconnect")
             if response.status_code == 200:
                 self.util.log("Calibre server reconnected successfully.")
-            else:
-                self.util.log(f"Failed to reconnect. Status code: {response.status_code}")
+                return True
+            self.util.log(f"Failed to reconnect. Status code: {response.status_code}", logging.ERROR)
         except Exception as e:
-            self.util.log(f"Error during reconnection: {str(e)}")
+            self.util.log(f"Error during reconnection: {str(e)}", logging.ERROR)
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe("calibre_reconnect_duration_seconds", time.monotonic() - started, labels=self.metric_labels)
+        if self.metrics is not None:
+            self.metrics.inc("calibre_reconnect_failures_total", labels=self.metric_labels)
+        return False
+
+    def collect_metrics(self, metrics):
+        
+        # Updates the gauges describing the cps process. Called right before metrics are rendered.
+
+        # :param metrics: The Metrics registry to update.
+        
+        running = self.process is not None and self.process.poll() is None
+        metrics.set("calibre_up", 1 if running else 0, labels=self.metric_labels)
+        metrics.set("calibre_restarts_total", self.restart_count, labels=self.metric_labels)
+        metrics.set("calibre_rss_bytes", self.rss_bytes() if running else 0, labels=self.metric_labels)
+        if self.started_at is not None:
+            metrics.set("calibre_start_time_seconds", self.started_at, labels=self.metric_labels)
+        if self.time_to_ready is not None:
+            metrics.set("calibre_time_to_ready_seconds", self.time_to_ready, labels=self.metric_labels)
+
+    def is_ready(self):
+        
+        # Probes the Calibre server once with a short timeout.
+
+        # :return: True if the server answered without a server error, False otherwise.
+        
+        try:
+            response = self.session.get(f"{self.base_url}/", timeout=self.config.HTTPConnectTimeoutSecond, allow_redirects=False)
+        except requests.RequestException:
+            return False
+        return response.status_code < 500
+
+    def wait_until_ready(self, timeout):
+        
+        # Probes the Calibre server until it is ready or the timeout passes.
+
+        # :param timeout: Maximum time in seconds to wait.
+        # :return: True if the server became ready, False otherwise.
+        
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.is_ready():
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.config.ReadyPollSecond)
+
+    def _get(self, path):
+        
+        # Sends a GET request to the Calibre server, retrying connection errors, timeouts and server errors
+        # with jittered exponential backoff.
+
+        # :param path: URL path on the Calibre server.
+        # :return: The last response received.
+        # :raises requests.RequestException: If the last attempt failed without a response.
+        
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.config.HTTPRetries + 1):
+            last_attempt = attempt == self.config.HTTPRetries
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code < 500 or last_attempt:
+                    return response
+            except requests.RequestException:
+                if last_attempt:
+                    raise
+            backoff = min(self.config.HTTPBackoffSecond * 2 ** attempt, self.config.HTTPBackoffMaxSecond)
+            time.sleep(random.uniform(backoff / 2, backoff))
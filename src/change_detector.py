@@ -0,0 +1,184 @@
+# change_detector.py
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+# Tables whose content is visible in Calibre-Web. Changes elsewhere (e.g. preferences) do not need a reload.
+DEFAULT_TABLES = (
+    "books", "data", "authors", "books_authors_link", "tags", "books_tags_link",
+    "series", "books_series_link", "publishers", "books_publishers_link",
+    "ratings", "books_ratings_link", "languages", "books_languages_link",
+    "comments", "identifiers", "custom_columns",
+)
+
+class ChangeDetector:
+
+    # Decides whether the content of metadata.db changed, so that file touches, re-downloads of identical
+    # data and WAL checkpoints do not force Calibre-Web to reload.
+    #
+    # Strategies (config.ChangeDetection):
+    #   'content' - row counts and maximum row ids per table plus MAX(books.last_modified).
+    #   'hash'    - a hash over every row of the tables that matter.
+    # Both strategies skip opening the database when size, mtime and inode of the DB and its WAL are unchanged.
+
+
+    def __init__(self, util, config, db_path=None):
+
+        # Initializes the ChangeDetector instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param db_path: Path to the metadata.db to inspect. Defaults to config.MetadataDBPath.
+
+        self.util = util
+        self.config = config
+        self.db_path = db_path or config.MetadataDBPath
+        self.strategy = config.ChangeDetection
+        self.tables = tuple(t.strip() for t in config.ChangeDetectionTables.split(",") if t.strip()) or DEFAULT_TABLES
+        self.last_stat = None  # Stat signature of the last accepted state
+        self.last_fingerprint = None  # Content fingerprint of the last accepted state
+        self._pending = None  # (stat, fingerprint) observed by has_changed() and not yet accepted
+        self._lock = threading.Lock()  # Guards the accepted state and _pending, used by the sync, watcher and push threads
+
+    def has_changed(self):
+
+        # Checks whether the library content changed since the last accepted state.
+        # A detected change is only remembered once accept() is called, so a failed reload is retried.
+
+        # :return: True if the content changed (or on the first check), False if not, None if the database could not be read.
+
+        stat = self.stat_signature()
+        if stat is None:
+            return None
+
+        # Fast path: nothing on disk moved, so the content cannot have changed.
+        if stat == self.last_stat:
+            return False
+
+        fingerprint = self.fingerprint()
+        if fingerprint is None:
+            return None
+
+        with self._lock:
+            if fingerprint == self.last_fingerprint:
+                # Only the file changed (touch, identical re-download, checkpoint); remember it for the fast path.
+                self.last_stat = stat
+                return False
+
+            self._pending = (stat, fingerprint)
+            return True
+
+    def accept(self):
+
+        # Records the state seen by the last has_changed() call as handled.
+
+        with self._lock:
+            if self._pending is not None:
+                self.last_stat, self.last_fingerprint = self._pending
+                self._pending = None
+
+    def state(self):
+
+        # :return: The last accepted state as a JSON-serializable dict, for StateStore.
+
+        return {"strategy": self.strategy, "tables": list(self.tables), "stat": self.last_stat, "fingerprint": self.last_fingerprint}
+
+    def restore(self, state):
+
+        # Restores an accepted state saved by state(), e.g. by a previous run of the daemon. A state computed
+        # with another strategy or other tables is ignored, since its fingerprint is not comparable.
+
+        # :param state: Dict returned by state(), after a JSON round trip.
+        # :return: True if the state was restored, False if it was ignored.
+
+        if not state or state.get("strategy") != self.strategy or tuple(state.get("tables") or ()) != self.tables:
+            return False
+        self.last_stat = _to_tuple(state.get("stat"))
+        self.last_fingerprint = _to_tuple(state.get("fingerprint"))
+        return True
+
+    def stat_signature(self):
+
+        # Builds a signature from size, mtime and inode of metadata.db and its -wal file.
+
+        # :return: A tuple describing the files on disk, or None if metadata.db cannot be stat'ed.
+
+        try:
+            db_stat = os.stat(self.db_path)
+        except OSError as e:
+            self.util.log(f"Error reading {self.db_path}: {e}", logging.ERROR)
+            return None
+        try:
+            wal_stat = os.stat(self.db_path + "-wal")
+            wal = (wal_stat.st_size, wal_stat.st_mtime_ns, wal_stat.st_ino)
+        except OSError:
+            wal = None
+        return (db_stat.st_size, db_stat.st_mtime_ns, db_stat.st_ino, wal)
+
+    def fingerprint(self):
+
+        # Opens metadata.db read-only and computes a fingerprint of its content using the configured strategy.
+
+        # :return: The fingerprint, or None if the database could not be read.
+
+        try:
+            connection = sqlite3.connect(f"file:{urllib.parse.quote(self.db_path)}?mode=ro", uri=True)
+        except sqlite3.Error as e:
+            self.util.log(f"Error opening {self.db_path}: {e}", logging.ERROR)
+            return None
+        try:
+            existing = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            tables = [t for t in self.tables if t in existing]
+            if self.strategy == "hash":
+                return self._hash_fingerprint(connection, tables)
+            return self._content_fingerprint(connection, tables)
+        except sqlite3.Error as e:
+            self.util.log(f"Error reading {self.db_path}: {e}", logging.ERROR)
+            return None
+        finally:
+            connection.close()
+
+    def _content_fingerprint(self, connection, tables):
+
+        # Summarizes each table by its row count and highest rowid, plus the latest book modification.
+
+        # :param connection: Read-only connection to metadata.db.
+        # :param tables: Names of the tables to include.
+        # :return: A tuple of per-table summaries.
+
+        summary = []
+        for table in tables:
+            summary.append((table,) + tuple(connection.execute(f'SELECT COUNT(*), MAX(rowid) FROM "{table}"').fetchone()))
+        if "books" in tables:
+            summary.append(connection.execute("SELECT MAX(last_modified) FROM books").fetchone())
+        return tuple(summary)
+
+    def _hash_fingerprint(self, connection, tables):
+
+        # Hashes every row of the given tables.
+
+        # :param connection: Read-only connection to metadata.db.
+        # :param tables: Names of the tables to include.
+        # :return: The hex digest of all rows.
+
+        digest = hashlib.blake2b(digest_size=16)
+        for table in tables:
+            digest.update(table.encode())
+            for row in connection.execute(f'SELECT * FROM "{table}" ORDER BY rowid'):
+                digest.update(repr(row).encode())
+        return digest.hexdigest()
+
+def _to_tuple(value):
+
+    # Turns the lists of a JSON-decoded value back into the tuples the signatures are built from.
+
+    # :param value: A JSON-decoded value.
+    # :return: The value with every list converted to a tuple.
+
+    if isinstance(value, list):
+        return tuple(_to_tuple(item) for item in value)
+    return value
@@ -0,0 +1,126 @@
+# control_server.py
+
+import json
+import logging
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class ControlServer:
+    
+    # Local HTTP endpoint for driving the daemon from scripts, webhooks or Calibre-Web hooks:
+    #   GET  /status                   Phase of each library, last durations, results and errors, queue depth.
+    #   POST /sync-now[?library=name]  Sync now; coalesced with a sync already running or waiting.
+    #   POST /reload-now[?library=name] Reconnect Calibre-Web now, whether or not metadata.db changed; null when
+    #                                  queued behind a running check or deferred until metadata.db settles.
+    #   POST /pause, POST /resume      Stop and restart the scheduled syncs.
+    # Without ?library= a command applies to every library. Responses are JSON.
+    
+
+    def __init__(self, util, config, scheduler, onedrive_servers):
+        
+        # Initializes the ControlServer instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param scheduler: The SyncScheduler running the sync jobs, named after the libraries.
+        # :param onedrive_servers: Dict of library name to its OneDriveServer.
+        
+        self.util = util
+        self.config = config
+        self.scheduler = scheduler
+        self.onedrive_servers = onedrive_servers
+        self.server = None
+        self._thread = None
+
+    def handle(self, method, command, library=None):
+        
+        # Executes one command.
+
+        # :param method: HTTP method, "GET" or "POST".
+        # :param command: The command, e.g. "status" or "sync-now".
+        # :param library: Optional name of the library the command applies to.
+        # :return: A tuple (HTTP status code, JSON-serializable response).
+        
+        if library is not None and library not in self.onedrive_servers:
+            return 404, {"error": f"Unknown library {library!r}"}
+        libraries = [library] if library is not None else list(self.onedrive_servers)
+
+        if method == "GET" and command == "status":
+            status = self.scheduler.status()
+            status["libraries"] = {}
+            for name in libraries:
+                status["libraries"][name] = dict(self.onedrive_servers[name].status(), job=status["jobs"].get(name))
+            del status["jobs"]
+            return 200, status
+
+        if method != "POST":
+            return 405, {"error": f"Use POST for {command}"}
+        if command == "sync-now":
+            triggered = [name for name in libraries if self.scheduler.trigger(name)]
+            self.util.log(f"Sync requested for {', '.join(triggered) or 'no scheduled library'}.")
+            return 202, {"triggered": triggered, "paused": self.scheduler.paused}
+        if command == "reload-now":
+            return 200, {"reloaded": {name: self.onedrive_servers[name].reload_now() for name in libraries}}
+        if command == "pause":
+            self.scheduler.pause()
+            self.util.log("Scheduled syncs paused.")
+            return 200, {"paused": True}
+        if command == "resume":
+            self.scheduler.resume()
+            self.util.log("Scheduled syncs resumed.")
+            return 200, {"paused": False}
+        return 404, {"error": f"Unknown command {command!r}"}
+
+    def start(self):
+        
+        # Starts listening on config.ControlHost:config.ControlPort.
+
+        # :return: True if the endpoint is listening, False otherwise.
+        
+        control = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def _dispatch(self, method):
+                url = urllib.parse.urlsplit(self.path)
+                library = urllib.parse.parse_qs(url.query).get("library", [None])[0]
+                try:
+                    status, response = control.handle(method, url.path.strip("/"), library)
+                except Exception as e:
+                    control.util.log(f"Control command {url.path} failed: {e}", logging.ERROR)
+                    status, response = 500, {"error": str(e)}
+                body = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((self.config.ControlHost, self.config.ControlPort), Handler)
+        except OSError as e:
+            self.util.log(f"Failed to start control endpoint: {e}", logging.ERROR)
+            return False
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="control-server", daemon=True)
+        self._thread.start()
+        self.util.log(f"Serving control endpoint on http://{self.config.ControlHost}:{self.server.server_port}/")
+        return True
+
+    def stop(self):
+        
+        # Stops the endpoint.
+        
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,99 @@
+# cycle_recorder.py
+
+import json
+import logging
+import threading
+import time
+
+# Serializes writes of the recorders of all libraries, which usually share one file.
+_write_lock = threading.Lock()
+
+class CycleRecorder:
+    
+    # Records each sync cycle of a library as one JSON line in config.CycleRecordPath, for replaying it
+    # offline with benchmarks/replay_cycles.py. A record holds the onedrive output with the time each line
+    # arrived, the exit code, the metadata.db fingerprints before and after the sync and the time each
+    # Calibre-Web reconnect took, which is what a slow or flapping cycle depends on. Only cycles of
+    # `onedrive --synchronize` are recorded, not the output of `--monitor`.
+    
+
+    def __init__(self, util, config, path=None):
+        
+        # Initializes the CycleRecorder instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param path: Path of the recording. Defaults to config.CycleRecordPath.
+        
+        self.util = util
+        self.config = config
+        self.path = path or config.CycleRecordPath
+        self._cycle = None  # Record of the cycle in progress
+        self._started = None  # Monotonic time the cycle in progress started
+
+    def begin(self, fingerprint):
+        
+        # Starts recording a cycle.
+
+        # :param fingerprint: JSON-serializable fingerprint of metadata.db before the sync.
+        
+        self._started = time.monotonic()
+        self._cycle = {
+            "library": self.config.LibraryName,
+            "started": time.time(),
+            "fingerprint_before": fingerprint,
+            "output": [],
+            "reconnects": [],
+        }
+
+    def output(self, line):
+        
+        # Records one line of onedrive output.
+
+        # :param line: The line, without its line break.
+        
+        if self._cycle is not None:
+            self._cycle["output"].append([round(time.monotonic() - self._started, 4), line])
+
+    def reconnect(self, started, duration, succeeded):
+        
+        # Records one reconnect of Calibre-Web. Reconnects outside a recorded cycle are ignored.
+
+        # :param started: Monotonic time the reconnect was sent.
+        # :param duration: Seconds until Calibre-Web answered.
+        # :param succeeded: Whether Calibre-Web confirmed the reconnect.
+        
+        if self._cycle is not None:
+            self._cycle["reconnects"].append([round(started - self._started, 4), round(duration, 4), succeeded])
+
+    def end(self, exit_code, fingerprint, result, timed_out=False):
+        
+        # Finishes the cycle in progress and appends its record to the recording.
+
+        # :param exit_code: Exit code of onedrive, or None if it could not be started or was killed.
+        # :param fingerprint: JSON-serializable fingerprint of metadata.db after the cycle.
+        # :param result: Result of the cycle: True if Calibre-Web was reloaded, False if not, None if the sync failed.
+        # :param timed_out: Whether onedrive was killed for exceeding config.SyncTimeoutSecond.
+        
+        if self._cycle is None:
+            return
+        cycle, self._cycle = self._cycle, None
+        cycle.update(duration=round(time.monotonic() - self._started, 4), exit_code=exit_code, timed_out=timed_out,
+                     fingerprint_after=fingerprint, result=result)
+        try:
+            with _write_lock, open(self.path, "a") as recording:
+                recording.write(json.dumps(cycle) + "\n")
+        except (OSError, TypeError, ValueError) as e:
+            self.util.log(f"Error recording sync cycle to {self.path}: {e}", logging.ERROR)
+
+def load_recording(path, library=None):
+    
+    # Reads the cycles recorded by CycleRecorder.
+
+    # :param path: Path of the recording.
+    # :param library: Optional name of the library whose cycles are returned. Defaults to every library.
+    # :return: List of cycle records in the order they were recorded.
+    
+    with open(path) as recording:
+        cycles = [json.loads(line) for line in recording if line.strip()]
+    return [cycle for cycle in cycles if library is None or cycle["library"] == library]
@@ -0,0 +1,171 @@
+# db_watcher.py
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+# inotify event masks (see inotify(7)).
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+EVENT_HEADER = struct.Struct("iIII")
+
+class DBWatcher:
+
+    # Watches the Calibre library directory with inotify and fires a callback as soon as writes to
+    # metadata.db (or its -wal/-journal siblings) have settled.
+
+
+    def __init__(self, util, config, on_change, db_path=None):
+
+        # Initializes the DBWatcher instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param on_change: Callback invoked (without arguments) once a burst of writes has settled.
+        # :param db_path: Path to the metadata.db to watch. Defaults to config.MetadataDBPath.
+
+        self.util = util
+        self.config = config
+        self.on_change = on_change
+        self.db_path = os.path.abspath(db_path or config.MetadataDBPath)
+        self.library_dir = os.path.dirname(self.db_path)
+        db_name = os.path.basename(self.db_path)
+        self.watched_names = {db_name, f"{db_name}-wal", f"{db_name}-journal"}
+        self.fd = None
+        self._libc = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def is_available(self):
+
+        # Checks whether inotify can be used on this platform.
+
+        # :return: True if the inotify syscalls are available, False otherwise.
+
+        return self._load_libc() is not None
+
+    def start(self):
+
+        # Starts watching the library directory in a background thread.
+
+        # :return: True if the watcher is running, False if inotify is unavailable or the directory cannot be watched.
+
+        libc = self._load_libc()
+        if libc is None:
+            self.util.log("inotify is not available on this platform.", logging.WARNING)
+            return False
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self.util.log(f"Failed to initialize inotify: {os.strerror(ctypes.get_errno())}", logging.ERROR)
+            return False
+
+        wd = libc.inotify_add_watch(fd, os.fsencode(self.library_dir), WATCH_MASK)
+        if wd < 0:
+            self.util.log(f"Failed to watch {self.library_dir}: {os.strerror(ctypes.get_errno())}", logging.ERROR)
+            os.close(fd)
+            return False
+
+        self.fd = fd
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="db-watcher", daemon=True)
+        self._thread.start()
+        self.util.log(f"Watching {self.library_dir} for changes to metadata.db.")
+        return True
+
+    def stop(self):
+
+        # Stops the watcher thread and releases the inotify descriptor.
+
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _run(self):
+
+        # Waits for relevant events, then keeps reading until no further event arrives within the settle
+        # window (or the maximum delay is reached) and fires the callback once for the whole burst.
+
+        while not self._stop_event.is_set():
+            if not self._read_events(timeout=1.0):
+                continue
+
+            burst_started = time.monotonic()
+            while not self._stop_event.is_set():
+                if time.monotonic() - burst_started >= self.config.WatchMaxDelaySecond:
+                    break
+                if not self._read_events(timeout=self.config.WatchSettleSecond):
+                    break
+
+            if self._stop_event.is_set():
+                return
+            try:
+                self.on_change()
+            except Exception as e:
+                self.util.log(f"Error while handling metadata.db change: {e}", logging.ERROR)
+
+    def _read_events(self, timeout):
+
+        # Reads pending inotify events, waiting at most timeout seconds for the first one.
+
+        # :param timeout: Maximum time in seconds to wait for events.
+        # :return: True if at least one event concerned metadata.db or its journal files.
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+
+        relevant = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            _, mask, _, name_length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + name_length].rstrip(b"\0").decode(errors="replace")
+            offset += name_length
+            if mask & IN_IGNORED:
+                continue
+            if name in self.watched_names:
+                relevant = True
+        return relevant
+
+    def _load_libc(self):
+
+        # Loads libc and checks it exposes the inotify syscalls.
+
+        # :return: The loaded libc handle, or None if inotify is unavailable.
+
+        if self._libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                libc.inotify_init1
+                libc.inotify_add_watch
+            except (OSError, AttributeError):
+                return None
+            self._libc = libc
+        return self._libc
@@ -1,23 +1,268 @@
 from dotenv import load_dotenv
+import copy
+import json
 import os
 
 # Load environment variables from .env file
 load_dotenv()
 
 class Config:
+    # Name of the library, used in logs and metrics
+    LibraryName = os.getenv('LIBRARY_NAME', 'default')
+
+    # Optional JSON file listing several libraries to sync from one process. Each entry is an object whose keys are
+    # attribute names of this class (e.g. "LibraryName", "MetadataDBPath", "OneDriveConfDir", "PortCalibreWeb",
+    # "TimeCheckOneDriveSecond") overriding the values below for that library
+    LibrariesPath = os.getenv('LIBRARIES_PATH', '')
+
+    # Maximum number of libraries synced at the same time
+    MaxSyncWorkers = int(os.getenv('MAX_SYNC_WORKERS', 4))
+
+    # Optional configuration directory passed to the onedrive client with --confdir (one per OneDrive account)
+    OneDriveConfDir = os.getenv('ONEDRIVE_CONFDIR', '')
+
+    # Generate the onedrive sync_list (in OneDriveConfDir or ~/.config/onedrive) from metadata.db, limiting the sync to the library
+    GenerateSyncList = os.getenv('GENERATE_SYNC_LIST', 'False').lower() in ('true', '1', 'yes')
+
+    # Folder of the library relative to the OneDrive root (defaults to the folder containing metadata.db)
+    OneDriveLibraryFolder = os.getenv('ONEDRIVE_LIBRARY_FOLDER', '')
+
+    # Optional comma-separated list of book formats to sync, e.g. "epub,pdf" (empty syncs every file)
+    SyncListFormats = os.getenv('SYNC_LIST_FORMATS', '')
+
+    # Only sync the books modified within this many days (0 syncs every book); covers are always synced
+    SyncListRecentDays = int(os.getenv('SYNC_LIST_RECENT_DAYS', 0))
+
     # Port number for the Calibre content server
     PortCalibreWeb = int(os.getenv('PORT_CALIBRE_WEB', 8083))
     
+    # Connect and read timeouts in seconds for requests to Calibre-Web
+    HTTPConnectTimeoutSecond = float(os.getenv('HTTP_CONNECT_TIMEOUT_SECOND', 3))
+    HTTPReadTimeoutSecond = float(os.getenv('HTTP_READ_TIMEOUT_SECOND', 30))
+
+    # Retries for failed requests to Calibre-Web, with jittered exponential backoff between base and maximum delay
+    HTTPRetries = int(os.getenv('HTTP_RETRIES', 3))
+    HTTPBackoffSecond = float(os.getenv('HTTP_BACKOFF_SECOND', 0.5))
+    HTTPBackoffMaxSecond = float(os.getenv('HTTP_BACKOFF_MAX_SECOND', 10))
+
+    # Number of pooled keep-alive connections to Calibre-Web
+    HTTPPoolSize = int(os.getenv('HTTP_POOL_SIZE', 2))
+
+    # How long to wait for Calibre-Web to answer after starting it, and how often to probe
+    ReadyTimeoutSecond = float(os.getenv('READY_TIMEOUT_SECOND', 60))
+    ReadyPollSecond = float(os.getenv('READY_POLL_SECOND', 1))
+
+    # Seconds between health checks of the cps process (0 disables supervision)
+    CalibreHealthCheckSecond = float(os.getenv('CALIBRE_HEALTH_CHECK_SECOND', 30))
+
+    # Restart cps after this many consecutive failed or slow probes, when a probe is slower than the latency limit, or when it uses more memory than the limit (0 for no limit)
+    CalibreMaxFailedProbes = int(os.getenv('CALIBRE_MAX_FAILED_PROBES', 3))
+    CalibreMaxLatencySecond = float(os.getenv('CALIBRE_MAX_LATENCY_SECOND', 10))
+    CalibreMaxRSSMB = int(os.getenv('CALIBRE_MAX_RSS_MB', 0))
+
+    # Seconds cps gets to exit after SIGTERM before it is killed
+    CalibreStopTimeoutSecond = float(os.getenv('CALIBRE_STOP_TIMEOUT_SECOND', 10))
+
+    # Kill whatever listens on PORT_CALIBRE_WEB before starting cps
+    ClearPortOnStart = os.getenv('CLEAR_PORT_ON_START', 'False').lower() in ('true', '1', 'yes')
+
     # Time interval in seconds to check for changes in OneDrive
     TimeCheckOneDriveSecond = int(os.getenv('TIME_CHECK_ONEDRIVE_SECOND', 60))
 
+    # Interval in seconds right after a sync that brought changes, to follow active editing closely
+    SyncMinIntervalSecond = float(os.getenv('SYNC_MIN_INTERVAL_SECOND', 15))
+
+    # Longest interval in seconds reached by backing off while nothing changes
+    SyncMaxIntervalSecond = float(os.getenv('SYNC_MAX_INTERVAL_SECOND', 900))
+
+    # Factor applied to the interval after each sync that brought no changes (1 keeps it fixed)
+    SyncBackoffFactor = float(os.getenv('SYNC_BACKOFF_FACTOR', 2))
+
+    # Random jitter applied to every interval, as a fraction of it
+    SyncJitterRatio = float(os.getenv('SYNC_JITTER_RATIO', 0.1))
+
+    # Delay in seconds before retrying a failed sync, doubled for each consecutive failure
+    SyncFailureRetrySecond = float(os.getenv('SYNC_FAILURE_RETRY_SECOND', 30))
+
+    # Upload edits made through Calibre-Web between syncs (synchronize mode, without a staging metadata.db)
+    PushLocalChanges = os.getenv('PUSH_LOCAL_CHANGES', 'False').lower() in ('true', '1', 'yes')
+
+    # Interval in seconds to check metadata.db for local edits
+    PushCheckSecond = float(os.getenv('PUSH_CHECK_SECOND', 5))
+
+    # Seconds after which a running `onedrive --synchronize` is killed (0 for no limit)
+    SyncTimeoutSecond = float(os.getenv('SYNC_TIMEOUT_SECOND', 3600))
+
+    # Skip the metadata.db check after a sync in which onedrive reported no change to metadata.db
+    SkipCheckWithoutDBEvent = os.getenv('SKIP_CHECK_WITHOUT_DB_EVENT', 'True').lower() in ('true', '1', 'yes')
+
+    # Number of recent onedrive output lines kept in memory and logged when a sync fails
+    OneDriveOutputHistory = int(os.getenv('ONEDRIVE_OUTPUT_HISTORY', 200))
+
     # Path to the metadata.db file in your Calibre library
     MetadataDBPath = os.getenv('METADATA_DB_PATH', "path/to/metadata.db")
 
+    # Optional path to the metadata.db that OneDrive syncs into. When set, it is copied to METADATA_DB_PATH (read by Calibre-Web) and swapped in atomically after each change
+    StagingMetadataDBPath = os.getenv('STAGING_METADATA_DB_PATH', '')
+
+    # Number of database pages copied per backup step when publishing, and the pause between steps
+    PublishPagesPerStep = int(os.getenv('PUBLISH_PAGES_PER_STEP', 1024))
+    PublishStepSleepSecond = float(os.getenv('PUBLISH_STEP_SLEEP_SECOND', 0))
+
+    # Symlink the staging library's book folders next to the published metadata.db
+    PublishLinkBooks = os.getenv('PUBLISH_LINK_BOOKS', 'True').lower() in ('true', '1', 'yes')
+
     # Path to the cps file in your venv
     CPSPath = os.getenv('CPS_PATH', "path/to/cps")
 
     # Enable or disable logging
     Log = os.getenv('LOG', 'True').lower() in ('true', '1', 'yes')
 
+    # Minimum level of messages to log: DEBUG (includes the output of the onedrive client), INFO, WARNING or ERROR
+    LogLevel = os.getenv('LOG_LEVEL', 'INFO')
+
+    # Path of the log file
+    LogPath = os.getenv('LOG_PATH', 'sync.log')
+
+    # Maximum number of messages waiting to be written; further messages are dropped and counted
+    LogQueueSize = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+    # Rotate the log file when it reaches LOG_MAX_BYTES, or on a schedule if LOG_ROTATE_WHEN is set (e.g. 'midnight'), keeping LOG_BACKUP_COUNT old files
+    LogMaxBytes = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LogRotateWhen = os.getenv('LOG_ROTATE_WHEN', '')
+    LogBackupCount = int(os.getenv('LOG_BACKUP_COUNT', 5))
+
+    # Gzip rotated log files
+    LogCompress = os.getenv('LOG_COMPRESS', 'True').lower() in ('true', '1', 'yes')
+
+    # How changes to metadata.db are detected: 'mtime' (any newer modification time), 'content' (row counts and last_modified) or 'hash' (hash of all relevant rows)
+    ChangeDetection = os.getenv('CHANGE_DETECTION', 'content').lower()
+
+    # Comma-separated tables considered by the 'content' and 'hash' strategies (empty for the default set)
+    ChangeDetectionTables = os.getenv('CHANGE_DETECTION_TABLES', '')
+
+    # Path of the book snapshot used to work out which books changed (empty to disable)
+    BookIndexPath = os.getenv('BOOK_INDEX_PATH', 'book_index.db')
+
+    # Optional URL receiving a JSON POST with the added/removed/modified books after each change
+    BookChangeWebhookURL = os.getenv('BOOK_CHANGE_WEBHOOK_URL', '')
+
+    # Cache directory of Calibre-Web (its CACHE_DIR) whose thumbnails are filled with the covers of new and changed books after each sync (empty to disable)
+    ThumbnailCacheDir = os.getenv('THUMBNAIL_CACHE_DIR', '')
+
+    # Path of Calibre-Web's app.db, in which the rendered thumbnails are recorded (needed with THUMBNAIL_CACHE_DIR)
+    CalibreWebAppDBPath = os.getenv('CALIBRE_WEB_APP_DB_PATH', '')
+
+    # Comma-separated Calibre-Web thumbnail resolutions rendered per cover (1 is 225 pixels high, 2 is 450)
+    ThumbnailResolutions = os.getenv('THUMBNAIL_RESOLUTIONS', '1,2')
+
+    # JPEG quality of the thumbnails
+    ThumbnailQuality = int(os.getenv('THUMBNAIL_QUALITY', 85))
+
+    # Number of processes rendering thumbnails (0 for the CPU count)
+    ThumbnailWorkers = int(os.getenv('THUMBNAIL_WORKERS', 0))
+
+    # Path of the index of the library files used to hold back reloads until every referenced book file is downloaded (empty to disable)
+    LibraryIndexPath = os.getenv('LIBRARY_INDEX_PATH', '')
+
+    # Also store a hash of each indexed file; files are hashed only when their size or modification time changes
+    LibraryIndexHash = os.getenv('LIBRARY_INDEX_HASH', 'False').lower() in ('true', '1', 'yes')
+
+    # How long a check waits for missing book files, and how often it looks for them while waiting
+    IntegrityWaitSecond = float(os.getenv('INTEGRITY_WAIT_SECOND', 10))
+    IntegrityPollSecond = float(os.getenv('INTEGRITY_POLL_SECOND', 1))
+
+    # How long reloads are held back for missing book files before Calibre-Web is reloaded anyway and the files are reported
+    IntegrityMaxWaitSecond = float(os.getenv('INTEGRITY_MAX_WAIT_SECOND', 600))
+
+    # Path of the file keeping the sync state of every library across restarts (empty to disable)
+    StatePath = os.getenv('STATE_PATH', 'sync_state.db')
+
+    # Seconds metadata.db and its -wal/-journal must stay unchanged before Calibre-Web is reloaded (0 to disable the settle check)
+    SettleWindowSecond = float(os.getenv('SETTLE_WINDOW_SECOND', 2))
+
+    # How often the files are re-checked while waiting, and how long to wait at most before giving up until the next check
+    SettlePollSecond = float(os.getenv('SETTLE_POLL_SECOND', 0.5))
+    SettleTimeoutSecond = float(os.getenv('SETTLE_TIMEOUT_SECOND', 60))
+
+    # Run PRAGMA quick_check on a read-only handle before reloading Calibre-Web
+    SettleQuickCheck = os.getenv('SETTLE_QUICK_CHECK', 'False').lower() in ('true', '1', 'yes')
+
+    # File to which every sync cycle is appended as a JSON line for offline replay (empty to disable)
+    CycleRecordPath = os.getenv('CYCLE_RECORD_PATH', '')
+
+    # Local address and port of the Prometheus metrics endpoint (port 0 disables it)
+    MetricsHost = os.getenv('METRICS_HOST', '127.0.0.1')
+    MetricsPort = int(os.getenv('METRICS_PORT', 0))
+
+    # Local address and port of the control endpoint for sync-now, reload-now, status, pause and resume (port 0 disables it)
+    ControlHost = os.getenv('CONTROL_HOST', '127.0.0.1')
+    ControlPort = int(os.getenv('CONTROL_PORT', 0))
+
+    # Optional file to which a JSON summary of each sync cycle is appended
+    MetricsSummaryPath = os.getenv('METRICS_SUMMARY_PATH', '')
+
+    # How OneDrive is run: 'synchronize' (one `onedrive --synchronize` per interval) or 'monitor' (one supervised `onedrive --monitor` process)
+    OneDriveMode = os.getenv('ONEDRIVE_MODE', 'synchronize').lower()
+
+    # Initial and maximum delay in seconds before restarting a `onedrive --monitor` process that exited
+    MonitorRestartMinSecond = float(os.getenv('MONITOR_RESTART_MIN_SECOND', 5))
+    MonitorRestartMaxSecond = float(os.getenv('MONITOR_RESTART_MAX_SECOND', 300))
+
+    # How changes to metadata.db are noticed: 'poll' (checked after every sync) or 'inotify' (watched as they happen, Linux only)
+    WatchMode = os.getenv('WATCH_MODE', 'poll').lower()
+
+    # Seconds without further writes before a change to metadata.db is considered settled (inotify mode)
+    WatchSettleSecond = float(os.getenv('WATCH_SETTLE_SECOND', 0.5))
+
+    # Maximum seconds to wait for a continuous burst of writes to settle (inotify mode)
+    WatchMaxDelaySecond = float(os.getenv('WATCH_MAX_DELAY_SECOND', 10))
+
+    def library_folder(self, db_path=None):
+        
+        # :param db_path: The metadata.db OneDrive syncs. Defaults to MetadataDBPath.
+        # :return: Folder of the library relative to the OneDrive root, without leading or trailing slashes.
+        
+        db_path = db_path or self.MetadataDBPath
+        return (self.OneDriveLibraryFolder or os.path.basename(os.path.dirname(os.path.abspath(db_path)))).strip("/")
+
+    def libraries(self):
+        
+        # Builds one configuration per library. Without LibrariesPath this is just this configuration.
+
+        # :return: List of Config objects.
+        # :raises ValueError: If the libraries file names an unknown setting, or two libraries share a name or an onedrive confdir.
+        
+        if not self.LibrariesPath:
+            return [self]
+
+        with open(self.LibrariesPath) as libraries_file:
+            definitions = json.load(libraries_file)
+
+        libraries = []
+        for index, definition in enumerate(definitions):
+            library = copy.copy(self)
+            library.LibrariesPath = ''
+            library.LibraryName = f"library{index + 1}"
+            for key, value in definition.items():
+                if key.startswith("_") or not hasattr(Config, key) or callable(getattr(Config, key)):
+                    raise ValueError(f"Unknown setting {key!r} for library {index + 1} in {self.LibrariesPath}")
+                setattr(library, key, value)
+            # Keep per-library state files apart unless they were set explicitly.
+            for key in ("BookIndexPath", "LibraryIndexPath"):
+                if key not in definition and getattr(library, key):
+                    root, extension = os.path.splitext(getattr(library, key))
+                    setattr(library, key, f"{root}_{library.LibraryName}{extension}")
+            libraries.append(library)
+
+        names = [library.LibraryName for library in libraries]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Library names in {self.LibrariesPath} must be unique")
+        # onedrive keeps its items database and sync_list in the confdir, so two libraries syncing through one would
+        # run onedrive on it at the same time and overwrite each other's sync_list.
+        confdirs = [os.path.abspath(os.path.expanduser(library.OneDriveConfDir or "~/.config/onedrive")) for library in libraries]
+        if len(set(confdirs)) != len(confdirs):
+            raise ValueError(f"Each library in {self.LibrariesPath} needs its own OneDriveConfDir")
+        return libraries
+
 default_config = Config()
\ No newline at end of file
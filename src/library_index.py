@@ -0,0 +1,252 @@
+# library_index.py
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from contextlib import closing
+
+class LibraryIndex:
+    
+    # Index of the files of a library (path, size, modification time and optionally a hash), used to hold
+    # back a reload until every book file metadata.db references has been downloaded. OneDrive often
+    # delivers metadata.db before the files it references, so Calibre-Web would show broken downloads and
+    # covers. The index is kept in SQLite next to the book index. It is filled by one scan of the library and
+    # then updated only from the paths onedrive reports acting on, so a check never walks or rehashes the
+    # whole tree. Files the cross-check against the `data` table finds missing or incomplete are stat'ed
+    # again before being reported, so a stale entry can delay a reload but never block it for good.
+    
+
+    def __init__(self, util, config, db_path=None, index_path=None):
+        
+        # Initializes the LibraryIndex instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param db_path: Path to the metadata.db whose folder holds the books. Defaults to config.MetadataDBPath.
+        # :param index_path: Path of the index file. Defaults to config.LibraryIndexPath.
+        
+        self.util = util
+        self.config = config
+        self.db_path = db_path or config.MetadataDBPath
+        self.index_path = index_path or config.LibraryIndexPath
+        self.library_path = os.path.dirname(os.path.abspath(self.db_path))
+        # Folder of the library relative to the OneDrive root, which prefixes the paths onedrive reports.
+        self.library_folder = config.library_folder(self.db_path)
+        self._pending = set()  # Library-relative paths onedrive acted on since the last update
+        self._pending_lock = threading.Lock()  # Guards _pending, noted by the sync or monitor thread while a check updates
+        self._scanned = False  # True once the library was scanned by this process
+
+    def note(self, path):
+        
+        # Records a path onedrive reported acting on, to be re-stat'ed by the next update().
+
+        # :param path: Path relative to the OneDrive root, e.g. "./Calibre Library/Author/Book/Book.epub". Paths outside the library are ignored.
+        
+        path = path.replace(os.sep, "/")
+        if path.startswith("./"):
+            path = path[2:]
+        path = path.lstrip("/")
+        prefix = self.library_folder + "/"
+        if path.startswith(prefix):
+            with self._pending_lock:
+                self._pending.add(path[len(prefix):])
+
+    def update(self, full=False):
+        
+        # Brings the index up to date: scans the whole library the first time or when asked to, otherwise
+        # re-stats only the noted paths.
+
+        # :param full: Whether to scan the whole library, e.g. when onedrive output is not parsed.
+        # :return: Number of entries added, changed or removed, or None if the index could not be updated.
+        
+        # Paths noted from now on are left to the next update.
+        with self._pending_lock:
+            pending, self._pending = self._pending, set()
+        try:
+            with closing(self._connect()) as connection, connection:
+                if full or not self._scanned:
+                    changed = self._scan(connection)
+                    self._scanned = True
+                else:
+                    changed = self._refresh(connection, pending)
+        except sqlite3.Error as e:
+            self.util.log(f"Error updating library index {self.index_path}: {e}", logging.ERROR)
+            # Keep the paths for the next attempt.
+            with self._pending_lock:
+                self._pending |= pending
+            return None
+        return changed
+
+    def missing(self):
+        
+        # Cross-checks the index against metadata.db.
+
+        # :return: Sorted list of library-relative paths of referenced book files and covers that are missing
+        #          or smaller than metadata.db records, or None if metadata.db could not be read.
+        
+        try:
+            with closing(self._connect()) as connection, connection:
+                connection.execute("ATTACH DATABASE ? AS library", (f"file:{urllib.parse.quote(self.db_path)}?mode=ro",))
+                try:
+                    suspects = [path for path, in connection.execute(self._missing_query(), self._missing_parameters())]
+                    # Entries can be stale when a file arrived without onedrive reporting it; look again before reporting.
+                    if suspects:
+                        self._refresh(connection, suspects)
+                        suspects = [path for path, in connection.execute(self._missing_query(), self._missing_parameters())]
+                finally:
+                    connection.commit()
+                    connection.execute("DETACH DATABASE library")
+        except sqlite3.Error as e:
+            self.util.log(f"Error checking the library files against {self.db_path}: {e}", logging.ERROR)
+            return None
+        return sorted(suspects)
+
+    def wait(self, full=False):
+        
+        # Updates the index and waits until every referenced file is present, or config.IntegrityWaitSecond passes.
+
+        # :param full: Whether to scan the whole library first.
+        # :return: List of the files still missing, empty if the library is complete, or None if it could not be checked.
+        
+        if self.update(full=full) is None:
+            return None
+        deadline = time.monotonic() + self.config.IntegrityWaitSecond
+        while True:
+            missing = self.missing()
+            if not missing or time.monotonic() >= deadline:
+                return missing
+            time.sleep(self.config.IntegrityPollSecond)
+
+    def _missing_query(self):
+        
+        # :return: SQL selecting the referenced files that are not indexed with at least their recorded size.
+        
+        books = "SELECT id, path, has_cover FROM library.books"
+        if self.config.GenerateSyncList and self.config.SyncListRecentDays:
+            # Books left out of the sync list are never downloaded, so they cannot be missing.
+            books += " WHERE last_modified >= ?"
+        formats = ""
+        if self.config.GenerateSyncList and self.config.SyncListFormats:
+            formats = " AND lower(d.format) IN (SELECT value FROM json_each(?))"
+        return f"""
+            WITH b AS ({books}),
+            expected (path, size) AS (
+                SELECT b.path || '/' || d.name || '.' || lower(d.format), d.uncompressed_size
+                FROM b JOIN library.data d ON d.book = b.id WHERE 1{formats}
+                UNION ALL
+                SELECT b.path || '/cover.jpg', 0 FROM b WHERE b.has_cover
+            )
+            SELECT e.path FROM expected e LEFT JOIN files f ON f.path = e.path
+            WHERE f.path IS NULL OR f.size < e.size
+        """
+
+    def _missing_parameters(self):
+        
+        # :return: Parameters of _missing_query().
+        
+        parameters = []
+        if self.config.GenerateSyncList and self.config.SyncListRecentDays:
+            cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=self.config.SyncListRecentDays)
+            parameters.append(cutoff.isoformat(sep=" "))
+        if self.config.GenerateSyncList and self.config.SyncListFormats:
+            formats = [f.strip().lower() for f in self.config.SyncListFormats.split(",") if f.strip()]
+            parameters.append(json.dumps(formats))
+        return parameters
+
+    def _scan(self, connection):
+        
+        # Walks the library and stores the files whose size or modification time changed. Unchanged files are
+        # neither written nor hashed.
+
+        # :param connection: Open connection to the index.
+        # :return: Number of entries added, changed or removed.
+        
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in connection.execute("SELECT path, size, mtime_ns FROM files")}
+        changed = []
+        stack = [""]
+        while stack:
+            folder = stack.pop()
+            try:
+                entries = list(os.scandir(os.path.join(self.library_path, folder)))
+            except OSError:
+                continue
+            for entry in entries:
+                path = f"{folder}/{entry.name}" if folder else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(path)
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if known.pop(path, None) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((path, stat))
+        self._store(connection, changed)
+        connection.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in known))
+        return len(changed) + len(known)
+
+    def _refresh(self, connection, paths):
+        
+        # Re-stats the given files and stores those that changed or disappeared.
+
+        # :param connection: Open connection to the index.
+        # :param paths: Library-relative paths.
+        # :return: Number of entries added, changed or removed.
+        
+        changed, removed = [], []
+        for path in paths:
+            row = connection.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+            try:
+                stat = os.stat(os.path.join(self.library_path, path))
+            except OSError:
+                if row is not None:
+                    removed.append((path,))
+                continue
+            if row != (stat.st_size, stat.st_mtime_ns):
+                changed.append((path, stat))
+        self._store(connection, changed)
+        connection.executemany("DELETE FROM files WHERE path = ?", removed)
+        return len(changed) + len(removed)
+
+    def _store(self, connection, changed):
+        
+        # Writes the entries of changed files, hashing them if config.LibraryIndexHash is set.
+
+        # :param connection: Open connection to the index.
+        # :param changed: List of (library-relative path, os.stat_result) tuples.
+        
+        rows = []
+        for path, stat in changed:
+            digest = _hash_file(os.path.join(self.library_path, path)) if self.config.LibraryIndexHash else None
+            rows.append((path, stat.st_size, stat.st_mtime_ns, digest))
+        connection.executemany("INSERT OR REPLACE INTO files (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)", rows)
+
+    def _connect(self):
+        
+        # Opens the index, creating its table if needed.
+
+        # :return: An sqlite3 connection.
+        
+        connection = sqlite3.connect(self.index_path, timeout=10)
+        connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT)")
+        return connection
+
+def _hash_file(path):
+    
+    # :param path: Path of the file.
+    # :return: Hex blake2b digest of its content, or None if it could not be read.
+    
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
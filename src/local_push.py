@@ -0,0 +1,140 @@
+# local_push.py
+
+import logging
+import os
+import subprocess
+from contextlib import closing
+
+class LocalChangePusher:
+    
+    # Pushes edits made through Calibre-Web back to OneDrive between syncs. A local edit is a change of
+    # metadata.db content against the fingerprint accepted after the last sync, seen while onedrive is not
+    # running. Only the book folders the BookIndex reports as changed are uploaded, each with
+    # `--upload-only --single-directory`, followed by metadata.db. Before uploading, a dry-run download of
+    # the library folder checks whether metadata.db changed on OneDrive too; in that case nothing is pushed
+    # and the next full sync resolves the conflict, where onedrive keeps both copies.
+    
+
+    def __init__(self, util, config, onedrive_server, change_detector, book_index=None):
+        
+        # Initializes the LocalChangePusher instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param onedrive_server: The OneDriveServer of the library, used to run onedrive and to persist state.
+        # :param change_detector: The ChangeDetector of the library, holding the fingerprint of the last sync.
+        # :param book_index: Optional BookIndex telling which book folders changed. Without it, the whole library folder is uploaded.
+        
+        self.util = util
+        self.config = config
+        self.onedrive_server = onedrive_server
+        self.change_detector = change_detector
+        self.book_index = book_index
+        self.library_folder = config.library_folder(onedrive_server.db_path)
+        self.push_count = 0  # Number of local edits pushed
+        self.conflict_count = 0  # Number of local edits held back because OneDrive changed too
+
+    def push(self):
+        
+        # Checks for local edits and uploads them. Does nothing while onedrive is syncing the library.
+
+        # :return: True if edits were pushed, False if there were none, None if the push failed or was held back.
+
+        # Without a completed check there is no baseline to tell local edits from the state OneDrive synced.
+        if not self.onedrive_server.checked or not self.onedrive_server.sync_lock.acquire(blocking=False):
+            return False
+        try:
+            changed = self.change_detector.has_changed()
+            if not changed:
+                return changed
+
+            self.util.log("Local changes detected in metadata.db. Checking OneDrive for concurrent changes...")
+            remote_changed = self._remote_changed()
+            if remote_changed is None:
+                return None
+            if remote_changed:
+                self.conflict_count += 1
+                self.util.log("metadata.db changed on OneDrive as well. Leaving the local changes to the next full sync.", logging.WARNING)
+                return None
+
+            folders = self._changed_folders()
+            if folders is None:
+                # Without knowing which books changed, upload the whole library folder.
+                if not self._upload(self.library_folder, recursive=True):
+                    return None
+            else:
+                for folder in folders:
+                    if not self._upload(folder, recursive=True):
+                        return None
+                # metadata.db last, so OneDrive never references book files that are not uploaded yet.
+                if not self._upload(self.library_folder, recursive=False):
+                    return None
+
+            # Only now that everything is uploaded are the changed books recorded and handed to the consumers.
+            if self.book_index is not None:
+                self.book_index.refresh()
+            self.change_detector.accept()
+            self.onedrive_server.save_state()
+            self.push_count += 1
+            if folders is None:
+                self.util.log("Pushed local changes to OneDrive (whole library folder).")
+            else:
+                self.util.log(f"Pushed local changes to OneDrive ({len(folders)} book folders).")
+            return True
+        finally:
+            self.onedrive_server.sync_lock.release()
+
+    def _remote_changed(self):
+        
+        # Asks onedrive, without changing anything, whether it would download metadata.db.
+
+        # :return: True if metadata.db changed on OneDrive, False if not, None if onedrive failed.
+        
+        try:
+            # Leaving the loop early closes the output, which terminates onedrive before the sync lock is released.
+            with closing(self.onedrive_server.run_onedrive("--synchronize", "--download-only", "--dry-run", "--single-directory",
+                                                           self.library_folder, timeout=self.config.SyncTimeoutSecond)) as output:
+                for _, event in output:
+                    if event is not None and event.is_metadata_db and event.action != "upload":
+                        return True
+        except (subprocess.SubprocessError, OSError) as e:
+            self.util.log(f"Could not check OneDrive for changes: {e}", logging.ERROR)
+            return None
+        return False
+
+    def _changed_folders(self):
+        
+        # :return: Folders, relative to the OneDrive root, holding the books added, modified or removed locally, or None if unknown.
+        
+        if self.book_index is None:
+            return None
+        # The snapshot is left as it is, so a failed upload finds the same books again at the next push.
+        changeset = self.book_index.diff()
+        if changeset is None:
+            return None
+        folders = set()
+        for book_id in changeset.added + changeset.modified:
+            folders.add(changeset.paths[book_id])
+        for book_id in changeset.removed:
+            # The folder of a removed book is gone; upload its author folder to delete it on OneDrive.
+            folders.add(os.path.dirname(changeset.paths[book_id]))
+        return sorted(f"{self.library_folder}/{folder}" for folder in folders if folder)
+
+    def _upload(self, folder, recursive):
+        
+        # Uploads one folder of the library.
+
+        # :param folder: Folder relative to the OneDrive root.
+        # :param recursive: Whether to include subfolders. Without them only the files directly in the folder, e.g. metadata.db, are uploaded.
+        # :return: True if the upload succeeded, False otherwise.
+        
+        args = ["--synchronize", "--upload-only", "--single-directory", folder]
+        if not recursive:
+            args += ["--skip-dir", "*"]
+        try:
+            for _ in self.onedrive_server.run_onedrive(*args, timeout=self.config.SyncTimeoutSecond):
+                pass
+        except (subprocess.SubprocessError, OSError) as e:
+            self.util.log(f"Uploading {folder} failed: {e}", logging.ERROR)
+            return False
+        return True
@@ -0,0 +1,243 @@
+# metrics.py
+
+import json
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram buckets in seconds, covering everything from a quick stat to a full sync of a large library.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+class Metrics:
+    
+    # Thread-safe registry of counters, gauges and histograms, rendered in the Prometheus text exposition format.
+    
+
+    def __init__(self, config, prefix="calibre_onedrive_sync"):
+        
+        # Initializes the Metrics instance.
+
+        # :param config: Configuration object containing settings.
+        # :param prefix: Prefix added to every metric name.
+        
+        self.config = config
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._types = {}  # name -> (type, help)
+        self._values = {}  # (name, labels) -> float for counters and gauges, [bucket counts, sum, count] for histograms
+        self._collectors = []
+
+    def describe(self, name, metric_type, help_text):
+        
+        # Registers the type and help text of a metric.
+
+        # :param name: Metric name without prefix.
+        # :param metric_type: 'counter', 'gauge' or 'histogram'.
+        # :param help_text: Description shown in the exposition output.
+        
+        with self._lock:
+            self._types[name] = (metric_type, help_text)
+
+    def inc(self, name, value=1, labels=None):
+        
+        # Increments a counter.
+
+        # :param name: Metric name without prefix.
+        # :param value: Amount to add.
+        # :param labels: Optional dict of label names to values.
+        
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._types.setdefault(name, ("counter", name))
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        
+        # Sets a gauge.
+
+        # :param name: Metric name without prefix.
+        # :param value: New value.
+        # :param labels: Optional dict of label names to values.
+        
+        with self._lock:
+            self._types.setdefault(name, ("gauge", name))
+            self._values[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, labels=None):
+        
+        # Records an observation in a histogram.
+
+        # :param name: Metric name without prefix.
+        # :param value: Observed value, usually a duration in seconds.
+        # :param labels: Optional dict of label names to values.
+        
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._types.setdefault(name, ("histogram", name))
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [[0] * len(DEFAULT_BUCKETS), 0.0, 0]
+            for index, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def add_collector(self, collector):
+        
+        # Registers a callable that updates metrics right before they are rendered, for values that are
+        # cheaper to read on demand than to keep up to date.
+
+        # :param collector: Callable taking this Metrics instance.
+        
+        self._collectors.append(collector)
+
+    def get(self, name, labels=None):
+        
+        # Returns the current value of a counter or gauge, or the count of a histogram.
+
+        # :param name: Metric name without prefix.
+        # :param labels: Optional dict of label names to values.
+        # :return: The value, or 0 if nothing was recorded.
+        
+        with self._lock:
+            value = self._values.get((name, _label_key(labels)), 0)
+        return value[2] if isinstance(value, list) else value
+
+    def render(self):
+        
+        # Renders all metrics in the Prometheus text exposition format.
+
+        # :return: The exposition text.
+        
+        for collector in self._collectors:
+            collector(self)
+
+        lines = []
+        with self._lock:
+            for name, (metric_type, help_text) in sorted(self._types.items()):
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {metric_type}")
+                for (value_name, labels), value in sorted(self._values.items(), key=lambda item: (item[0][0], item[0][1])):
+                    if value_name != name:
+                        continue
+                    if metric_type == "histogram":
+                        buckets, total, count = value
+                        for bound, bucket_count in zip(DEFAULT_BUCKETS, buckets):
+                            lines.append(f"{full_name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {bucket_count}")
+                        lines.append(f"{full_name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}")
+                        lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(total)}")
+                        lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+                    else:
+                        lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def record_cycle(self, summary):
+        
+        # Appends a JSON summary of one sync cycle to config.MetricsSummaryPath, if configured.
+
+        # :param summary: Dict describing the cycle.
+        
+        if not self.config.MetricsSummaryPath:
+            return
+        summary = dict(summary, timestamp=time.time())
+        with self._lock:
+            with open(self.config.MetricsSummaryPath, "a") as summary_file:
+                summary_file.write(json.dumps(summary, sort_keys=True) + "\n")
+
+class MetricsServer:
+    
+    # Serves the metrics on a local HTTP endpoint (GET /metrics) from a background thread.
+    
+
+    def __init__(self, util, config, metrics):
+        
+        # Initializes the MetricsServer instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param metrics: The Metrics registry to serve.
+        
+        self.util = util
+        self.config = config
+        self.metrics = metrics
+        self.server = None
+        self._thread = None
+
+    def start(self):
+        
+        # Starts listening on config.MetricsHost:config.MetricsPort.
+
+        # :return: True if the endpoint is listening, False otherwise.
+        
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((self.config.MetricsHost, self.config.MetricsPort), Handler)
+        except OSError as e:
+            self.util.log(f"Failed to start metrics endpoint: {e}", logging.ERROR)
+            return False
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        self.util.log(f"Serving metrics on http://{self.config.MetricsHost}:{self.server.server_port}/metrics")
+        return True
+
+    def stop(self):
+        
+        # Stops the HTTP endpoint.
+        
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def _label_key(labels):
+    
+    # Turns a labels dict into a hashable, ordered key.
+    
+    return tuple(sorted(labels.items())) if labels else ()
+
+def _format_labels(labels, extra=None):
+    
+    # Formats labels for the exposition format, e.g. {library="main",le="0.5"}.
+    
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (f'{key}="{_escape_label_value(str(value))}"' for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+def _escape_label_value(value):
+    
+    # Escapes backslashes, quotes and newlines in a label value.
+    
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_value(value):
+    
+    # Formats a number for the exposition format.
+    
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
@@ -0,0 +1,102 @@
+# onedrive_parser.py
+
+import collections
+import os
+import re
+
+DOWNLOAD = "download"
+UPLOAD = "upload"
+DELETE = "delete"
+MOVE = "move"
+CONFLICT = "conflict"
+ERROR = "error"
+
+# Trailing status and optional size onedrive prints after an item, e.g. " ... done." or " ... failed!"
+_STATUS = r"(?:\s+\.\.\.\s*(?P<status>done|failed|skipped)?[.!]?)?(?:\s+\((?P<size>\d+) bytes\))?\s*$"
+
+# Patterns of the onedrive client output, in the order they are tried.
+PATTERNS = [
+    (DOWNLOAD, re.compile(r"^Downloading (?:new |modified )?file:?\s+(?P<path>.+?)" + _STATUS, re.IGNORECASE)),
+    (UPLOAD, re.compile(r"^Uploading (?:new |modified |differences of )?(?:file|item)s?:?\s+(?P<path>.+?)" + _STATUS, re.IGNORECASE)),
+    (DELETE, re.compile(r"^(?:Deleting item|Deleting item from OneDrive|Trying to delete item|Deleting local item):?\s+(?P<path>.+?)" + _STATUS, re.IGNORECASE)),
+    (MOVE, re.compile(r"^Moving\s+(?P<path>.+?)\s+to\s+(?P<target>.+?)\s*$", re.IGNORECASE)),
+    (CONFLICT, re.compile(r"renaming to preserve (?:existing file|data).*?:\s+(?P<path>.+?)\s+->\s+(?P<target>.+?)\s*$", re.IGNORECASE)),
+    (ERROR, re.compile(r"^ERROR:\s*(?P<message>.*)$", re.IGNORECASE)),
+]
+
+class SyncEvent:
+    
+    # One item the onedrive client reported acting on.
+    
+
+    def __init__(self, action, path, size=None, raw="", target=None, failed=False):
+        
+        # Initializes the SyncEvent instance.
+
+        # :param action: One of DOWNLOAD, UPLOAD, DELETE, MOVE, CONFLICT or ERROR.
+        # :param path: Path of the item relative to the sync directory, e.g. "./Calibre Library/metadata.db".
+        #              None for errors that do not name an item.
+        # :param size: Size in bytes if onedrive printed it, otherwise None.
+        # :param raw: The line the event was parsed from.
+        # :param target: New path of a moved item, or the name a conflicting item was renamed to.
+        # :param failed: Whether onedrive reported the action as failed.
+        
+        self.action = action
+        self.path = path
+        self.size = size
+        self.raw = raw
+        self.target = target
+        self.failed = failed
+
+    @property
+    def is_metadata_db(self):
+        
+        # :return: True if the event concerns metadata.db or its -wal/-journal files.
+        
+        return any(path is not None and os.path.basename(path).startswith("metadata.db") for path in (self.path, self.target))
+
+    def __repr__(self):
+        return f"SyncEvent({self.action!r}, {self.path!r}, size={self.size}, failed={self.failed})"
+
+class OneDriveOutputParser:
+    
+    # Turns the output of the onedrive client into SyncEvents line by line, so a sync never has to be
+    # buffered. The most recent raw lines are kept in a ring buffer of fixed size for diagnostics.
+    
+
+    def __init__(self, history=200):
+        
+        # Initializes the OneDriveOutputParser instance.
+
+        # :param history: Number of recent raw lines to keep.
+        
+        self.recent = collections.deque(maxlen=history)
+        self.counts = collections.Counter()  # Events seen per action
+
+    def parse(self, line):
+        
+        # Parses one line of output.
+
+        # :param line: The line, without its trailing newline.
+        # :return: A SyncEvent, or None if the line does not describe an item.
+        
+        self.recent.append(line)
+        for action, pattern in PATTERNS:
+            match = pattern.search(line)
+            if match is None:
+                continue
+            groups = match.groupdict()
+            size = groups.get("size")
+            event = SyncEvent(action, groups.get("path"), size=int(size) if size else None, raw=line,
+                              target=groups.get("target"),
+                              failed=action == ERROR or groups.get("status") == "failed" or "failed" in line.lower())
+            self.counts[action] += 1
+            return event
+        return None
+
+    def tail(self, lines=20):
+        
+        # :param lines: Maximum number of lines to return.
+        # :return: The most recent raw lines, oldest first.
+        
+        return list(self.recent)[-lines:]
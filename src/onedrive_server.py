@@ -1,76 +1,623 @@
 # onedrive_server.py
 
+import logging
+import os
+import re
 import subprocess
+import threading
+import time
+
+# Matches the line `onedrive` prints when it has fetched a new copy of metadata.db, e.g.
+# "Downloading file ./Calibre Library/metadata.db ... done."
+METADATA_DOWNLOAD_PATTERN = re.compile(r"Downloading file:?\s+(.*metadata\.db)(?:\s|$)")
+
+# Seconds onedrive gets to exit after SIGTERM when its output is abandoned, before it is killed.
+TERMINATE_TIMEOUT_SECOND = 10
 
 class OneDriveServer:
     
     # Manages synchronization with OneDrive and monitors changes in the Calibre metadata database.
     
 
-    def __init__(self, util, config, calibre_server):
+    def __init__(self, util, config, calibre_server, change_detector=None, book_index=None, settle_gate=None, publisher=None, metrics=None,
+                 parser=None, state_store=None, sync_list=None, library_index=None, recorder=None):
         
         # Initializes the OneDriveServer instance.
 
         # :param util: Instance of the Utils class for logging and utility functions.
         # :param config: Configuration object containing settings.
         # :param calibre_server: Instance of the CalibreServer to manage Calibre operations.
+        # :param change_detector: Optional ChangeDetector deciding whether metadata.db content changed. If omitted, any newer modification time counts as a change.
+        # :param book_index: Optional BookIndex, refreshed after each reload to dispatch book-level changes.
+        # :param settle_gate: Optional SettleGate that holds back checks until metadata.db has stopped changing.
+        # :param publisher: Optional SnapshotPublisher that publishes the staging metadata.db before each reload.
+        # :param metrics: Optional Metrics registry recording durations and counts of each phase.
+        # :param parser: Optional OneDriveOutputParser turning onedrive output into SyncEvents. With it, metadata.db is
+        #                only checked after onedrive reported touching it.
+        # :param state_store: Optional StateStore keeping the last accepted metadata.db state across restarts.
+        # :param sync_list: Optional SyncListGenerator limiting what onedrive syncs to what the library needs.
+        # :param library_index: Optional LibraryIndex holding back reloads until the book files metadata.db references are downloaded.
+        # :param recorder: Optional CycleRecorder recording each sync cycle for offline replay.
         
         self.util = util
         self.config = config
         self.calibre_server = calibre_server
+        self.change_detector = change_detector
+        self.book_index = book_index
+        self.settle_gate = settle_gate
+        self.publisher = publisher
+        self.metrics = metrics
+        self.parser = parser
+        self.state_store = state_store
+        self.sync_list = sync_list
+        self.library_index = library_index
+        self.recorder = recorder
+        # The metadata.db written by OneDrive: the staging copy when publishing snapshots, otherwise the one Calibre-Web reads.
+        self.db_path = config.StagingMetadataDBPath or config.MetadataDBPath
         self.last_modified_time = None  # Tracks the last modification time of the metadata.db
+        self._pending_modified_time = None  # Modification time seen by the last check, recorded once handled
+        self._check_lock = threading.Lock()  # Guards _checking and _recheck
+        self.sync_lock = threading.Lock()  # Held while onedrive runs for this library
+        self.phase = "idle"  # What the library is doing, reported by status()
+        self._checking = False  # True while a check is running
+        self._recheck = False  # Set when a check was requested while another one was running
+        self._reload_requested = False  # Set by reload_now() to reload at the next check whether or not metadata.db changed
+        self._last_reconnect = None  # Whether the last check's reconnect was confirmed by Calibre-Web, None if it did not get that far
+        self.process = None  # The onedrive child process currently being read, if any
+        self._stop_event = threading.Event()  # Set to stop the monitor loop
+        self.reload_count = 0  # Number of times Calibre-Web was told to reload
+        self.checked = False  # True once metadata.db was checked, which has to happen at least once whatever onedrive reports
+        self.changed_paths = set()  # Paths other than metadata.db onedrive reported acting on during the last sync
+        self.last_error = None  # Why the last sync failed, None if it succeeded
+        self.missing_files = []  # Book files metadata.db referenced but that were not downloaded at the last check
+        self._incomplete_since = None  # When reloads started being held back for missing book files
+        self.metric_labels = {"library": config.LibraryName}
+        if self.metrics is not None:
+            self._describe_metrics()
+        if self.state_store is not None:
+            self._restore_state()
 
     def call_onedrive(self, onFinish):
         
         # Initiates the OneDrive synchronization process. After syncing, it checks if the Calibre metadata database has changed and reloads the Calibre server if necessary.
 
-        # :param onFinish: Callback function to execute upon completion.
+        # :param onFinish: Callback function to execute upon completion, whether the sync succeeded or not.
+        # :return: True if Calibre-Web was reloaded, False if nothing changed, None if the sync failed.
+        
+        # The lock keeps uploads of local edits from running while onedrive is pulling.
+        with self.sync_lock:
+            try:
+                result = self._synchronize()
+            finally:
+                self.phase = "idle"
+
+        # Always hand control back, so a failed sync can never stop the schedule.
+        onFinish()
+        return result
+
+    def _synchronize(self):
+        
+        # Runs `onedrive --synchronize` and checks metadata.db afterwards.
+
+        # :return: True if Calibre-Web was reloaded, False if nothing changed, None if the sync failed.
         
         self.util.log("Starting OneDrive sync...")
+        self.phase = "syncing"
+        started = time.monotonic()
+        reload_count = self.reload_count
+        output_lines = 0
+        output_bytes = 0
+        metadata_changed = False
+        self.changed_paths = set()
+        result = None
+        exit_code = None
+        timed_out = False
+        if self.recorder is not None:
+            self.recorder.begin(self._fingerprint())
         try:
             # Execute the OneDrive synchronization command and log its output.
-            for output in self._execute(["onedrive", "--synchronize"]):
-                self.util.log(output.strip())
+            for output in self._execute(self._onedrive_command("--synchronize"), timeout=self.config.SyncTimeoutSecond):
+                self.util.debug(output)
+                if self.recorder is not None:
+                    self.recorder.output(output)
+                output_lines += 1
+                # Bytes rather than characters, including the newline stripped by _execute.
+                output_bytes += len(output.encode()) + 1
+                event = self._parse(output)
+                if event is not None and not event.failed:
+                    if event.is_metadata_db:
+                        metadata_changed = True
+                    elif event.path:
+                        self.changed_paths.add(event.path)
             self.util.log("OneDrive sync finished.")
-        except subprocess.CalledProcessError as e:
-            self.util.log(f"OneDrive sync failed: {e}")
-            return
+            exit_code = 0
+            self.last_error = None
+            if self.sync_list is not None:
+                self.sync_list.resync_required = False
+        except subprocess.TimeoutExpired as e:
+            self.last_error = f"OneDrive sync timed out after {e.timeout} seconds and was killed."
+            self.util.log(self.last_error, logging.ERROR)
+            timed_out = True
+            self._log_recent_output()
+            self._record_cycle(started, output_lines, output_bytes, failed=True, reloaded=False)
+        except (subprocess.CalledProcessError, OSError) as e:
+            self.last_error = f"OneDrive sync failed: {e}"
+            self.util.log(self.last_error, logging.ERROR)
+            exit_code = getattr(e, "returncode", None)
+            self._log_recent_output()
+            self._record_cycle(started, output_lines, output_bytes, failed=True, reloaded=False)
+        else:
+            if self.parser is not None and self.config.SkipCheckWithoutDBEvent and self.checked and not metadata_changed:
+                self.util.log("OneDrive reported no change to metadata.db. No need to check it.")
+            else:
+                # Check for changes in the metadata database and reload Calibre if needed.
+                self._check_and_reload_calibre()
+            result = self.reload_count > reload_count
+            self._record_cycle(started, output_lines, output_bytes, failed=False, reloaded=result)
+            if self.state_store is not None:
+                self.state_store.set("last_sync_time", time.time())
+        if self.recorder is not None:
+            self.recorder.end(exit_code, self._fingerprint(), result, timed_out=timed_out)
+        return result
+
+    def run_monitor(self):
         
-        # Check for changes in the metadata database and reload Calibre if needed.
+        # Supervises a long-running `onedrive --monitor` process. Its output is streamed line by line and
+        # metadata.db is checked as soon as onedrive reports downloading it. If the process exits it is
+        # restarted with exponential backoff. Blocks until stop() is called.
+        
+        self._stop_event.clear()
+        # Make sure Calibre-Web starts from the current database before waiting for events.
         self._check_and_reload_calibre()
-        onFinish()
 
-    def _execute(self, cmd):
+        backoff = self.config.MonitorRestartMinSecond
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            restart = False
+            self.util.log("Starting OneDrive monitor...")
+            cmd = self._onedrive_command("--monitor")
+            resync = "--resync" in cmd
+            try:
+                for output in self._execute(cmd):
+                    self.util.debug(output)
+                    if self.parser is not None:
+                        event = self._parse(output)
+                        metadata_changed = event is not None and event.is_metadata_db and not event.failed
+                    else:
+                        metadata_changed = METADATA_DOWNLOAD_PATTERN.search(output) and "failed" not in output.lower()
+                    if metadata_changed:
+                        self._check_and_reload_calibre()
+                        # onedrive reads sync_list only when it starts, so restart it when the list changed.
+                        if self.sync_list is not None and self.sync_list.update():
+                            self.util.log("sync_list changed. Restarting OneDrive monitor...")
+                            restart = True
+                            self._terminate()
+                if resync and not restart:
+                    # Only a run with --resync that exited successfully, on the list it started with, clears the request.
+                    self.sync_list.resync_required = False
+                if not restart:
+                    self.util.log("OneDrive monitor exited.", logging.WARNING)
+            except subprocess.CalledProcessError as e:
+                if not restart:
+                    self.util.log(f"OneDrive monitor failed: {e}", logging.ERROR)
+            except OSError as e:
+                self.util.log(f"Could not start OneDrive monitor: {e}", logging.ERROR)
+
+            if self._stop_event.is_set():
+                break
+            if restart:
+                continue
+
+            # A monitor that ran for a while was healthy, so start backing off from scratch.
+            if time.monotonic() - started >= self.config.MonitorRestartMaxSecond:
+                backoff = self.config.MonitorRestartMinSecond
+            self.util.log(f"Restarting OneDrive monitor in {backoff} seconds...", logging.WARNING)
+            self._stop_event.wait(backoff)
+            backoff = min(backoff * 2, self.config.MonitorRestartMaxSecond)
+
+    def reload_now(self):
+        
+        # Reconnects Calibre-Web whether or not metadata.db changed, e.g. when asked through the control endpoint.
+
+        # :return: True if Calibre-Web answered the reconnect, False if it did not or metadata.db could not be published,
+        #          None if the reload was queued behind a running check or deferred until metadata.db settles.
+        
+        # Goes through the same coalescing as the checks, so it never publishes or reconnects alongside one.
+        with self._check_lock:
+            self._reload_requested = True
+        if not self._check_and_reload_calibre():
+            self.util.log("Reload requested while metadata.db is being checked. Reloading once the check finished.")
+            return None
+        return self._last_reconnect
+
+    def status(self):
+        
+        # :return: Dict describing the state of the library, for the control endpoint.
+        
+        return {
+            "phase": self.phase,
+            "reload_count": self.reload_count,
+            "metadata_checked": self.checked,
+            "changed_paths": len(self.changed_paths),
+            "missing_files": len(self.missing_files),
+            "last_error": self.last_error,
+        }
+
+    def stop(self):
+        
+        # Stops the monitor loop and terminates the running onedrive process, if any.
+        
+        self._stop_event.set()
+        self._terminate()
+
+    def _terminate(self):
+        
+        # Terminates the running onedrive process, if any.
+        
+        process = self.process
+        if process and process.poll() is None:
+            process.terminate()
+
+    def run_onedrive(self, *args, timeout=None):
+        
+        # Runs onedrive for this library, logging its output at DEBUG and parsing it like the output of a sync.
+        # Closing the generator early terminates onedrive.
+
+        # :param args: Arguments of the command, e.g. "--synchronize", "--upload-only".
+        # :param timeout: Seconds after which onedrive is killed (None or 0 for no limit).
+        # :return: Generator yielding (output line, SyncEvent or None) tuples.
+        # :raises subprocess.CalledProcessError: If onedrive exits with a non-zero status.
+        # :raises subprocess.TimeoutExpired: If onedrive was killed because it ran longer than the timeout.
+        
+        lines = self._execute(self._onedrive_command(*args), timeout=timeout)
+        try:
+            for output in lines:
+                self.util.debug(output)
+                yield output, self._parse(output)
+        finally:
+            lines.close()
+
+    def _onedrive_command(self, *args):
+        
+        # Builds the onedrive command line for this library.
+
+        # :param args: Arguments selecting the mode, e.g. "--synchronize".
+        # :return: List of command arguments.
+        
+        cmd = ["onedrive", *args]
+        if self.config.OneDriveConfDir:
+            cmd += ["--confdir", self.config.OneDriveConfDir]
+        if self.sync_list is not None:
+            self.sync_list.update()
+            # onedrive refuses to run after its sync_list changed until it rescanned everything once.
+            if self.sync_list.resync_required:
+                cmd += ["--resync", "--resync-auth"]
+        return cmd
+
+    def _execute(self, cmd, timeout=None):
         
         # Executes a shell command and yields its output line by line.
 
         # :param cmd: List of command arguments to execute.
+        # :param timeout: Seconds after which the command is killed (None or 0 for no limit).
         # :return: Generator yielding output lines from the command.
         # :raises subprocess.CalledProcessError: If the command exits with a non-zero status.
+        # :raises subprocess.TimeoutExpired: If the command was killed because it ran longer than the timeout.
         
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
-        if process.stdout:
-            for stdout_line in iter(process.stdout.readline, ""):
-                yield stdout_line.strip()
-        process.wait()
+        # stderr is merged into stdout so that errors reach the log and the parser in order with the rest.
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        self.process = process
+        started = time.monotonic()
+        # A watchdog kills the process, which closes its output and ends the loop below even if it hangs silently.
+        watchdog = None
+        timed_out = threading.Event()
+        if timeout:
+            def kill():
+                timed_out.set()
+                process.kill()
+            watchdog = threading.Timer(timeout, kill)
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            if process.stdout:
+                for stdout_line in iter(process.stdout.readline, ""):
+                    yield stdout_line.strip()
+            process.wait()
+        finally:
+            if process.poll() is None:
+                # The caller stopped reading early; do not leave onedrive running on the same confdir.
+                process.terminate()
+                try:
+                    process.wait(timeout=TERMINATE_TIMEOUT_SECOND)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            if process.stdout:
+                process.stdout.close()
+            if watchdog is not None:
+                watchdog.cancel()
+            self.process = None
+            if self.metrics is not None:
+                self.metrics.observe("onedrive_process_duration_seconds", time.monotonic() - started, labels=self.metric_labels)
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
         if process.returncode != 0:
             raise subprocess.CalledProcessError(process.returncode, cmd)
 
+    def _parse(self, output):
+        
+        # Parses one line of onedrive output and counts the event it describes.
+
+        # :param output: The output line.
+        # :return: A SyncEvent, or None if there is no parser or the line describes no item.
+        
+        if self.parser is None:
+            return None
+        event = self.parser.parse(output)
+        if event is not None and self.library_index is not None and not event.failed:
+            for path in (event.path, event.target):
+                if path:
+                    self.library_index.note(path)
+        if event is not None and self.metrics is not None:
+            self.metrics.inc("onedrive_events_total", labels=dict(self.metric_labels, action=event.action, failed=str(event.failed).lower()))
+        return event
+
+    def _log_recent_output(self):
+        
+        # Logs the last lines onedrive printed, to explain a failed sync even when its output is not logged at DEBUG.
+        
+        if self.parser is not None and self.parser.recent:
+            self.util.log("Last OneDrive output:\n" + "\n".join(self.parser.tail()), logging.ERROR)
+
     def _check_and_reload_calibre(self):
         
         # Checks if the Calibre metadata database has been modified since the last check.
         # If changes are detected, instructs the Calibre server to reconnect.
         
-        current_modified_time = self.util.get_last_modified_time(self.config.MetadataDBPath)
+        # Requests arriving while a check is running (from the sync loop, the watcher or the monitor) are
+        # collapsed into a single follow-up check instead of each causing a reload.
+
+        # :return: True if this call ran the check, False if it was left to the check already running.
         
-        if current_modified_time is None:
-            self.util.log("Could not determine the last modified time of the metadata database.")
+        with self._check_lock:
+            if self._checking:
+                self._recheck = True
+                return False
+            self._checking = True
+
+        try:
+            while True:
+                self._check_metadata_db()
+                with self._check_lock:
+                    if not self._recheck:
+                        return True
+                    self._recheck = False
+        finally:
+            with self._check_lock:
+                self._checking = False
+
+    def _check_metadata_db(self):
+        
+        # Reconnects Calibre-Web if metadata.db changed since the last check. Only one call runs at a time.
+        
+        started = time.monotonic()
+        phase = self.phase
+        self.phase = "checking"
+        try:
+            self._reload_if_changed()
+        finally:
+            self.phase = phase
+            if self.metrics is not None:
+                self.metrics.observe("metadata_check_duration_seconds", time.monotonic() - started, labels=self.metric_labels)
+
+    def _reload_if_changed(self):
+        
+        # Waits for metadata.db to settle, detects changes, publishes the snapshot and reconnects Calibre-Web.
+        
+        # Until this check completes, the next sync has to check metadata.db again even if onedrive reports nothing.
+        self.checked = False
+        # Stays None while a requested reload is deferred, so reload_now() does not report an earlier result.
+        self._last_reconnect = None
+        if self.settle_gate is not None and not self.settle_gate.wait():
+            self.util.log("metadata.db is still changing. Will check again later.")
             return
 
-        # If it's the first check or if the database has been modified since the last check.
-        if self.last_modified_time is None or current_modified_time > self.last_modified_time:
-            self.util.log("Changes detected in metadata.db. Reloading CalibreWeb DB...")
-            self.calibre_server.reconnect()
-            self.last_modified_time = current_modified_time
+        with self._check_lock:
+            forced, self._reload_requested = self._reload_requested, False
+        changed = self._detect_change()
+        if changed is None and not forced:
+            return
+
+        if changed or forced:
+            # A requested reload does not wait for missing book files.
+            if changed and not forced and self.library_index is not None and not self._library_complete():
+                return
+            self.phase = "publishing"
+            self._last_reconnect = False
+            if self.publisher is not None and not self.publisher.publish():
+                self.util.log("Could not publish metadata.db. Will check again later.", logging.ERROR)
+                return
+            if changed:
+                self.util.log("Changes detected in metadata.db. Reloading CalibreWeb DB...")
+            else:
+                self.util.log("Reload requested. Reloading CalibreWeb DB...")
+            self.phase = "reloading"
+            self._last_reconnect = bool(self._reconnect())
+            if not self._last_reconnect:
+                # Keep the change pending, so the next check reloads Calibre-Web again.
+                self.util.log("CalibreWeb did not confirm the reload. Will check again later.", logging.WARNING)
+                return
+            self.reload_count += 1
+            if changed is None:
+                return
+            if changed:
+                self._accept_change()
+            if self.metrics is not None:
+                self.metrics.inc("reloads_total", labels=self.metric_labels)
+                self._observe_change_latency()
+            if self.book_index is not None:
+                self.book_index.refresh()
+            if self.sync_list is not None:
+                self.sync_list.invalidate()
         else:
             self.util.log("No changes detected in metadata.db. No need to reload CalibreWeb DB.")
+        self.checked = True
+        self.save_state()
+
+    def _library_complete(self):
+        
+        # Waits for the book files the changed metadata.db references. Reloads are held back while files are
+        # missing, for at most config.IntegrityMaxWaitSecond; after that Calibre-Web is reloaded anyway.
+
+        # :return: True if Calibre-Web can be reloaded, False if the reload has to wait for the next check.
+        
+        self.phase = "verifying"
+        # Without parsed output the index does not know which files onedrive touched, so it rescans the library.
+        missing = self.library_index.wait(full=self.parser is None)
+        if missing is None:
+            # The files could not be checked; do not let that block the reload.
+            return True
+        self.missing_files = missing
+        if self.metrics is not None:
+            self.metrics.set("library_missing_files", len(missing), labels=self.metric_labels)
+        if not missing:
+            self._incomplete_since = None
+            return True
+
+        if self._incomplete_since is None:
+            self._incomplete_since = time.monotonic()
+        examples = ", ".join(missing[:5]) + (", ..." if len(missing) > 5 else "")
+        if time.monotonic() - self._incomplete_since < self.config.IntegrityMaxWaitSecond:
+            self.util.log(f"{len(missing)} book files referenced by metadata.db are missing or incomplete ({examples}). Will check again later.", logging.WARNING)
+            return False
+        self.util.log(f"{len(missing)} book files referenced by metadata.db are still missing or incomplete after "
+                      f"{self.config.IntegrityMaxWaitSecond} seconds ({examples}). Reloading CalibreWeb DB anyway.", logging.WARNING)
+        self._incomplete_since = None
+        return True
+
+    def _reconnect(self):
+        
+        # Tells Calibre-Web to reconnect to metadata.db, timing it for the recorder.
+
+        # :return: True if Calibre-Web confirmed the reconnect, False otherwise.
+        
+        started = time.monotonic()
+        reconnected = self.calibre_server.reconnect()
+        if self.recorder is not None:
+            self.recorder.reconnect(started, time.monotonic() - started, bool(reconnected))
+        return reconnected
+
+    def _fingerprint(self):
+        
+        # :return: Fingerprint of metadata.db from the change detector, or its modification time without one.
+        
+        if self.change_detector is not None:
+            return self.change_detector.fingerprint()
+        return self.util.get_last_modified_time(self.db_path)
+
+    def _detect_change(self):
+        
+        # Asks the change detector whether metadata.db changed. Without a detector, compares modification times.
+
+        # :return: True if changed (or on the first check), False if not, None if it could not be determined.
+        
+        if self.change_detector is not None:
+            changed = self.change_detector.has_changed()
+            if changed is None:
+                self.util.log("Could not determine whether the metadata database changed.", logging.ERROR)
+            return changed
+
+        current_modified_time = self.util.get_last_modified_time(self.db_path)
+        
+        if current_modified_time is None:
+            self.util.log("Could not determine the last modified time of the metadata database.", logging.ERROR)
+            return None
+
+        # If it's the first check or if the database has been modified since the last check.
+        self._pending_modified_time = current_modified_time
+        return self.last_modified_time is None or current_modified_time > self.last_modified_time
+
+    def _accept_change(self):
+        
+        # Records the state seen by the last _detect_change() call as handled.
+        
+        if self.change_detector is not None:
+            self.change_detector.accept()
+        else:
+            self.last_modified_time = self._pending_modified_time
+
+    def _restore_state(self):
+        
+        # Loads the metadata.db state accepted by a previous run, so that an unchanged database is not reloaded after a restart.
+        
+        state = self.state_store.load()
+        if self.change_detector is not None:
+            restored = self.change_detector.restore(state.get("change_detector"))
+        else:
+            self.last_modified_time = state.get("last_modified_time")
+            restored = self.last_modified_time is not None
+        if restored:
+            self.util.log("Restored the metadata.db state of the previous run.")
+
+    def save_state(self):
+        
+        # Persists the accepted metadata.db state after a completed check.
+        
+        if self.state_store is None:
+            return
+        if self.change_detector is not None:
+            self.state_store.set("change_detector", self.change_detector.state())
+        else:
+            self.state_store.set("last_modified_time", self.last_modified_time)
+
+    def _observe_change_latency(self):
+        
+        # Records the time from the last write to metadata.db until Calibre-Web was told to reload.
+        
+        try:
+            latency = time.time() - os.path.getmtime(self.db_path)
+        except OSError:
+            return
+        self.metrics.observe("change_to_reload_seconds", max(latency, 0.0), labels=self.metric_labels)
+
+    def _record_cycle(self, started, output_lines, output_bytes, failed, reloaded):
+        
+        # Records the metrics of one sync cycle and writes its JSON summary, if enabled.
+
+        # :param started: Monotonic time the cycle started.
+        # :param output_lines: Number of lines the onedrive client printed.
+        # :param output_bytes: Number of bytes the onedrive client printed.
+        # :param failed: Whether the onedrive client failed.
+        # :param reloaded: Whether Calibre-Web was reloaded.
+        
+        if self.metrics is None:
+            return
+        duration = time.monotonic() - started
+        self.metrics.observe("sync_cycle_duration_seconds", duration, labels=self.metric_labels)
+        self.metrics.inc("onedrive_output_lines_total", output_lines, labels=self.metric_labels)
+        self.metrics.inc("onedrive_output_bytes_total", output_bytes, labels=self.metric_labels)
+        if failed:
+            self.metrics.inc("onedrive_sync_failures_total", labels=self.metric_labels)
+        self.metrics.record_cycle({
+            "library": self.config.LibraryName,
+            "duration_seconds": round(duration, 3),
+            "output_lines": output_lines,
+            "output_bytes": output_bytes,
+            "failed": failed,
+            "reloaded": reloaded,
+        })
+
+    def _describe_metrics(self):
+        
+        # Registers type and help text of the metrics recorded by this class.
+        
+        self.metrics.describe("sync_cycle_duration_seconds", "histogram", "Duration of a sync cycle including the metadata.db check.")
+        self.metrics.describe("onedrive_process_duration_seconds", "histogram", "Lifetime of an onedrive client process.")
+        self.metrics.describe("onedrive_output_lines_total", "counter", "Lines printed by the onedrive client.")
+        self.metrics.describe("onedrive_output_bytes_total", "counter", "Bytes printed by the onedrive client.")
+        self.metrics.describe("onedrive_sync_failures_total", "counter", "onedrive client runs that exited with an error.")
+        self.metrics.describe("onedrive_events_total", "counter", "Items the onedrive client reported downloading, uploading, deleting, moving or renaming.")
+        self.metrics.describe("metadata_check_duration_seconds", "histogram", "Duration of the metadata.db check, including settling, publishing and reloading.")
+        self.metrics.describe("reloads_total", "counter", "Times Calibre-Web was told to reload metadata.db.")
+        self.metrics.describe("library_missing_files", "gauge", "Book files metadata.db referenced but that were missing or incomplete at the last check.")
+        self.metrics.describe("change_to_reload_seconds", "histogram", "Time from the last write to metadata.db until Calibre-Web was told to reload.")
@@ -0,0 +1,121 @@
+# settle_gate.py
+
+import logging
+import os
+import sqlite3
+import time
+import urllib.parse
+
+# First bytes of a rollback journal holding an uncommitted transaction (a "hot" journal). SQLite zeroes or
+# truncates the header when the transaction ends, and a journal without it is ignored by readers.
+JOURNAL_MAGIC = b"\xd9\xd5\x05\xf9\x20\xa1\x63\xd7"
+
+class SettleGate:
+
+    # Holds back a Calibre-Web reload until metadata.db and its -wal/-journal files have stopped changing,
+    # and optionally until SQLite reports the database as consistent.
+
+
+    def __init__(self, util, config, db_path=None):
+
+        # Initializes the SettleGate instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param db_path: Path to the metadata.db to watch. Defaults to config.MetadataDBPath.
+
+        self.util = util
+        self.config = config
+        self.db_path = db_path or config.MetadataDBPath
+        self.last_settled = None  # Signature of the files the last time they were found settled
+        self._stale_journal = None  # Signature of the hot journal a wait timed out on
+
+    def wait(self):
+
+        # Blocks until the files have been unchanged for the settle window, or the settle timeout passes.
+        # Returns immediately if nothing changed since the files last settled.
+
+        # :return: True if the database is settled (and passed the quick check, if enabled), False otherwise.
+
+        signature = self.signature()
+        if signature == self.last_settled:
+            return True
+
+        deadline = time.monotonic() + self.config.SettleTimeoutSecond
+        stable_since = time.monotonic()
+        while True:
+            in_transaction = self.in_transaction(signature[2])
+            if not in_transaction and time.monotonic() - stable_since >= self.config.SettleWindowSecond:
+                break
+            if time.monotonic() >= deadline:
+                self.util.log(f"metadata.db did not settle within {self.config.SettleTimeoutSecond} seconds.", logging.WARNING)
+                if in_transaction:
+                    self._stale_journal = signature[2]
+                return False
+            time.sleep(self.config.SettlePollSecond)
+            current = self.signature()
+            if current != signature:
+                signature = current
+                stable_since = time.monotonic()
+
+        if self.config.SettleQuickCheck and not self.quick_check():
+            return False
+
+        self.last_settled = signature
+        return True
+
+    def in_transaction(self, journal_signature):
+
+        # Tells whether the rollback journal belongs to a transaction in progress. Only a hot journal does, and
+        # one still unchanged after a wait timed out on it is taken as the leftover of a writer that died or of
+        # a sync that copied it, so it cannot hold back reloads for good.
+
+        # :param journal_signature: Entry of the -journal file in the signature, None if it does not exist.
+        # :return: True if a writer is in the middle of a transaction.
+
+        return journal_signature is not None and journal_signature != self._stale_journal and self.journal_is_hot()
+
+    def journal_is_hot(self):
+
+        # :return: True if the -journal file is non-empty and starts with a valid journal header.
+
+        try:
+            with open(self.db_path + "-journal", "rb") as journal:
+                return journal.read(len(JOURNAL_MAGIC)) == JOURNAL_MAGIC
+        except OSError:
+            return False
+
+    def signature(self):
+
+        # Describes size, mtime and inode of metadata.db and its -wal and -journal files.
+
+        # :return: A tuple with one entry per file, None for files that do not exist.
+
+        entries = []
+        for path in (self.db_path, self.db_path + "-wal", self.db_path + "-journal"):
+            try:
+                stat = os.stat(path)
+                entries.append((stat.st_size, stat.st_mtime_ns, stat.st_ino))
+            except OSError:
+                entries.append(None)
+        return tuple(entries)
+
+    def quick_check(self):
+
+        # Runs PRAGMA quick_check on a read-only connection.
+
+        # :return: True if SQLite reports the database as consistent, False otherwise.
+
+        try:
+            connection = sqlite3.connect(f"file:{urllib.parse.quote(self.db_path)}?mode=ro", uri=True)
+            try:
+                result = connection.execute("PRAGMA quick_check").fetchone()[0]
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            self.util.log(f"Quick check of metadata.db failed: {e}", logging.ERROR)
+            return False
+        if result != "ok":
+            self.util.log(f"Quick check of metadata.db reported: {result}")
+            return False
+        return True
@@ -0,0 +1,107 @@
+# snapshot_publisher.py
+
+import logging
+import os
+import sqlite3
+import urllib.parse
+
+class SnapshotPublisher:
+
+    # Publishes the metadata.db that OneDrive syncs into a staging library to the path Calibre-Web reads.
+    # The copy is made with the SQLite online backup API into a temporary file next to the published path
+    # and then swapped in with an atomic rename, so Calibre-Web never sees a partially written database.
+
+
+    def __init__(self, util, config):
+
+        # Initializes the SnapshotPublisher instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+
+        self.util = util
+        self.config = config
+        self.staging_path = config.StagingMetadataDBPath
+        self.published_path = config.MetadataDBPath
+
+    def publish(self):
+
+        # Copies the staging metadata.db to the published path and swaps it in atomically.
+
+        # :return: True if the new snapshot was published, False otherwise.
+
+        temporary_path = self.published_path + ".publishing"
+        try:
+            self._remove(temporary_path)
+            source = sqlite3.connect(f"file:{urllib.parse.quote(self.staging_path)}?mode=ro", uri=True)
+            try:
+                target = sqlite3.connect(temporary_path)
+                try:
+                    # Copy in steps so the staging database is not locked against OneDrive for the whole copy.
+                    source.backup(target, pages=self.config.PublishPagesPerStep, sleep=self.config.PublishStepSleepSecond)
+                    # Readers should only ever need the single published file, never a WAL next to it.
+                    target.execute("PRAGMA journal_mode=DELETE")
+                finally:
+                    target.close()
+            finally:
+                source.close()
+
+            os.replace(temporary_path, self.published_path)
+            self._sync_directory(os.path.dirname(os.path.abspath(self.published_path)))
+        except (sqlite3.Error, OSError) as e:
+            self.util.log(f"Failed to publish metadata.db snapshot: {e}", logging.ERROR)
+            self._remove(temporary_path)
+            return False
+
+        if self.config.PublishLinkBooks:
+            self.link_books()
+        self.util.log(f"Published metadata.db snapshot to {self.published_path}.")
+        return True
+
+    def link_books(self):
+
+        # Makes the book folders of the staging library visible next to the published metadata.db by
+        # symlinking each top-level entry (one per author). Links whose target disappeared are removed.
+
+        staging_dir = os.path.dirname(os.path.abspath(self.staging_path))
+        published_dir = os.path.dirname(os.path.abspath(self.published_path))
+        db_name = os.path.basename(self.staging_path)
+        try:
+            wanted = {entry.name for entry in os.scandir(staging_dir) if not entry.name.startswith(db_name)}
+            for entry in os.scandir(published_dir):
+                if entry.is_symlink() and entry.name not in wanted:
+                    os.unlink(entry.path)
+            for name in wanted:
+                link = os.path.join(published_dir, name)
+                if not os.path.lexists(link):
+                    os.symlink(os.path.join(staging_dir, name), link)
+        except OSError as e:
+            self.util.log(f"Failed to link book folders into {published_dir}: {e}", logging.ERROR)
+
+    def _sync_directory(self, path):
+
+        # Flushes a directory entry to disk so the rename survives a crash.
+
+        # :param path: Directory to sync.
+
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _remove(self, path):
+
+        # Removes a file if it exists.
+
+        # :param path: File to remove.
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
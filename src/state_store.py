@@ -0,0 +1,89 @@
+# state_store.py
+
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+
+class StateStore:
+    
+    # Durable key-value state of one library, kept in a small SQLite file (config.StatePath) shared by all
+    # libraries. It lets a restarted daemon resume from the last accepted metadata.db state instead of
+    # treating its first check as a change. Values are stored as JSON and every update is one transaction,
+    # so a crash leaves either the old or the new state, never a mix.
+    
+
+    def __init__(self, util, config, library=None, path=None):
+        
+        # Initializes the StateStore instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param library: Name of the library the state belongs to. Defaults to config.LibraryName.
+        # :param path: Path of the state file. Defaults to config.StatePath.
+        
+        self.util = util
+        self.config = config
+        self.library = library or config.LibraryName
+        self.path = path or config.StatePath
+
+    def load(self):
+        
+        # Reads the whole state of the library.
+
+        # :return: Dict of key to value, empty if nothing was stored or the file could not be read.
+        
+        try:
+            with closing(self._connect()) as connection:
+                rows = connection.execute("SELECT key, value FROM sync_state WHERE library = ?", (self.library,)).fetchall()
+        except sqlite3.Error as e:
+            self.util.log(f"Error reading sync state from {self.path}: {e}", logging.ERROR)
+            return {}
+        return {key: json.loads(value) for key, value in rows}
+
+    def get(self, key, default=None):
+        
+        # :param key: Name of the value.
+        # :param default: Value returned if the key was never stored.
+        # :return: The stored value, or the default.
+        
+        return self.load().get(key, default)
+
+    def update(self, values):
+        
+        # Stores several values in one transaction.
+
+        # :param values: Dict of key to JSON-serializable value.
+        # :return: True if the values were written, False otherwise.
+        
+        rows = [(self.library, key, json.dumps(value), time.time()) for key, value in values.items()]
+        try:
+            with closing(self._connect()) as connection, connection:
+                connection.executemany("INSERT OR REPLACE INTO sync_state (library, key, value, updated) VALUES (?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            self.util.log(f"Error writing sync state to {self.path}: {e}", logging.ERROR)
+            return False
+        return True
+
+    def set(self, key, value):
+        
+        # Stores one value.
+
+        # :param key: Name of the value.
+        # :param value: JSON-serializable value.
+        # :return: True if the value was written, False otherwise.
+        
+        return self.update({key: value})
+
+    def _connect(self):
+        
+        # Opens the state file, creating its table if needed. A connection per call keeps the store usable
+        # from the sync threads of several libraries at once; the file is tiny, so this is cheap.
+
+        # :return: An sqlite3 connection.
+        
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute("CREATE TABLE IF NOT EXISTS sync_state (library TEXT NOT NULL, key TEXT NOT NULL, value TEXT, updated REAL, "
+                           "PRIMARY KEY (library, key))")
+        return connection
@@ -0,0 +1,125 @@
+# sync_list.py
+
+import datetime
+import logging
+import os
+import sqlite3
+import urllib.parse
+
+class SyncListGenerator:
+    
+    # Writes an onedrive `sync_list` limiting the sync to what Calibre-Web needs: metadata.db, the covers and
+    # the book files, optionally only some formats and only recently modified books. The list is built from
+    # the `books` and `data` tables of metadata.db and rewritten only when its content changes. onedrive
+    # refuses to run after any change to the list, added rules included, until it ran once with --resync,
+    # so every rewrite requests one.
+    
+
+    def __init__(self, util, config, db_path=None, path=None):
+        
+        # Initializes the SyncListGenerator instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param db_path: Path to the metadata.db the list is built from. Defaults to config.MetadataDBPath.
+        # :param path: Path of the sync_list file. Defaults to sync_list in config.OneDriveConfDir or ~/.config/onedrive.
+        
+        self.util = util
+        self.config = config
+        self.db_path = db_path or config.MetadataDBPath
+        self.path = path or os.path.join(config.OneDriveConfDir or os.path.expanduser("~/.config/onedrive"), "sync_list")
+        # Folder of the library relative to the OneDrive root, e.g. "Calibre Library".
+        self.library_folder = config.library_folder(self.db_path)
+        self.formats = [f.strip().lower() for f in config.SyncListFormats.split(",") if f.strip()]
+        self.recent_days = config.SyncListRecentDays
+        self.resync_required = False  # True from a rewrite until onedrive ran successfully with --resync
+        self._dirty = True  # True when the library changed since the list was last generated
+        self._cutoff_day = None  # Day the recent-books cutoff was computed for
+
+    def invalidate(self):
+        
+        # Marks the list for regeneration, e.g. after metadata.db changed.
+        
+        self._dirty = True
+
+    def update(self):
+        
+        # Regenerates the list if the library changed or the recent-books cutoff moved to another day, and
+        # rewrites the file if its content differs.
+
+        # :return: True if the file was rewritten, False otherwise.
+        
+        today = datetime.date.today()
+        if not self._dirty and (not self.recent_days or self._cutoff_day == today):
+            return False
+
+        lines = self.generate()
+        if lines is None:
+            return False
+        self._dirty = False
+        self._cutoff_day = today
+
+        content = "".join(line + "\n" for line in lines)
+        try:
+            with open(self.path) as existing:
+                previous = existing.read()
+        except OSError:
+            previous = None
+        if previous == content:
+            return False
+
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as sync_list:
+                sync_list.write(content)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            self.util.log(f"Error writing {self.path}: {e}", logging.ERROR)
+            return False
+        self.resync_required = True
+        self.util.log(f"Wrote {len(lines)} rules to {self.path}.")
+        return True
+
+    def generate(self):
+        
+        # Builds the rules of the list.
+
+        # :return: List of sync_list lines, or None if metadata.db could not be read.
+        
+        root = f"/{self.library_folder}"
+        lines = ["# Generated by CalibreOneDriveSync from metadata.db. Changes are overwritten.",
+                 f"{root}/metadata.db", f"{root}/*/*/cover.jpg"]
+
+        if not self.recent_days:
+            if not self.formats:
+                return [lines[0], f"{root}/"]
+            return lines + [f"{root}/*/*/*.{book_format}" for book_format in self.formats]
+
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=self.recent_days)
+        try:
+            connection = sqlite3.connect(f"file:{urllib.parse.quote(self.db_path)}?mode=ro", uri=True)
+        except sqlite3.Error as e:
+            self.util.log(f"Error opening {self.db_path}: {e}", logging.ERROR)
+            return None
+        try:
+            # last_modified is stored as ISO text, so the newest books are a range scan on the text.
+            rows = connection.execute("""
+                SELECT b.path, d.name, d.format FROM books b LEFT JOIN data d ON d.book = b.id
+                WHERE b.last_modified >= ? ORDER BY b.path, d.format
+            """, (cutoff.isoformat(sep=" "),)).fetchall()
+        except sqlite3.Error as e:
+            self.util.log(f"Error reading {self.db_path}: {e}", logging.ERROR)
+            return None
+        finally:
+            connection.close()
+
+        for book_path, name, book_format in rows:
+            if not self.formats:
+                line = f"{root}/{book_path}/"
+            elif book_format and book_format.lower() in self.formats:
+                line = f"{root}/{book_path}/{name}.{book_format.lower()}"
+            else:
+                continue
+            if line != lines[-1]:
+                lines.append(line)
+        return lines
@@ -0,0 +1,237 @@
+# sync_scheduler.py
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class SyncJob:
+    
+    # A periodic job of the SyncScheduler, usually the OneDrive sync of one library.
+    
+
+    def __init__(self, name, run, interval, min_interval=None, max_interval=None):
+        
+        # Initializes the SyncJob instance.
+
+        # :param name: Name of the job, used in logs.
+        # :param run: Callable doing one run of the job. It returns True if the run found changes, False if it
+        #             found none and None if it failed; any other value counts as no changes.
+        # :param interval: Seconds between the end of one run and the start of the next.
+        # :param min_interval: Interval after a run that found changes. Defaults to the interval.
+        # :param max_interval: Longest interval reached by backing off while idle. Defaults to the interval.
+        
+        self.name = name
+        self.run = run
+        self.interval = interval  # Current interval, adapted after each run
+        self.min_interval = interval if min_interval is None else min_interval
+        self.max_interval = interval if max_interval is None else max_interval
+        self.failures = 0  # Consecutive failed runs
+        self.running = False  # True while a run is in progress
+        self.rerun = False  # Set when the job was triggered while running, to run again right after
+        self.token = None  # Sequence number of the queue entry that is current; older entries are ignored
+        self.next_due = None  # Monotonic time the next run is due
+        self.last_duration = None  # Seconds the last run took
+        self.last_error = None  # Error raised by the last run, if any
+        self.last_result = None  # Value returned by the last run
+        self.last_run = None  # Wall-clock time the last run ended
+
+class SyncScheduler:
+    
+    # Runs periodic jobs on a bounded thread pool, each at its own interval. A job is rescheduled when its
+    # run ends, whether it succeeded or not, so one slow or failing library never delays or stops the others.
+
+    # The interval adapts to the results: a run that found changes drops it to the job's minimum, every idle
+    # run multiplies it by config.SyncBackoffFactor up to the maximum, and failed runs are retried after
+    # config.SyncFailureRetrySecond, doubling with each consecutive failure. All delays get random jitter so
+    # that libraries do not hit OneDrive in lockstep.
+    
+
+    def __init__(self, util, config):
+        
+        # Initializes the SyncScheduler instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        
+        self.util = util
+        self.config = config
+        self.jobs = []
+        self.pool = ThreadPoolExecutor(max_workers=config.MaxSyncWorkers, thread_name_prefix="sync")
+        self._queue = []  # Heap of (due, sequence, job)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition(threading.RLock())  # Reentrant, since _schedule() is called with it held
+        self._stopped = False
+        self.paused = False  # While True, no job is started
+
+    def add_job(self, name, run, interval, delay=None, min_interval=None, max_interval=None):
+        
+        # Adds a periodic job.
+
+        # :param name: Name of the job, used in logs.
+        # :param run: Callable doing one run of the job, see SyncJob.
+        # :param interval: Seconds between the end of one run and the start of the next.
+        # :param delay: Seconds until the first run. Defaults to the interval.
+        # :param min_interval: Interval after a run that found changes. Defaults to the interval.
+        # :param max_interval: Longest interval reached by backing off while idle. Defaults to the interval.
+        # :return: The SyncJob.
+        
+        job = SyncJob(name, run, interval, min_interval, max_interval)
+        self.jobs.append(job)
+        self._schedule(job, interval if delay is None else delay)
+        return job
+
+    def run(self):
+        
+        # Dispatches due jobs to the thread pool until stop() is called.
+        
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    # Drop entries replaced by a later _schedule() of the same job, e.g. by trigger().
+                    while self._queue and self._queue[0][1] != self._queue[0][2].token:
+                        heapq.heappop(self._queue)
+                    timeout = None
+                    if self._queue and not self.paused:
+                        timeout = self._queue[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, job = heapq.heappop(self._queue)
+                job.token = None
+                job.running = True
+            self.pool.submit(self._run_job, job)
+
+    def trigger(self, name):
+        
+        # Runs a job as soon as possible. Triggers arriving while the job runs or waits are coalesced into one run.
+
+        # :param name: Name of the job.
+        # :return: True if the job exists, False otherwise.
+        
+        with self._condition:
+            job = next((job for job in self.jobs if job.name == name), None)
+            if job is None:
+                return False
+            if job.running:
+                job.rerun = True
+                return True
+            # Still under the lock, so the dispatcher cannot start the job between the check and the reschedule.
+            self._schedule(job, 0)
+        return True
+
+    def pause(self):
+        
+        # Stops starting jobs until resume() is called. Running jobs finish normally.
+        
+        with self._condition:
+            self.paused = True
+
+    def resume(self):
+        
+        # Starts jobs again after pause(); jobs that became due meanwhile run right away.
+        
+        with self._condition:
+            self.paused = False
+            self._condition.notify_all()
+
+    def status(self):
+        
+        # :return: Dict describing the scheduler and each job, for the control endpoint.
+        
+        with self._condition:
+            now = time.monotonic()
+            jobs = {}
+            for job in self.jobs:
+                jobs[job.name] = {
+                    "running": job.running,
+                    "next_run_in_seconds": None if job.token is None else round(max(job.next_due - now, 0), 3),
+                    "interval_seconds": job.interval,
+                    "failures": job.failures,
+                    "last_run": job.last_run,
+                    "last_duration_seconds": None if job.last_duration is None else round(job.last_duration, 3),
+                    "last_result": job.last_result,
+                    "last_error": None if job.last_error is None else str(job.last_error),
+                }
+            due = sum(1 for job in self.jobs if job.token is not None and job.next_due <= now)
+            running = sum(1 for job in self.jobs if job.running)
+            return {"paused": self.paused, "queue_depth": due + running, "running": running, "jobs": jobs}
+
+    def stop(self, wait=True):
+        
+        # Stops dispatching jobs and shuts the thread pool down.
+
+        # :param wait: Whether to wait for running jobs to finish.
+        
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self.pool.shutdown(wait=wait)
+
+    def _run_job(self, job):
+        
+        # Runs a job once and schedules its next run.
+
+        # :param job: The SyncJob to run.
+        
+        started = time.monotonic()
+        job.last_error = None
+        result = None
+        try:
+            result = job.run()
+        except Exception as e:
+            job.last_error = e
+            self.util.log(f"Sync job {job.name} failed: {e}", logging.ERROR)
+        finally:
+            job.last_duration = time.monotonic() - started
+            job.last_result = result
+            job.last_run = time.time()
+            delay = self._next_delay(job, result)
+            with self._condition:
+                job.running = False
+                if job.rerun:
+                    job.rerun = False
+                    delay = 0
+                self._schedule(job, delay)
+            self.util.debug(f"Next run of sync job {job.name} in {delay:.1f} seconds.")
+
+    def _next_delay(self, job, result):
+        
+        # Adapts the interval of a job to the result of its last run.
+
+        # :param job: The SyncJob that just ran.
+        # :param result: Return value of the run: True for changes, False for none, None for a failure.
+        # :return: Seconds until the next run, including jitter.
+        
+        if result is None:
+            job.failures += 1
+            delay = min(self.config.SyncFailureRetrySecond * 2 ** (job.failures - 1), job.max_interval)
+        else:
+            job.failures = 0
+            if result is True:
+                job.interval = job.min_interval
+            else:
+                job.interval = min(job.interval * self.config.SyncBackoffFactor, job.max_interval)
+            delay = job.interval
+        jitter = self.config.SyncJitterRatio
+        return max(delay * random.uniform(1 - jitter, 1 + jitter), 0)
+
+    def _schedule(self, job, delay):
+        
+        # Queues the next run of a job.
+
+        # :param job: The SyncJob to schedule.
+        # :param delay: Seconds from now until the run.
+        
+        with self._condition:
+            if self._stopped:
+                return
+            job.next_due = time.monotonic() + delay
+            job.token = next(self._sequence)
+            heapq.heappush(self._queue, (job.next_due, job.token, job))
+            self._condition.notify_all()
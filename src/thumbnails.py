@@ -0,0 +1,192 @@
+# thumbnails.py
+
+import datetime
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import urllib.parse
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow no thumbnails are rendered.
+    Image = None
+
+# Values Calibre-Web stores in its `thumbnail` table (cps/constants.py).
+THUMBNAIL_TYPE_COVER = 1
+THUMBNAIL_HEIGHT = 225  # Height in pixels of resolution 1; resolution n is n times as high
+
+class CoverThumbnailer:
+    
+    # Book change consumer that renders the cover thumbnails of added and modified books right after a sync,
+    # straight into Calibre-Web's thumbnail cache, so that the first view of newly synced books does not wait
+    # for them. Files are written where Calibre-Web looks for them (<cache dir>/thumbnails/<uuid[:2]>/<uuid>.jpg)
+    # and recorded in the `thumbnail` table of its app.db, in the format of Calibre-Web's own thumbnail task.
+    # Covers are rendered in a process pool sized to the CPU count. A thumbnail newer than its cover is not
+    # rendered again.
+    
+
+    def __init__(self, util, config, db_path=None):
+        
+        # Initializes the CoverThumbnailer instance.
+
+        # :param util: Instance of the Utils class for logging.
+        # :param config: Configuration object containing settings.
+        # :param db_path: Path to the metadata.db whose folder holds the books. Defaults to config.MetadataDBPath.
+        
+        self.util = util
+        self.config = config
+        self.library_path = os.path.dirname(os.path.abspath(db_path or config.MetadataDBPath))
+        self.cache_dir = os.path.join(config.ThumbnailCacheDir, "thumbnails")
+        self.app_db_path = config.CalibreWebAppDBPath
+        self.resolutions = tuple(int(resolution) for resolution in config.ThumbnailResolutions.split(",") if resolution.strip())
+        self.workers = config.ThumbnailWorkers or os.cpu_count() or 1
+        self.pool = None  # Started on first use, so the workers only exist once there is something to render
+        self._lock = threading.Lock()  # Serializes writes to app.db from the callbacks of the pool
+        self.rendered = 0  # Number of thumbnails rendered
+        self.cached = 0  # Number of thumbnails that were already up to date
+
+    @staticmethod
+    def is_available():
+        
+        # :return: True if Pillow is installed.
+        
+        return Image is not None
+
+    def __call__(self, changeset):
+        
+        # Queues the covers of the added and modified books for rendering. Returns without waiting.
+
+        # :param changeset: The Changeset dispatched by the BookIndex.
+        
+        try:
+            existing = self._existing_thumbnails(changeset.added + changeset.modified)
+        except sqlite3.Error as e:
+            self.util.log(f"Error reading the thumbnails of Calibre-Web from {self.app_db_path}: {e}", logging.ERROR)
+            return
+        for book_id in changeset.added + changeset.modified:
+            cover = os.path.join(self.library_path, changeset.paths[book_id], "cover.jpg")
+            try:
+                cover_time = os.path.getmtime(cover)
+            except OSError:
+                continue
+            for resolution in self.resolutions:
+                thumbnail_id, filename, generated_at = existing.get((book_id, resolution), (None, None, None))
+                if filename is not None and generated_at >= cover_time and os.path.exists(thumbnail_path(self.cache_dir, filename)):
+                    self.cached += 1
+                    continue
+                # An outdated thumbnail is overwritten in place, like Calibre-Web does.
+                filename = filename or f"{uuid.uuid4()}.jpg"
+                self._submit(book_id, resolution, thumbnail_id, cover, filename)
+
+    def shutdown(self):
+        
+        # Stops the worker processes without waiting for queued covers.
+        
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def _submit(self, book_id, resolution, thumbnail_id, cover, filename):
+        
+        # Queues one thumbnail for rendering.
+
+        # :param book_id: Id of the book.
+        # :param resolution: Calibre-Web resolution of the thumbnail.
+        # :param thumbnail_id: Id of the existing row in the thumbnail table, or None.
+        # :param cover: Path of the cover.
+        # :param filename: Name of the thumbnail file in the cache.
+        
+        if self.pool is None:
+            # Worker processes are spawned, not forked, since the daemon runs several threads.
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        future = self.pool.submit(render_thumbnail, cover, thumbnail_path(self.cache_dir, filename),
+                                  THUMBNAIL_HEIGHT * resolution, self.config.ThumbnailQuality)
+        future.add_done_callback(lambda future: self._rendered(book_id, resolution, thumbnail_id, cover, filename, future))
+
+    def _rendered(self, book_id, resolution, thumbnail_id, cover, filename, future):
+        
+        # Records a rendered thumbnail in app.db and logs failures.
+
+        # :param future: The finished future of render_thumbnail(); the other parameters are those of _submit().
+        
+        if future.cancelled():
+            return
+        try:
+            future.result()
+        except Exception as e:
+            self.util.log(f"Could not render the thumbnail of {cover}: {e}", logging.ERROR)
+            return
+        # SQLAlchemy's format for naive UTC DateTime columns, as Calibre-Web writes them.
+        generated_at = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+        try:
+            with self._lock, closing(self._connect()) as connection, connection:
+                if thumbnail_id is None:
+                    connection.execute("INSERT INTO thumbnail (entity_id, uuid, format, type, resolution, filename, generated_at, expiration) "
+                                       "VALUES (?, ?, 'jpeg', ?, ?, ?, ?, NULL)",
+                                       (book_id, filename[:-len(".jpg")], THUMBNAIL_TYPE_COVER, resolution, filename, generated_at))
+                else:
+                    connection.execute("UPDATE thumbnail SET generated_at = ?, expiration = NULL WHERE id = ?", (generated_at, thumbnail_id))
+        except sqlite3.Error as e:
+            self.util.log(f"Error recording the thumbnail of {cover} in {self.app_db_path}: {e}", logging.ERROR)
+            return
+        self.rendered += 1
+
+    def _existing_thumbnails(self, book_ids):
+        
+        # :param book_ids: Ids of the books.
+        # :return: Dict of (book id, resolution) to (row id, filename, generation time as a timestamp) of their cover thumbnails.
+        
+        existing = {}
+        if not book_ids:
+            return existing
+        with closing(self._connect()) as connection:
+            rows = connection.execute(f"SELECT id, entity_id, resolution, filename, generated_at FROM thumbnail "
+                                      f"WHERE type = ? AND entity_id IN ({','.join('?' * len(book_ids))})",
+                                      (THUMBNAIL_TYPE_COVER, *book_ids)).fetchall()
+        for thumbnail_id, book_id, resolution, filename, generated_at in rows:
+            generated = datetime.datetime.fromisoformat(generated_at).replace(tzinfo=datetime.timezone.utc).timestamp() if generated_at else 0
+            existing[(book_id, resolution)] = (thumbnail_id, filename, generated)
+        return existing
+
+    def _connect(self):
+        
+        # Opens Calibre-Web's app.db without creating it when it does not exist.
+
+        # :return: An sqlite3 connection.
+        
+        return sqlite3.connect(f"file:{urllib.parse.quote(self.app_db_path)}?mode=rw", uri=True, timeout=10)
+
+def thumbnail_path(cache_dir, filename):
+    
+    # :param cache_dir: The thumbnails folder of Calibre-Web's cache.
+    # :param filename: Name of the thumbnail, "<uuid>.jpg".
+    # :return: Path of the thumbnail, in the subfolder Calibre-Web reads it from.
+    
+    return os.path.join(cache_dir, filename[:2], filename)
+
+def render_thumbnail(cover, path, height, quality):
+    
+    # Renders one thumbnail of a cover. Runs in a worker process.
+
+    # :param cover: Path of the cover image.
+    # :param path: Path of the thumbnail.
+    # :param height: Height of the thumbnail in pixels; the width keeps the aspect ratio of the cover.
+    # :param quality: JPEG quality of the thumbnail.
+    
+    if Image is None:
+        raise RuntimeError("Pillow is not installed")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with Image.open(cover) as image:
+        image = image.convert("RGB")
+        width = max(round(image.width * height / image.height), 1)
+        thumbnail = image.resize((width, height), Image.LANCZOS) if image.height > height else image
+        # Written under a temporary name, so Calibre-Web never serves a half-written thumbnail.
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        thumbnail.save(temp_path, "JPEG", quality=quality, optimize=True)
+        os.replace(temp_path, path)
@@ -1,11 +1,55 @@
 # utils.py
 
+import copy
+import gzip
+import logging
+import logging.handlers
 import os
+import queue
+import shutil
+import threading
 import time
 
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    
+    # Queue handler that never blocks the caller: when the queue is full the record is dropped and counted,
+    # and a summary of the dropped records is queued as soon as there is room again.
+    
+
+    def __init__(self, log_queue):
+        
+        # Initializes the DroppingQueueHandler instance.
+
+        # :param log_queue: Bounded queue shared with the writer thread.
+        
+        super().__init__(log_queue)
+        self.dropped = 0  # Records dropped since the last summary
+        self.dropped_total = 0  # Records dropped since start
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        
+        # Queues a record without blocking, preceded by a summary of any records dropped before it.
+
+        # :param record: The log record to queue.
+        
+        with self._dropped_lock:
+            try:
+                if self.dropped:
+                    summary = logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+                                                f"{self.dropped} log messages dropped because the log queue was full.", None, None)
+                    self.queue.put_nowait(summary)
+                    self.dropped = 0
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                self.dropped_total += 1
+
 class Utils:
     
     # Utility class providing logging functionality and file system operations.
+    # Log records are handed to a bounded queue and written to the console and a rotating log file by a
+    # background thread, so the sync loop never waits on terminal or disk I/O.
     
 
     def __init__(self, config):
@@ -15,43 +59,93 @@ class Utils:
         # :param config: Configuration object containing settings.
         
         self.config = config
-        self.log_file = None  # File object for the log file.
+        self.log_file = None  # Rotating file handler writing the log file, while the log is open.
+        level = logging.getLevelName(config.LogLevel.upper())
+        self.logger = logging.Logger("calibre_onedrive_sync", level=level if isinstance(level, int) else logging.INFO)
+        self.queue_handler = None
+        self.listener = None
+        self.prefix = ""  # Prepended to every message, e.g. the library name
+        if not isinstance(level, int):
+            self.log(f"Invalid LOG_LEVEL {config.LogLevel!r}. Logging at INFO.", logging.WARNING)
+
+    def for_library(self, name):
+        
+        # Creates a Utils that logs through the same writer as this one, prefixing messages with a library name.
+
+        # :param name: Name of the library.
+        # :return: The new Utils instance.
+        
+        library_utils = copy.copy(self)
+        library_utils.prefix = f"[{name}] "
+        return library_utils
 
     def open_log(self):
         
-        # Opens the log file in append mode if logging is enabled.
+        # Starts the background log writer. The log file is opened once and kept open until close_log().
+        # Calling it again while the log is open does nothing.
         
+        if self.listener is not None:
+            return
+
+        formatter = logging.Formatter("%(asctime)s - %(message)s", "%Y-%m-%d %H:%M:%S")
+        handlers = [logging.StreamHandler()]
         if self.config.Log:
             try:
-                self.log_file = open("sync.log", "a")
-            except IOError as e:
+                self.log_file = self._create_file_handler()
+                handlers.append(self.log_file)
+            except OSError as e:
                 print(f"Failed to open log file: {e}")
                 self.log_file = None
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=self.config.LogQueueSize)
+        self.queue_handler = DroppingQueueHandler(log_queue)
+        self.logger.addHandler(self.queue_handler)
+        self.listener = logging.handlers.QueueListener(log_queue, *handlers)
+        self.listener.start()
 
     def close_log(self):
         
-        # Closes the log file if it's open.
+        # Flushes all queued messages, stops the background writer and closes the log file.
         
-        if self.log_file:
+        if self.listener is None:
+            return
+        self.logger.removeHandler(self.queue_handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
             try:
-                self.log_file.close()
-            except IOError as e:
+                handler.close()
+            except OSError as e:
                 print(f"Failed to close log file: {e}")
+        self.listener = None
+        self.queue_handler = None
+        self.log_file = None
 
-    def log(self, message):
+    def log(self, message, level=logging.INFO):
         
         # Logs a message with a timestamp to both the console and the log file if logging is enabled.
+        # Before open_log() is called, messages are printed directly.
 
         # :param message: The message to log.
+        # :param level: Logging level of the message. Messages below config.LogLevel are discarded.
         
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        log_message = f"{timestamp} - {message}"
-        print(log_message)
-        if self.config.Log and self.log_file:
-            try:
-                self.log_file.write(log_message + "\n")
-            except IOError as e:
-                print(f"Failed to write to log file: {e}")
+        if not self.logger.isEnabledFor(level):
+            return
+        # The logger is shared with the instances created by for_library(), so check its handlers rather than our own listener.
+        if not self.logger.handlers:
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{timestamp} - {self.prefix}{message}")
+            return
+        self.logger.log(level, self.prefix + message)
+
+    def debug(self, message):
+        
+        # Logs a message at debug level, e.g. the output of the onedrive client.
+
+        # :param message: The message to log.
+        
+        self.log(message, logging.DEBUG)
 
     def get_last_modified_time(self, file_path):
         
@@ -63,5 +157,33 @@ class Utils:
         try:
             return os.path.getmtime(file_path)
         except OSError as e:
-            self.log(f"Error getting last modified time for {file_path}: {e}")
+            self.log(f"Error getting last modified time for {file_path}: {e}", logging.ERROR)
             return None
+
+    def _create_file_handler(self):
+        
+        # Creates the handler writing the log file, rotated by size or by time depending on the configuration.
+
+        # :return: The file handler.
+        
+        if self.config.LogRotateWhen:
+            handler = logging.handlers.TimedRotatingFileHandler(self.config.LogPath, when=self.config.LogRotateWhen,
+                                                                backupCount=self.config.LogBackupCount)
+        else:
+            handler = logging.handlers.RotatingFileHandler(self.config.LogPath, maxBytes=self.config.LogMaxBytes,
+                                                           backupCount=self.config.LogBackupCount)
+        if self.config.LogCompress:
+            handler.namer = lambda name: name + ".gz"
+            handler.rotator = _compress_rotated_log
+        return handler
+
+def _compress_rotated_log(source, destination):
+    
+    # Rotator for the log file handlers that gzips the rotated file.
+
+    # :param source: Path of the log file being rotated.
+    # :param destination: Path of the compressed backup.
+    
+    with open(source, "rb") as plain, gzip.open(destination, "wb") as compressed:
+        shutil.copyfileobj(plain, compressed)
+    os.remove(source)
@@ -0,0 +1,135 @@
+# test_book_index.py
+
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from book_index import BookIndex, ChangesetLogger
+from utils import Utils
+from default_config import default_config
+
+def write_library(path, books, formats):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS books (id INTEGER PRIMARY KEY, title TEXT, path TEXT, last_modified TEXT)")
+    connection.execute("CREATE TABLE IF NOT EXISTS data (id INTEGER PRIMARY KEY, book INTEGER, format TEXT, name TEXT, uncompressed_size INTEGER)")
+    connection.execute("DELETE FROM books")
+    connection.execute("DELETE FROM data")
+    connection.executemany("INSERT INTO books (id, title, path, last_modified) VALUES (?, ?, ?, ?)", books)
+    connection.executemany("INSERT INTO data (book, format, name, uncompressed_size) VALUES (?, ?, ?, 100)", formats)
+    connection.commit()
+    connection.close()
+
+class TestBookIndex(unittest.TestCase):
+    def setUp(self):
+        self.config = default_config
+        self.utils = Utils(self.config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "metadata.db")
+        self.index_path = os.path.join(self.tmpdir.name, "book_index.db")
+        self.books = [(1, "One", "A/One (1)", "2024-01-01"), (2, "Two", "A/Two (2)", "2024-01-01"), (3, "Three", "B/Three (3)", "2024-01-01")]
+        self.formats = [(1, "EPUB", "One"), (2, "EPUB", "Two"), (3, "PDF", "Three")]
+        write_library(self.db_path, self.books, self.formats)
+        self.index = BookIndex(util=self.utils, config=self.config, db_path=self.db_path, index_path=self.index_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_first_refresh_records_baseline(self):
+
+        # Test that the first refresh records a baseline without dispatching every book as added.
+
+        consumer = MagicMock()
+        self.index.add_consumer(consumer)
+        with patch.object(self.utils, 'log') as mock_log:
+            self.assertIsNone(self.index.refresh())
+            mock_log.assert_called_with("Book index initialized with 3 books.")
+        consumer.assert_not_called()
+
+    def test_refresh_reports_added_removed_modified(self):
+
+        # Test that the diff finds added, removed and modified books, including format changes.
+
+        with patch.object(self.utils, 'log'):
+            self.index.refresh()
+        books = [(1, "One", "A/One (1)", "2024-02-01"), (2, "Two", "A/Two (2)", "2024-01-01"), (4, "Four", "C/Four (4)", "2024-02-01")]
+        formats = [(1, "EPUB", "One"), (2, "EPUB", "Two"), (2, "PDF", "Two"), (4, "EPUB", "Four")]
+        write_library(self.db_path, books, formats)
+
+        consumer = MagicMock()
+        self.index.add_consumer(consumer)
+        changeset = self.index.refresh()
+
+        self.assertEqual(changeset.added, [4])
+        self.assertEqual(changeset.removed, [3])
+        self.assertEqual(sorted(changeset.modified), [1, 2])
+        self.assertEqual(changeset.paths[3], "B/Three (3)")
+        self.assertEqual(changeset.paths[4], "C/Four (4)")
+        consumer.assert_called_once_with(changeset)
+
+    def test_unchanged_library_dispatches_nothing(self):
+
+        # Test that a refresh without changes returns an empty changeset and does not call consumers.
+
+        with patch.object(self.utils, 'log'):
+            self.index.refresh()
+        consumer = MagicMock()
+        self.index.add_consumer(consumer)
+        changeset = self.index.refresh()
+        self.assertEqual(len(changeset), 0)
+        consumer.assert_not_called()
+
+    def test_diff_leaves_snapshot_unchanged(self):
+
+        # Test that diff() reports the changes without recording them or calling consumers.
+
+        with patch.object(self.utils, 'log'):
+            self.index.refresh()
+        write_library(self.db_path, self.books[:2], self.formats[:2])
+        consumer = MagicMock()
+        self.index.add_consumer(consumer)
+        self.assertEqual(self.index.diff().removed, [3])
+        self.assertEqual(self.index.diff().removed, [3])
+        consumer.assert_not_called()
+        self.assertEqual(self.index.refresh().removed, [3])
+        consumer.assert_called_once()
+
+    def test_snapshot_survives_new_instance(self):
+
+        # Test that the snapshot is stored on disk and picked up by a new BookIndex.
+
+        with patch.object(self.utils, 'log'):
+            self.index.refresh()
+        write_library(self.db_path, self.books[:2], self.formats[:2])
+        index = BookIndex(util=self.utils, config=self.config, db_path=self.db_path, index_path=self.index_path)
+        self.assertEqual(index.refresh().removed, [3])
+
+    def test_failing_consumer_does_not_stop_others(self):
+
+        # Test that an exception in one consumer is logged and the next consumer still runs.
+
+        with patch.object(self.utils, 'log'):
+            self.index.refresh()
+        write_library(self.db_path, self.books[:2], self.formats[:2])
+        failing = MagicMock(side_effect=Exception("boom"), __name__="failing")
+        logger = ChangesetLogger(self.utils)
+        self.index.add_consumer(failing)
+        self.index.add_consumer(logger)
+        with patch.object(self.utils, 'log') as mock_log:
+            self.index.refresh()
+            mock_log.assert_any_call("Book change consumer failing failed: boom", logging.ERROR)
+            mock_log.assert_any_call("Books changed: 0 added, 1 removed, 0 modified.")
+
+    def test_unreadable_library(self):
+
+        # Test that a missing metadata.db is logged and returns None.
+
+        index = BookIndex(util=self.utils, config=self.config, db_path=os.path.join(self.tmpdir.name, "missing.db"), index_path=self.index_path)
+        with patch.object(self.utils, 'log') as mock_log:
+            self.assertIsNone(index.refresh())
+            mock_log.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,28 +1,50 @@
 # test_calibre_server.py
 
+import copy
+import logging
+import os
+import subprocess
 import unittest
 from unittest.mock import patch, MagicMock
 
+import requests
+
 from calibre_server import CalibreServer
+from metrics import Metrics
 from utils import Utils
 from default_config import default_config
 
 class TestCalibreServer(unittest.TestCase):
     def setUp(self):
-        self.config = default_config
+        self.config = copy.copy(default_config)
         self.utils = Utils(self.config)
+        self.config.HTTPRetries = 2
         self.calibre_server = CalibreServer(util=self.utils, config=self.config)
+        self.reconnect_url = f"http://localhost:{self.config.PortCalibreWeb}/reconnect"
 
     @patch("subprocess.Popen")
     def test_start_server_success(self, mock_popen):
         
         #Test starting the Calibre server successfully.
         
-        with patch.object(self.utils, 'log') as mock_log:
-            self.calibre_server.start_server()
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.calibre_server, 'wait_until_ready', return_value=True):
+            self.assertTrue(self.calibre_server.start_server())
             mock_popen.assert_called_with([self.config.CPSPath, "-r"])
             mock_log.assert_any_call("Starting Calibre server...")
             mock_log.assert_any_call("Calibre server started.")
+            mock_log.assert_any_call("Calibre server is ready.")
+
+    @patch("subprocess.Popen")
+    def test_start_server_not_ready(self, mock_popen):
+        
+        #Test that start_server reports a server that never answers the readiness probe.
+        
+        self.config.ReadyTimeoutSecond = 0
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.calibre_server.session, 'get', side_effect=requests.ConnectionError("refused")):
+            self.assertFalse(self.calibre_server.start_server())
+            mock_log.assert_any_call("Calibre server did not become ready within 0 seconds.", logging.WARNING)
 
     @patch("subprocess.Popen", side_effect=Exception("Popen failed"))
     def test_start_server_failure(self, mock_popen):
@@ -30,50 +52,188 @@ class TestCalibreServer(unittest.TestCase):
         #Test handling of an error when starting the Calibre server.
         
         with patch.object(self.utils, 'log') as mock_log:
-            self.calibre_server.start_server()
+            self.assertFalse(self.calibre_server.start_server())
             mock_log.assert_any_call("Starting Calibre server...")
-            mock_log.assert_any_call("Failed to start Calibre server: Popen failed")
+            mock_log.assert_any_call("Failed to start Calibre server: Popen failed", logging.ERROR)
 
-    @patch("requests.get")
-    def test_reconnect_success(self, mock_get):
+    def test_reconnect_success(self):
         
         #Test successful reconnection to the Calibre server.
         
         mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_get.return_value = mock_response
 
-        with patch.object(self.utils, 'log') as mock_log:
-            self.calibre_server.reconnect()
-            mock_get.assert_called_with(f"http://localhost:{self.config.PortCalibreWeb}/reconnect")
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.calibre_server.session, 'get', return_value=mock_response) as mock_get:
+            self.assertTrue(self.calibre_server.reconnect())
+            mock_get.assert_called_once_with(self.reconnect_url, timeout=self.calibre_server.timeout)
             mock_log.assert_any_call("Attempting to reconnect Calibre server...")
             mock_log.assert_any_call("Calibre server reconnected successfully.")
 
-    @patch("requests.get")
-    def test_reconnect_failure_status_code(self, mock_get):
+    @patch("time.sleep")
+    def test_reconnect_failure_status_code(self, mock_sleep):
         
         #Test handling of a failed reconnection due to a bad status code.
         
         mock_response = MagicMock()
         mock_response.status_code = 500
-        mock_get.return_value = mock_response
 
-        with patch.object(self.utils, 'log') as mock_log:
-            self.calibre_server.reconnect()
-            mock_get.assert_called_with(f"http://localhost:{self.config.PortCalibreWeb}/reconnect")
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.calibre_server.session, 'get', return_value=mock_response) as mock_get:
+            self.assertFalse(self.calibre_server.reconnect())
+            # Server errors are retried before giving up.
+            self.assertEqual(mock_get.call_count, 3)
             mock_log.assert_any_call("Attempting to reconnect Calibre server...")
-            mock_log.assert_any_call("Failed to reconnect. Status code: 500")
+            mock_log.assert_any_call("Failed to reconnect. Status code: 500", logging.ERROR)
 
-    @patch("requests.get", side_effect=Exception("Connection error"))
-    def test_reconnect_exception(self, mock_get):
+    def test_reconnect_exception(self):
         
         #Test handling of an exception during reconnection.
         
-        with patch.object(self.utils, 'log') as mock_log:
-            self.calibre_server.reconnect()
-            mock_get.assert_called_with(f"http://localhost:{self.config.PortCalibreWeb}/reconnect")
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.calibre_server.session, 'get', side_effect=Exception("Connection error")) as mock_get:
+            self.assertFalse(self.calibre_server.reconnect())
+            mock_get.assert_called_with(self.reconnect_url, timeout=self.calibre_server.timeout)
             mock_log.assert_any_call("Attempting to reconnect Calibre server...")
-            mock_log.assert_any_call("Error during reconnection: Connection error")
+            mock_log.assert_any_call("Error during reconnection: Connection error", logging.ERROR)
+
+    @patch("time.sleep")
+    def test_reconnect_retries_connection_errors(self, mock_sleep):
+        
+        #Test that connection errors are retried with backoff until a request succeeds.
+        
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        side_effect = [requests.ConnectionError("refused"), requests.Timeout("timed out"), mock_response]
+
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.calibre_server.session, 'get', side_effect=side_effect) as mock_get:
+            self.assertTrue(self.calibre_server.reconnect())
+            self.assertEqual(mock_get.call_count, 3)
+            self.assertEqual(mock_sleep.call_count, 2)
+            mock_log.assert_any_call("Calibre server reconnected successfully.")
+
+    @patch("time.sleep")
+    def test_reconnect_gives_up_after_retries(self, mock_sleep):
+        
+        #Test that reconnect stops after the configured number of retries.
+        
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.calibre_server.session, 'get', side_effect=requests.ConnectionError("refused")) as mock_get:
+            self.assertFalse(self.calibre_server.reconnect())
+            self.assertEqual(mock_get.call_count, 3)
+            mock_log.assert_any_call("Error during reconnection: refused", logging.ERROR)
+
+    def test_check_health_detects_exited_process(self):
+        
+        #Test that a crashed cps process is reported as unhealthy.
+        
+        self.calibre_server.process = MagicMock()
+        self.calibre_server.process.poll.return_value = 1
+        self.assertEqual(self.calibre_server.check_health(), "process exited with code 1")
+
+    def test_check_health_tolerates_single_failed_probe(self):
+        
+        #Test that one failed probe is tolerated and consecutive failures are reported.
+        
+        self.config.CalibreMaxFailedProbes = 2
+        self.config.CalibreMaxRSSMB = 0
+        self.calibre_server.process = MagicMock()
+        self.calibre_server.process.poll.return_value = None
+        with patch.object(self.calibre_server, 'is_ready', return_value=False):
+            self.assertIsNone(self.calibre_server.check_health())
+            self.assertEqual(self.calibre_server.check_health(), "no answer to 2 probes in a row")
+        with patch.object(self.calibre_server, 'is_ready', return_value=True):
+            self.assertIsNone(self.calibre_server.check_health())
+            self.assertEqual(self.calibre_server.failed_probes, 0)
+
+    def test_check_health_detects_memory_limit(self):
+        
+        #Test that exceeding the memory limit is reported as unhealthy.
+        
+        self.config.CalibreMaxRSSMB = 100
+        self.calibre_server.process = MagicMock()
+        self.calibre_server.process.poll.return_value = None
+        with patch.object(self.calibre_server, 'rss_bytes', return_value=200 * 1024 * 1024):
+            self.assertEqual(self.calibre_server.check_health(), "memory usage 200 MB exceeds 100 MB")
+        self.config.CalibreMaxRSSMB = 0
+
+    def test_restart_server_counts_restarts(self):
+        
+        #Test that a restart stops the old process, starts a new one and is counted.
+        
+        with patch.object(self.calibre_server, 'stop_server') as mock_stop, \
+             patch.object(self.calibre_server, 'start_server', return_value=True) as mock_start, \
+             patch.object(self.utils, 'log') as mock_log:
+            self.assertTrue(self.calibre_server.restart_server("process exited with code 1"))
+            mock_stop.assert_called_once()
+            mock_start.assert_called_once()
+            mock_log.assert_any_call("Restarting Calibre server: process exited with code 1", logging.WARNING)
+        self.assertEqual(self.calibre_server.restart_count, 1)
+
+    def test_stop_server_kills_after_timeout(self):
+        
+        #Test that cps is killed when it ignores SIGTERM.
+        
+        process = MagicMock()
+        process.poll.return_value = None
+        process.wait.side_effect = [subprocess.TimeoutExpired("cps", 10), 0]
+        self.calibre_server.process = process
+        with patch.object(self.utils, 'log'):
+            self.calibre_server.stop_server()
+        process.terminate.assert_called_once()
+        process.kill.assert_called_once()
+
+    def test_rss_bytes_of_running_process(self):
+        
+        #Test reading the resident memory of a live process from /proc.
+        
+        if not os.path.exists(f"/proc/{os.getpid()}/status"):
+            self.skipTest("/proc is not available")
+        self.calibre_server.process = MagicMock(pid=os.getpid())
+        self.assertGreater(self.calibre_server.rss_bytes(), 0)
+
+    def test_metrics_for_reconnects_and_process(self):
+        
+        #Test that reconnects and the state of the cps process are exported as metrics.
+        
+        metrics = Metrics(self.config)
+        calibre_server = CalibreServer(util=self.utils, config=self.config, metrics=metrics)
+        mock_response = MagicMock()
+        mock_response.status_code = 404
+        with patch.object(self.utils, 'log'), \
+             patch.object(calibre_server.session, 'get', return_value=mock_response):
+            calibre_server.reconnect()
+        labels = {"port": str(self.config.PortCalibreWeb)}
+        self.assertEqual(metrics.get("calibre_reconnect_duration_seconds", labels=labels), 1)
+        self.assertEqual(metrics.get("calibre_reconnect_failures_total", labels=labels), 1)
+
+        calibre_server.process = MagicMock()
+        calibre_server.process.poll.return_value = None
+        calibre_server.started_at = 1700000000.0
+        calibre_server.time_to_ready = 2.5
+        calibre_server.restart_count = 3
+        with patch.object(calibre_server, 'rss_bytes', return_value=1024):
+            text = metrics.render()
+        port = self.config.PortCalibreWeb
+        self.assertIn(f'calibre_onedrive_sync_calibre_up{{port="{port}"}} 1', text)
+        self.assertIn(f'calibre_onedrive_sync_calibre_restarts_total{{port="{port}"}} 3', text)
+        self.assertIn(f'calibre_onedrive_sync_calibre_time_to_ready_seconds{{port="{port}"}} 2.5', text)
+        self.assertIn(f'calibre_onedrive_sync_calibre_rss_bytes{{port="{port}"}} 1024', text)
+
+    def test_metrics_of_several_servers(self):
+        
+        #Test that the metrics of Calibre-Web servers on different ports do not overwrite each other.
+        
+        metrics = Metrics(self.config)
+        other_config = copy.copy(self.config)
+        other_config.PortCalibreWeb = 8084
+        servers = [CalibreServer(util=self.utils, config=config, metrics=metrics) for config in (self.config, other_config)]
+        servers[0].restart_count = 1
+        servers[1].restart_count = 2
+        text = metrics.render()
+        self.assertIn(f'calibre_onedrive_sync_calibre_restarts_total{{port="{self.config.PortCalibreWeb}"}} 1', text)
+        self.assertIn('calibre_onedrive_sync_calibre_restarts_total{port="8084"} 2', text)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,127 @@
+# test_change_detector.py
+
+import copy
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from change_detector import ChangeDetector
+from utils import Utils
+from default_config import default_config
+
+def create_library(path, books):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS books (id INTEGER PRIMARY KEY, title TEXT, path TEXT, last_modified TEXT)")
+    connection.execute("CREATE TABLE IF NOT EXISTS data (id INTEGER PRIMARY KEY, book INTEGER, format TEXT, name TEXT, uncompressed_size INTEGER)")
+    connection.executemany("INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?)", books)
+    connection.commit()
+    connection.close()
+
+class TestChangeDetector(unittest.TestCase):
+    def setUp(self):
+        self.config = copy.copy(default_config)
+        self.config.ChangeDetection = "content"
+        self.config.ChangeDetectionTables = ""
+        self.utils = Utils(self.config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "metadata.db")
+        create_library(self.db_path, [(1, "Book", "Author/Book (1)", "2024-01-01")])
+        self.detector = ChangeDetector(util=self.utils, config=self.config, db_path=self.db_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_first_check_reports_change(self):
+
+        # Test that the first check always reports a change so Calibre-Web starts from the current DB.
+
+        self.assertTrue(self.detector.has_changed())
+
+    def test_unchanged_stat_skips_database(self):
+
+        # Test that the database is not opened when size, mtime and inode are unchanged.
+
+        self.detector.has_changed()
+        self.detector.accept()
+        with patch.object(self.detector, 'fingerprint') as mock_fingerprint:
+            self.assertFalse(self.detector.has_changed())
+            mock_fingerprint.assert_not_called()
+
+    def test_restored_state_survives_restart(self):
+
+        # Test that a state saved through a JSON round trip lets a new detector see the database as unchanged.
+
+        self.detector.has_changed()
+        self.detector.accept()
+        state = json.loads(json.dumps(self.detector.state()))
+        restarted = ChangeDetector(util=self.utils, config=self.config, db_path=self.db_path)
+        self.assertTrue(restarted.restore(state))
+        with patch.object(restarted, 'fingerprint') as mock_fingerprint:
+            self.assertFalse(restarted.has_changed())
+            mock_fingerprint.assert_not_called()
+
+    def test_restore_ignores_other_strategy(self):
+
+        # Test that a state computed with another strategy is not restored.
+
+        self.detector.has_changed()
+        self.detector.accept()
+        state = self.detector.state()
+        self.config.ChangeDetection = "hash"
+        restarted = ChangeDetector(util=self.utils, config=self.config, db_path=self.db_path)
+        self.assertFalse(restarted.restore(state))
+        self.assertTrue(restarted.has_changed())
+
+    def test_touch_is_not_a_change(self):
+
+        # Test that updating the modification time without changing content is not reported.
+
+        self.detector.has_changed()
+        self.detector.accept()
+        stat = os.stat(self.db_path)
+        os.utime(self.db_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertFalse(self.detector.has_changed())
+
+    def test_content_change_is_detected(self):
+
+        # Test that adding a book is reported as a change.
+
+        self.detector.has_changed()
+        self.detector.accept()
+        create_library(self.db_path, [(2, "Other", "Author/Other (2)", "2024-02-01")])
+        self.assertTrue(self.detector.has_changed())
+
+    def test_unaccepted_change_is_reported_again(self):
+
+        # Test that a change is reported until accept() is called.
+
+        self.assertTrue(self.detector.has_changed())
+        self.assertTrue(self.detector.has_changed())
+        self.detector.accept()
+        self.assertFalse(self.detector.has_changed())
+
+    def test_hash_strategy_detects_edit_without_last_modified(self):
+
+        # Test that the hash strategy notices a title edit that leaves counts and last_modified untouched.
+
+        self.config.ChangeDetection = "hash"
+        detector = ChangeDetector(util=self.utils, config=self.config, db_path=self.db_path)
+        detector.has_changed()
+        detector.accept()
+        create_library(self.db_path, [(1, "Renamed", "Author/Book (1)", "2024-01-01")])
+        self.assertTrue(detector.has_changed())
+
+    def test_missing_database(self):
+
+        # Test that a missing database is reported as undeterminable.
+
+        detector = ChangeDetector(util=self.utils, config=self.config, db_path=os.path.join(self.tmpdir.name, "missing.db"))
+        with patch.object(self.utils, 'log') as mock_log:
+            self.assertIsNone(detector.has_changed())
+            mock_log.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
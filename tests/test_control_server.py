@@ -0,0 +1,84 @@
+# test_control_server.py
+
+import json
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import patch, MagicMock
+
+from control_server import ControlServer
+from sync_scheduler import SyncScheduler
+from utils import Utils
+from default_config import default_config
+
+class TestControlServer(unittest.TestCase):
+    def setUp(self):
+        self.config = default_config
+        self.utils = Utils(self.config)
+        self.scheduler = SyncScheduler(util=self.utils, config=self.config)
+        self.scheduler.add_job("home", MagicMock(), 60)
+        self.home = MagicMock()
+        self.home.status.return_value = {"phase": "idle", "reload_count": 0}
+        self.home.reload_now.return_value = True
+        self.control = ControlServer(util=self.utils, config=self.config, scheduler=self.scheduler,
+                                     onedrive_servers={"home": self.home, "work": MagicMock()})
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.config.ControlPort = 0
+
+    def test_status(self):
+        
+        # Test that the status combines the library state with its scheduled job.
+        
+        status, response = self.control.handle("GET", "status", "home")
+        self.assertEqual(status, 200)
+        self.assertEqual(response["libraries"]["home"]["phase"], "idle")
+        self.assertEqual(response["libraries"]["home"]["job"]["interval_seconds"], 60)
+        self.assertFalse(response["paused"])
+
+    def test_sync_now_triggers_scheduled_libraries(self):
+        
+        # Test that sync-now triggers the job of every library that has one.
+        
+        with patch.object(self.utils, 'log'), patch.object(self.scheduler, 'trigger', side_effect=lambda name: name == "home") as mock_trigger:
+            status, response = self.control.handle("POST", "sync-now")
+        self.assertEqual((status, response["triggered"]), (202, ["home"]))
+        self.assertEqual(mock_trigger.call_count, 2)
+
+    def test_commands(self):
+        
+        # Test reload-now, pause and resume, and the errors for unknown libraries, commands and methods.
+        
+        with patch.object(self.utils, 'log'):
+            self.assertEqual(self.control.handle("POST", "reload-now", "home"), (200, {"reloaded": {"home": True}}))
+            self.control.handle("POST", "pause")
+            self.assertTrue(self.scheduler.paused)
+            self.control.handle("POST", "resume")
+            self.assertFalse(self.scheduler.paused)
+        self.assertEqual(self.control.handle("POST", "sync-now", "other")[0], 404)
+        self.assertEqual(self.control.handle("POST", "explode")[0], 404)
+        self.assertEqual(self.control.handle("GET", "pause")[0], 405)
+
+    def test_http_endpoint(self):
+        
+        # Test that commands are served over HTTP as JSON.
+        
+        self.config.ControlPort = 0
+        with patch.object(self.utils, 'log'):
+            self.assertTrue(self.control.start())
+            try:
+                url = f"http://127.0.0.1:{self.control.server.server_port}"
+                with urllib.request.urlopen(f"{url}/status") as response:
+                    self.assertIn("home", json.loads(response.read())["libraries"])
+                request = urllib.request.Request(f"{url}/pause", method="POST")
+                with urllib.request.urlopen(request) as response:
+                    self.assertEqual(json.loads(response.read()), {"paused": True})
+                with self.assertRaises(urllib.error.HTTPError) as error:
+                    urllib.request.urlopen(f"{url}/status?library=other")
+                self.assertEqual(error.exception.code, 404)
+            finally:
+                self.control.stop()
+
+if __name__ == '__main__':
+    unittest.main()
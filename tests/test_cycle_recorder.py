@@ -0,0 +1,67 @@
+# test_cycle_recorder.py
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from calibre_server import CalibreServer
+from cycle_recorder import CycleRecorder, load_recording
+from onedrive_server import OneDriveServer
+from utils import Utils
+from default_config import default_config
+
+class TestCycleRecorder(unittest.TestCase):
+    def setUp(self):
+        self.config = default_config
+        self.utils = Utils(self.config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cycles.jsonl")
+        self.recorder = CycleRecorder(util=self.utils, config=self.config, path=self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_record_cycle(self):
+        
+        # Test that a cycle is written as one JSON line with its output, reconnects and fingerprints.
+        
+        self.recorder.output("ignored outside a cycle")
+        self.recorder.begin([1, 2])
+        self.recorder.output("Downloading file ./Calibre Library/metadata.db ... done.")
+        self.recorder.reconnect(self.recorder._started + 0.5, 0.25, True)
+        self.recorder.end(0, [1, 3], True)
+        self.recorder.end(0, [1, 3], True)
+
+        cycles = load_recording(self.path)
+        self.assertEqual(len(cycles), 1)
+        cycle = cycles[0]
+        self.assertEqual([line for _, line in cycle["output"]], ["Downloading file ./Calibre Library/metadata.db ... done."])
+        self.assertEqual(cycle["reconnects"], [[0.5, 0.25, True]])
+        self.assertEqual((cycle["fingerprint_before"], cycle["fingerprint_after"]), ([1, 2], [1, 3]))
+        self.assertEqual((cycle["exit_code"], cycle["timed_out"], cycle["result"]), (0, False, True))
+        self.assertEqual(load_recording(self.path, library="other"), [])
+
+    def test_sync_is_recorded(self):
+        
+        # Test that OneDriveServer records the output, exit code and reconnects of a sync.
+        
+        calibre_server = CalibreServer(util=self.utils, config=self.config)
+        server = OneDriveServer(util=self.utils, config=self.config, calibre_server=calibre_server, recorder=self.recorder)
+        with patch.object(self.utils, 'log'), patch.object(self.utils, 'debug'), \
+             patch.object(server, '_execute', return_value=iter(["Syncing..."])), \
+             patch.object(server, '_fingerprint', side_effect=[1.0, 2.0]), \
+             patch.object(server, '_detect_change', return_value=True), \
+             patch.object(calibre_server, 'reconnect', return_value=False):
+            # Calibre-Web did not confirm the reconnect, so the cycle did not reload it.
+            self.assertFalse(server.call_onedrive(onFinish=MagicMock()))
+
+        cycle, = load_recording(self.path)
+        self.assertEqual([line for _, line in cycle["output"]], ["Syncing..."])
+        self.assertEqual((cycle["exit_code"], cycle["fingerprint_before"], cycle["fingerprint_after"]), (0, 1.0, 2.0))
+        self.assertEqual(len(cycle["reconnects"]), 1)
+        self.assertFalse(cycle["reconnects"][0][2])
+        self.assertFalse(cycle["result"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# test_db_watcher.py
+
+import copy
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from db_watcher import DBWatcher
+from utils import Utils
+from default_config import default_config
+
+class TestDBWatcher(unittest.TestCase):
+    def setUp(self):
+        self.config = copy.copy(default_config)
+        self.config.WatchSettleSecond = 0.1
+        self.config.WatchMaxDelaySecond = 2
+        self.utils = Utils(self.config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "metadata.db")
+        self.changed = threading.Event()
+        self.watcher = DBWatcher(util=self.utils, config=self.config, on_change=self.changed.set, db_path=self.db_path)
+
+    def tearDown(self):
+        self.watcher.stop()
+        self.tmpdir.cleanup()
+
+    def test_watched_names_include_journal_files(self):
+
+        # Test that the -wal and -journal siblings of metadata.db are watched.
+
+        self.assertEqual(self.watcher.watched_names, {"metadata.db", "metadata.db-wal", "metadata.db-journal"})
+
+    def test_change_to_metadata_db_fires_callback(self):
+
+        # Test that a write to metadata.db triggers the callback once writes settle.
+
+        if not self.watcher.is_available():
+            self.skipTest("inotify is not available")
+        with patch.object(self.utils, 'log'):
+            self.assertTrue(self.watcher.start())
+            with open(self.db_path, "w") as f:
+                f.write("data")
+            self.assertTrue(self.changed.wait(timeout=5))
+
+    def test_write_to_wal_fires_callback(self):
+
+        # Test that a write to the WAL file alone triggers the callback.
+
+        if not self.watcher.is_available():
+            self.skipTest("inotify is not available")
+        with patch.object(self.utils, 'log'):
+            self.assertTrue(self.watcher.start())
+            with open(self.db_path + "-wal", "w") as f:
+                f.write("data")
+            self.assertTrue(self.changed.wait(timeout=5))
+
+    def test_unrelated_file_is_ignored(self):
+
+        # Test that writes to other files in the library directory do not trigger the callback.
+
+        if not self.watcher.is_available():
+            self.skipTest("inotify is not available")
+        with patch.object(self.utils, 'log'):
+            self.assertTrue(self.watcher.start())
+            with open(os.path.join(self.tmpdir.name, "cover.jpg"), "w") as f:
+                f.write("data")
+            self.assertFalse(self.changed.wait(timeout=0.5))
+
+    def test_start_without_inotify(self):
+
+        # Test that start reports failure when inotify is unavailable so the caller can fall back to polling.
+
+        with patch.object(self.watcher, '_load_libc', return_value=None), \
+             patch.object(self.utils, 'log') as mock_log:
+            self.assertFalse(self.watcher.start())
+            mock_log.assert_called_with("inotify is not available on this platform.", logging.WARNING)
+
+    def test_start_with_missing_directory(self):
+
+        # Test that watching a nonexistent library directory fails cleanly.
+
+        if not self.watcher.is_available():
+            self.skipTest("inotify is not available")
+        watcher = DBWatcher(util=self.utils, config=self.config, on_change=MagicMock(), db_path="/nonexistent/dir/metadata.db")
+        with patch.object(self.utils, 'log'):
+            self.assertFalse(watcher.start())
+        self.assertIsNone(watcher.fd)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# test_library_index.py
+
+import copy
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from library_index import LibraryIndex
+from utils import Utils
+from default_config import default_config
+
+def create_library(path, books):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, path TEXT, has_cover INTEGER, last_modified TEXT)")
+    connection.execute("CREATE TABLE data (id INTEGER PRIMARY KEY, book INTEGER, format TEXT, name TEXT, uncompressed_size INTEGER)")
+    for book_id, path, has_cover, formats in books:
+        connection.execute("INSERT INTO books VALUES (?, ?, ?, '2000-01-01 00:00:00+00:00')", (book_id, path, has_cover))
+        for book_format, size in formats:
+            connection.execute("INSERT INTO data (book, format, name, uncompressed_size) VALUES (?, ?, ?, ?)", (book_id, book_format, f"Book {book_id}", size))
+    connection.commit()
+    connection.close()
+
+class TestLibraryIndex(unittest.TestCase):
+    def setUp(self):
+        self.config = copy.copy(default_config)
+        self.config.OneDriveLibraryFolder = ""
+        self.config.IntegrityWaitSecond = 0
+        self.utils = Utils(self.config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.library_dir = os.path.join(self.tmpdir.name, "Calibre Library")
+        self.db_path = os.path.join(self.library_dir, "metadata.db")
+        self.write("Author/Book (1)/Book 1.epub", 10)
+        self.write("Author/Book (1)/cover.jpg", 3)
+        create_library(self.db_path, [(1, "Author/Book (1)", 1, [("EPUB", 10)]), (2, "Author/Book (2)", 0, [("EPUB", 5), ("PDF", 8)])])
+        self.index = LibraryIndex(util=self.utils, config=self.config, db_path=self.db_path,
+                                  index_path=os.path.join(self.tmpdir.name, "library_index.db"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, path, size):
+        path = os.path.join(self.library_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as book_file:
+            book_file.write(b"x" * size)
+
+    def test_missing_files(self):
+        
+        # Test that the book files metadata.db references but that are absent or too small are reported.
+        
+        self.write("Author/Book (2)/Book 2.epub", 2)
+        self.assertEqual(self.index.wait(), ["Author/Book (2)/Book 2.epub", "Author/Book (2)/Book 2.pdf"])
+        self.write("Author/Book (2)/Book 2.epub", 5)
+        self.write("Author/Book (2)/Book 2.pdf", 8)
+        self.assertEqual(self.index.wait(), [])
+
+    def test_incremental_update(self):
+        
+        # Test that after the first scan only the noted paths are stat'ed, and only inside the library.
+        
+        self.assertEqual(self.index.update(), 3)
+        self.write("Author/Book (2)/Book 2.epub", 5)
+        with patch("os.scandir") as mock_scandir:
+            self.index.note("./Calibre Library/Author/Book (2)/Book 2.epub")
+            self.index.note("./Other/file.txt")
+            self.assertEqual(self.index.update(), 1)
+            mock_scandir.assert_not_called()
+        self.assertEqual(self.index.update(), 0)
+        os.remove(os.path.join(self.library_dir, "Author/Book (1)/cover.jpg"))
+        self.index.note("Calibre Library/Author/Book (1)/cover.jpg")
+        self.assertEqual(self.index.update(), 1)
+        self.assertEqual(self.index.missing(), ["Author/Book (1)/cover.jpg", "Author/Book (2)/Book 2.pdf"])
+
+    def test_paths_noted_during_update_are_kept(self):
+        
+        # Test that a path noted while an update is running is refreshed by the next update.
+        
+        self.index.update()
+        self.write("Author/Book (2)/Book 2.epub", 5)
+        refresh = self.index._refresh
+
+        def note_during_refresh(connection, paths):
+            self.index.note("Calibre Library/Author/Book (2)/Book 2.epub")
+            return refresh(connection, paths)
+
+        with patch.object(self.index, '_refresh', side_effect=note_during_refresh):
+            self.assertEqual(self.index.update(), 0)
+        self.assertEqual(self.index.update(), 1)
+
+    def test_stale_entries_are_checked_again(self):
+        
+        # Test that a file which arrived without being noted is found before it is reported missing.
+        
+        self.index.update()
+        self.write("Author/Book (2)/Book 2.epub", 5)
+        self.write("Author/Book (2)/Book 2.pdf", 8)
+        self.assertEqual(self.index.missing(), [])
+
+    def test_sync_list_filters(self):
+        
+        # Test that formats left out of the generated sync_list are not expected.
+        
+        self.config.GenerateSyncList = True
+        self.config.SyncListFormats = "epub"
+        self.write("Author/Book (2)/Book 2.epub", 5)
+        self.assertEqual(self.index.wait(), [])
+
+    def test_hash(self):
+        
+        # Test that files are hashed only when their size or modification time changed.
+        
+        self.config.LibraryIndexHash = True
+        with patch("library_index._hash_file", return_value="digest") as mock_hash:
+            self.index.update()
+            self.assertEqual(mock_hash.call_count, 3)
+            self.index.update(full=True)
+            self.assertEqual(mock_hash.call_count, 3)
+
+    def test_unreadable_database(self):
+        
+        # Test that a database without the library tables is reported as unreadable.
+        
+        os.remove(self.db_path)
+        sqlite3.connect(self.db_path).close()
+        with patch.object(self.utils, 'log') as mock_log:
+            self.assertIsNone(self.index.missing())
+            mock_log.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# test_local_push.py
+
+import logging
+import subprocess
+import unittest
+from unittest.mock import patch, MagicMock
+
+from local_push import LocalChangePusher
+from book_index import Changeset
+from onedrive_parser import OneDriveOutputParser
+from onedrive_server import OneDriveServer
+from utils import Utils
+from default_config import default_config
+
+class TestLocalChangePusher(unittest.TestCase):
+    def setUp(self):
+        self.config = default_config
+        self.config.MetadataDBPath = "/data/Calibre Library/metadata.db"
+        self.config.OneDriveLibraryFolder = ""
+        self.utils = Utils(self.config)
+        self.onedrive_server = OneDriveServer(util=self.utils, config=self.config, calibre_server=MagicMock(),
+                                              parser=OneDriveOutputParser())
+        self.onedrive_server.checked = True
+        self.detector = MagicMock()
+        self.detector.has_changed.return_value = True
+        self.book_index = MagicMock()
+        self.book_index.diff.return_value = Changeset(added=[3], removed=[1], modified=[2],
+                                                         paths={1: "Author/Old (1)", 2: "Author/Edited (2)", 3: "Other/New (3)"})
+        self.pusher = LocalChangePusher(util=self.utils, config=self.config, onedrive_server=self.onedrive_server,
+                                        change_detector=self.detector, book_index=self.book_index)
+        self.commands = []
+
+    def tearDown(self):
+        self.config.MetadataDBPath = default_config.__class__.MetadataDBPath
+
+    def execute(self, remote_output=()):
+        def execute(cmd, timeout=None):
+            self.commands.append(cmd)
+            if "--dry-run" in cmd:
+                yield from remote_output
+        return execute
+
+    def test_pushes_changed_folders_then_metadata(self):
+        
+        # Test that only the changed book folders are uploaded, followed by metadata.db, and the new state is accepted.
+        
+        with patch.object(self.onedrive_server, '_execute', side_effect=self.execute()), \
+             patch.object(self.utils, 'log'):
+            self.assertTrue(self.pusher.push())
+        uploads = [cmd[cmd.index("--single-directory") + 1:] for cmd in self.commands if "--upload-only" in cmd]
+        self.assertEqual(uploads, [["Calibre Library/Author"], ["Calibre Library/Author/Edited (2)"], ["Calibre Library/Other/New (3)"],
+                                   ["Calibre Library", "--skip-dir", "*"]])
+        self.detector.accept.assert_called_once()
+        self.book_index.refresh.assert_called_once()
+
+    def test_whole_library_without_book_index(self):
+        
+        # Test that without a book index the whole library folder is uploaded and logged as such.
+        
+        self.pusher.book_index = None
+        with patch.object(self.onedrive_server, '_execute', side_effect=self.execute()), \
+             patch.object(self.utils, 'log') as mock_log:
+            self.assertTrue(self.pusher.push())
+        uploads = [cmd[cmd.index("--single-directory") + 1:] for cmd in self.commands if "--upload-only" in cmd]
+        self.assertEqual(uploads, [["Calibre Library"]])
+        mock_log.assert_any_call("Pushed local changes to OneDrive (whole library folder).")
+
+    def test_conflict_holds_back_push(self):
+        
+        # Test that nothing is uploaded when metadata.db changed on OneDrive as well.
+        
+        remote = ["Downloading file ./Calibre Library/metadata.db ... done."]
+        with patch.object(self.onedrive_server, '_execute', side_effect=self.execute(remote)), \
+             patch.object(self.utils, 'log') as mock_log:
+            self.assertIsNone(self.pusher.push())
+        self.assertEqual(len(self.commands), 1)
+        self.detector.accept.assert_not_called()
+        self.book_index.refresh.assert_not_called()
+        self.assertEqual(self.pusher.conflict_count, 1)
+        mock_log.assert_any_call("metadata.db changed on OneDrive as well. Leaving the local changes to the next full sync.", logging.WARNING)
+
+    def test_failed_upload_is_retried(self):
+        
+        # Test that a failed upload leaves the change unaccepted, so the next check pushes again.
+        
+        def execute(cmd, timeout=None):
+            if "--upload-only" in cmd:
+                raise subprocess.CalledProcessError(1, cmd)
+            yield from ()
+
+        with patch.object(self.onedrive_server, '_execute', side_effect=execute), \
+             patch.object(self.utils, 'log'):
+            self.assertIsNone(self.pusher.push())
+        self.detector.accept.assert_not_called()
+        # The book index keeps the changed books for the next push.
+        self.book_index.refresh.assert_not_called()
+
+    def test_skipped_while_syncing(self):
+        
+        # Test that no check runs while onedrive is syncing the library or before the first check.
+        
+        with self.onedrive_server.sync_lock:
+            self.assertFalse(self.pusher.push())
+        self.onedrive_server.checked = False
+        self.assertFalse(self.pusher.push())
+        self.detector.has_changed.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
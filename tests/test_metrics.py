@@ -0,0 +1,103 @@
+# test_metrics.py
+
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+from unittest.mock import patch
+
+from metrics import Metrics, MetricsServer
+from utils import Utils
+from default_config import default_config
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.config = default_config
+        self.config.MetricsSummaryPath = ""
+        self.utils = Utils(self.config)
+        self.metrics = Metrics(self.config)
+
+    def tearDown(self):
+        self.config.MetricsSummaryPath = ""
+        self.config.MetricsPort = 0
+
+    def test_counter_and_gauge(self):
+        
+        # Test that counters add up and gauges keep the last value.
+        
+        self.metrics.inc("reloads_total")
+        self.metrics.inc("reloads_total", 2)
+        self.metrics.set("calibre_up", 1)
+        self.metrics.set("calibre_up", 0)
+        self.assertEqual(self.metrics.get("reloads_total"), 3)
+        self.assertEqual(self.metrics.get("calibre_up"), 0)
+
+    def test_render_histogram(self):
+        
+        # Test the exposition format of a histogram with cumulative buckets.
+        
+        self.metrics.describe("sync_cycle_duration_seconds", "histogram", "Duration of a sync cycle.")
+        self.metrics.observe("sync_cycle_duration_seconds", 0.3)
+        self.metrics.observe("sync_cycle_duration_seconds", 7)
+        text = self.metrics.render()
+        self.assertIn("# HELP calibre_onedrive_sync_sync_cycle_duration_seconds Duration of a sync cycle.", text)
+        self.assertIn("# TYPE calibre_onedrive_sync_sync_cycle_duration_seconds histogram", text)
+        self.assertIn('calibre_onedrive_sync_sync_cycle_duration_seconds_bucket{le="0.25"} 0', text)
+        self.assertIn('calibre_onedrive_sync_sync_cycle_duration_seconds_bucket{le="0.5"} 1', text)
+        self.assertIn('calibre_onedrive_sync_sync_cycle_duration_seconds_bucket{le="10"} 2', text)
+        self.assertIn('calibre_onedrive_sync_sync_cycle_duration_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn("calibre_onedrive_sync_sync_cycle_duration_seconds_sum 7.3", text)
+        self.assertIn("calibre_onedrive_sync_sync_cycle_duration_seconds_count 2", text)
+
+    def test_render_labels(self):
+        
+        # Test that labelled series are rendered separately with escaped values.
+        
+        self.metrics.inc("reloads_total", labels={"library": "main"})
+        self.metrics.inc("reloads_total", labels={"library": 'say "hi"'})
+        text = self.metrics.render()
+        self.assertIn('calibre_onedrive_sync_reloads_total{library="main"} 1', text)
+        self.assertIn('calibre_onedrive_sync_reloads_total{library="say \\"hi\\""} 1', text)
+
+    def test_collectors_run_before_render(self):
+        
+        # Test that collectors update values when metrics are rendered.
+        
+        self.metrics.add_collector(lambda metrics: metrics.set("calibre_rss_bytes", 42))
+        self.assertIn("calibre_onedrive_sync_calibre_rss_bytes 42", self.metrics.render())
+
+    def test_record_cycle_writes_json_lines(self):
+        
+        # Test that cycle summaries are appended as JSON lines when a summary path is configured.
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.config.MetricsSummaryPath = os.path.join(tmpdir, "cycles.jsonl")
+            self.metrics.record_cycle({"duration_seconds": 1.5, "failed": False})
+            self.metrics.record_cycle({"duration_seconds": 2.0, "failed": True})
+            with open(self.config.MetricsSummaryPath) as f:
+                cycles = [json.loads(line) for line in f]
+        self.assertEqual([cycle["failed"] for cycle in cycles], [False, True])
+        self.assertIn("timestamp", cycles[0])
+
+    def test_metrics_endpoint(self):
+        
+        # Test that the HTTP endpoint serves the metrics and rejects other paths.
+        
+        self.config.MetricsHost = "127.0.0.1"
+        self.config.MetricsPort = 0
+        self.metrics.inc("reloads_total")
+        server = MetricsServer(util=self.utils, config=self.config, metrics=self.metrics)
+        with patch.object(self.utils, 'log'):
+            self.assertTrue(server.start())
+        try:
+            url = f"http://127.0.0.1:{server.server.server_port}"
+            with urllib.request.urlopen(f"{url}/metrics") as response:
+                self.assertIn(b"calibre_onedrive_sync_reloads_total 1", response.read())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"{url}/other")
+        finally:
+            server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
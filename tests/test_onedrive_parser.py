@@ -0,0 +1,70 @@
+# test_onedrive_parser.py
+
+import unittest
+
+from onedrive_parser import OneDriveOutputParser, DOWNLOAD, UPLOAD, DELETE, MOVE, CONFLICT, ERROR
+
+class TestOneDriveOutputParser(unittest.TestCase):
+    def setUp(self):
+        self.parser = OneDriveOutputParser(history=3)
+
+    def test_download(self):
+        
+        # Test that a finished download is parsed with its path.
+        
+        event = self.parser.parse("Downloading file ./Calibre Library/metadata.db ... done.")
+        self.assertEqual((event.action, event.path, event.failed), (DOWNLOAD, "./Calibre Library/metadata.db", False))
+        self.assertTrue(event.is_metadata_db)
+
+    def test_failed_download(self):
+        
+        # Test that a failed download is marked as failed.
+        
+        event = self.parser.parse("Downloading file ./Calibre Library/Author/Book (1)/Book.epub ... failed!")
+        self.assertEqual(event.path, "./Calibre Library/Author/Book (1)/Book.epub")
+        self.assertTrue(event.failed)
+        self.assertFalse(event.is_metadata_db)
+
+    def test_size(self):
+        
+        # Test that a size printed after the item is parsed.
+        
+        event = self.parser.parse("Uploading new file ./Calibre Library/Author/Book (1)/Book.epub ... done. (524288 bytes)")
+        self.assertEqual((event.action, event.size), (UPLOAD, 524288))
+
+    def test_other_actions(self):
+        
+        # Test deletes, moves, conflicts and errors.
+        
+        delete = self.parser.parse("Deleting item ./Calibre Library/metadata.db-journal")
+        self.assertEqual((delete.action, delete.path), (DELETE, "./Calibre Library/metadata.db-journal"))
+        self.assertTrue(delete.is_metadata_db)
+
+        move = self.parser.parse("Moving ./Calibre Library/Author/Old (1) to ./Calibre Library/Author/New (1)")
+        self.assertEqual((move.action, move.path, move.target), (MOVE, "./Calibre Library/Author/Old (1)", "./Calibre Library/Author/New (1)"))
+
+        conflict = self.parser.parse("The local item is out-of-sync with OneDrive, renaming to preserve existing file and prevent local data loss: "
+                                     "./Calibre Library/metadata.db -> ./Calibre Library/metadata-host.db")
+        self.assertEqual((conflict.action, conflict.path), (CONFLICT, "./Calibre Library/metadata.db"))
+
+        error = self.parser.parse("ERROR: Cannot connect to Microsoft OneDrive Service")
+        self.assertEqual((error.action, error.path, error.failed), (ERROR, None, True))
+        self.assertEqual(self.parser.counts[DELETE], 1)
+
+    def test_unrelated_lines(self):
+        
+        # Test that lines not describing an item produce no event.
+        
+        self.assertIsNone(self.parser.parse("Syncing changes from OneDrive ..."))
+        self.assertIsNone(self.parser.parse("Processing ./Calibre Library/Author/Book (1)/cover.jpg"))
+
+    def test_ring_buffer_is_bounded(self):
+        
+        # Test that only the most recent lines are kept.
+        
+        for index in range(10):
+            self.parser.parse(f"line {index}")
+        self.assertEqual(self.parser.tail(), ["line 7", "line 8", "line 9"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 # test_onedrive_server.py
 
+import logging
+import os
 import subprocess
+import tempfile
+import time
 import unittest
 from unittest.mock import patch, MagicMock, mock_open
 
@@ -8,6 +12,9 @@ from onedrive_server import OneDriveServer
 from utils import Utils
 from default_config import default_config
 from calibre_server import CalibreServer
+from metrics import Metrics
+from onedrive_parser import OneDriveOutputParser
+from state_store import StateStore
 
 class TestOneDriveServer(unittest.TestCase):
     def setUp(self):
@@ -25,6 +32,7 @@ class TestOneDriveServer(unittest.TestCase):
         self.onedrive_server.last_modified_time = 1625068800.0  # Mocked previous timestamp
 
         with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.utils, 'debug') as mock_debug, \
              patch.object(self.utils, 'get_last_modified_time', return_value=1625068800.0) as mock_get_mtime, \
              patch.object(self.calibre_server, 'reconnect') as mock_reconnect:
             mock_onFinish = MagicMock()
@@ -32,8 +40,8 @@ class TestOneDriveServer(unittest.TestCase):
 
             # Verify logs
             mock_log.assert_any_call("Starting OneDrive sync...")
-            mock_log.assert_any_call("Syncing...")
-            mock_log.assert_any_call("Done")
+            mock_debug.assert_any_call("Syncing...")
+            mock_debug.assert_any_call("Done")
             mock_log.assert_any_call("OneDrive sync finished.")
             mock_log.assert_any_call("No changes detected in metadata.db. No need to reload CalibreWeb DB.")
 
@@ -50,6 +58,7 @@ class TestOneDriveServer(unittest.TestCase):
         self.onedrive_server.last_modified_time = 1625068800.0  # Mocked previous timestamp
 
         with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.utils, 'debug') as mock_debug, \
              patch.object(self.utils, 'get_last_modified_time', return_value=1625072400.0) as mock_get_mtime, \
              patch.object(self.calibre_server, 'reconnect') as mock_reconnect:
             mock_onFinish = MagicMock()
@@ -57,8 +66,8 @@ class TestOneDriveServer(unittest.TestCase):
 
             # Verify logs
             mock_log.assert_any_call("Starting OneDrive sync...")
-            mock_log.assert_any_call("Syncing...")
-            mock_log.assert_any_call("Done")
+            mock_debug.assert_any_call("Syncing...")
+            mock_debug.assert_any_call("Done")
             mock_log.assert_any_call("OneDrive sync finished.")
             mock_log.assert_any_call("Changes detected in metadata.db. Reloading CalibreWeb DB...")
 
@@ -73,14 +82,345 @@ class TestOneDriveServer(unittest.TestCase):
         
         with patch.object(self.utils, 'log') as mock_log:
             mock_onFinish = MagicMock()
-            self.onedrive_server.call_onedrive(onFinish=mock_onFinish)
+            result = self.onedrive_server.call_onedrive(onFinish=mock_onFinish)
 
             # Verify logs
             mock_log.assert_any_call("Starting OneDrive sync...")
-            mock_log.assert_any_call("OneDrive sync failed: Command '['onedrive', '--synchronize']' returned non-zero exit status 1.")
+            mock_log.assert_any_call("OneDrive sync failed: Command '['onedrive', '--synchronize']' returned non-zero exit status 1.", logging.ERROR)
+
+            # Verify that the failure is reported and onFinish is still called, so the schedule goes on
+            self.assertIsNone(result)
+            mock_onFinish.assert_called_once()
+            self.assertEqual(self.onedrive_server.status()["last_error"],
+                             "OneDrive sync failed: Command '['onedrive', '--synchronize']' returned non-zero exit status 1.")
+
+    @patch.object(OneDriveServer, '_execute')
+    def test_call_onedrive_checks_only_after_metadata_event(self, mock_execute):
+        
+        # Test that with a parser, metadata.db is checked on the first sync and then only when onedrive reports touching it.
+        
+        self.onedrive_server.parser = OneDriveOutputParser()
+        self.config.SkipCheckWithoutDBEvent = True
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.onedrive_server, '_reload_if_changed', side_effect=lambda: setattr(self.onedrive_server, 'checked', True)) as mock_check:
+            mock_execute.return_value = iter(["Downloading file ./Calibre Library/Author/Book (1)/cover.jpg ... done."])
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+            self.assertEqual(mock_check.call_count, 1)
+
+            mock_execute.return_value = iter(["Downloading file ./Calibre Library/Author/Book (1)/cover.jpg ... done."])
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+            self.assertEqual(mock_check.call_count, 1)
+            self.assertEqual(self.onedrive_server.changed_paths, {"./Calibre Library/Author/Book (1)/cover.jpg"})
+            mock_log.assert_any_call("OneDrive reported no change to metadata.db. No need to check it.")
+
+            mock_execute.return_value = iter(["Downloading file ./Calibre Library/metadata.db ... done."])
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+            self.assertEqual(mock_check.call_count, 2)
+            self.assertEqual(self.onedrive_server.changed_paths, set())
+
+    @patch.object(OneDriveServer, '_execute')
+    def test_call_onedrive_failure_logs_recent_output(self, mock_execute):
+        
+        # Test that the last lines onedrive printed are logged when the sync fails.
+        
+        self.onedrive_server.parser = OneDriveOutputParser()
+
+        def execute(cmd, timeout=None):
+            yield "ERROR: Cannot connect to Microsoft OneDrive Service"
+            raise subprocess.CalledProcessError(1, cmd)
+
+        mock_execute.side_effect = execute
+        with patch.object(self.utils, 'log') as mock_log:
+            self.assertIsNone(self.onedrive_server.call_onedrive(onFinish=MagicMock()))
+            mock_log.assert_any_call("Last OneDrive output:\nERROR: Cannot connect to Microsoft OneDrive Service", logging.ERROR)
+
+    def test_restart_does_not_reload_unchanged_database(self):
+        
+        # Test that the modification time accepted before a restart is restored, so an unchanged database is not reloaded.
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = StateStore(util=self.utils, config=self.config, path=os.path.join(tmpdir, "sync_state.db"))
+            self.onedrive_server.state_store = store
+            with patch.object(self.utils, 'log'), \
+                 patch.object(self.utils, 'get_last_modified_time', return_value=1625068800.0), \
+                 patch.object(self.calibre_server, 'reconnect') as mock_reconnect:
+                self.onedrive_server._check_metadata_db()
+                mock_reconnect.assert_called_once()
+
+                restarted = OneDriveServer(util=self.utils, config=self.config, calibre_server=self.calibre_server, state_store=store)
+                self.assertEqual(restarted.last_modified_time, 1625068800.0)
+                restarted._check_metadata_db()
+                mock_reconnect.assert_called_once()
+
+    @patch.object(OneDriveServer, '_execute')
+    def test_call_onedrive_uses_change_detector(self, mock_execute):
+        
+        # Test that a change detector decides whether to reconnect, and is told once the change was handled.
+        
+        mock_execute.return_value = iter(["Done"])
+        detector = MagicMock()
+        detector.has_changed.return_value = False
+        self.onedrive_server.change_detector = detector
+
+        with patch.object(self.utils, 'log'), \
+             patch.object(self.calibre_server, 'reconnect') as mock_reconnect:
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+            mock_reconnect.assert_not_called()
+            detector.accept.assert_not_called()
+
+            detector.has_changed.return_value = True
+            mock_execute.return_value = iter(["Done"])
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+            mock_reconnect.assert_called_once()
+            detector.accept.assert_called_once()
+
+    @patch.object(OneDriveServer, '_execute')
+    def test_call_onedrive_refreshes_book_index_after_reload(self, mock_execute):
+        
+        # Test that the book index is refreshed after Calibre-Web was reloaded, and not when nothing changed.
+        
+        mock_execute.return_value = iter(["Done"])
+        book_index = MagicMock()
+        self.onedrive_server.book_index = book_index
+        self.onedrive_server.last_modified_time = 1625068800.0
+
+        with patch.object(self.utils, 'log'), \
+             patch.object(self.utils, 'get_last_modified_time', return_value=1625068800.0), \
+             patch.object(self.calibre_server, 'reconnect'):
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+            book_index.refresh.assert_not_called()
+
+        mock_execute.return_value = iter(["Done"])
+        with patch.object(self.utils, 'log'), \
+             patch.object(self.utils, 'get_last_modified_time', return_value=1625072400.0), \
+             patch.object(self.calibre_server, 'reconnect'):
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+            book_index.refresh.assert_called_once()
+
+    def test_check_skipped_until_database_settles(self):
+        
+        # Test that no reload happens while the settle gate reports metadata.db as still changing.
+        
+        gate = MagicMock()
+        gate.wait.return_value = False
+        self.onedrive_server.settle_gate = gate
+
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.utils, 'get_last_modified_time', return_value=1625072400.0), \
+             patch.object(self.calibre_server, 'reconnect') as mock_reconnect:
+            self.onedrive_server._check_and_reload_calibre()
+            mock_reconnect.assert_not_called()
+            mock_log.assert_any_call("metadata.db is still changing. Will check again later.")
+            self.assertIsNone(self.onedrive_server.last_modified_time)
+
+    def test_unconfirmed_reconnect_keeps_change_pending(self):
+        
+        # Test that a change is only accepted, and the state saved, once Calibre-Web confirmed the reconnect.
+        
+        detector = MagicMock()
+        detector.has_changed.return_value = True
+        self.onedrive_server.change_detector = detector
+        self.onedrive_server.state_store = MagicMock()
+
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.calibre_server, 'reconnect', return_value=False):
+            self.onedrive_server._check_and_reload_calibre()
+            mock_log.assert_any_call("CalibreWeb did not confirm the reload. Will check again later.", logging.WARNING)
+        detector.accept.assert_not_called()
+        self.onedrive_server.state_store.set.assert_not_called()
+        self.assertFalse(self.onedrive_server.checked)
+        self.assertEqual(self.onedrive_server.reload_count, 0)
+
+        with patch.object(self.utils, 'log'), \
+             patch.object(self.calibre_server, 'reconnect', return_value=True):
+            self.onedrive_server._check_and_reload_calibre()
+        detector.accept.assert_called_once()
+        self.onedrive_server.state_store.set.assert_called_once()
+        self.assertTrue(self.onedrive_server.checked)
+
+    def test_failed_publish_skips_reload(self):
+        
+        # Test that Calibre-Web is not reloaded, and the change is retried, when the snapshot could not be published.
+        
+        publisher = MagicMock()
+        publisher.publish.return_value = False
+        self.onedrive_server.publisher = publisher
+
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.utils, 'get_last_modified_time', return_value=1625072400.0), \
+             patch.object(self.calibre_server, 'reconnect') as mock_reconnect:
+            self.onedrive_server._check_and_reload_calibre()
+            mock_reconnect.assert_not_called()
+            mock_log.assert_any_call("Could not publish metadata.db. Will check again later.", logging.ERROR)
+            self.assertIsNone(self.onedrive_server.last_modified_time)
+
+            publisher.publish.return_value = True
+            self.onedrive_server._check_and_reload_calibre()
+            mock_reconnect.assert_called_once()
+            self.assertEqual(self.onedrive_server.last_modified_time, 1625072400.0)
+
+    def test_concurrent_checks_are_coalesced(self):
+        
+        # Test that checks requested while one is running collapse into a single follow-up check.
+        
+        calls = []
+
+        def check():
+            calls.append(1)
+            if len(calls) == 1:
+                # Simulate three requests arriving while the first check runs.
+                for _ in range(3):
+                    self.onedrive_server._check_and_reload_calibre()
+
+        with patch.object(self.onedrive_server, '_check_metadata_db', side_effect=check):
+            self.onedrive_server._check_and_reload_calibre()
+
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(self.onedrive_server._checking)
+
+    @patch.object(OneDriveServer, '_execute')
+    def test_call_onedrive_records_metrics(self, mock_execute):
+        
+        # Test that a sync cycle records its duration, output volume, reloads and failures.
+        
+        metrics = Metrics(self.config)
+        self.onedrive_server.metrics = metrics
+        labels = self.onedrive_server.metric_labels
+        mock_execute.return_value = iter(["Syncing Élan.epub", "Done"])
 
-            # Verify that onFinish was not called due to failure
-            mock_onFinish.assert_not_called()
+        with patch.object(self.utils, 'log'), \
+             patch.object(self.utils, 'get_last_modified_time', return_value=1625072400.0), \
+             patch.object(self.calibre_server, 'reconnect'), \
+             patch.object(metrics, 'record_cycle') as mock_record_cycle:
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+
+            self.assertEqual(metrics.get("sync_cycle_duration_seconds", labels=labels), 1)
+            self.assertEqual(metrics.get("metadata_check_duration_seconds", labels=labels), 1)
+            self.assertEqual(metrics.get("onedrive_output_lines_total", labels=labels), 2)
+            self.assertEqual(metrics.get("onedrive_output_bytes_total", labels=labels), 19 + 5)
+            self.assertEqual(metrics.get("reloads_total", labels=labels), 1)
+            summary = mock_record_cycle.call_args[0][0]
+            self.assertTrue(summary["reloaded"])
+            self.assertFalse(summary["failed"])
+
+            mock_execute.side_effect = subprocess.CalledProcessError(1, ["onedrive", "--synchronize"])
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+            self.assertEqual(metrics.get("onedrive_sync_failures_total", labels=labels), 1)
+            self.assertTrue(mock_record_cycle.call_args[0][0]["failed"])
+
+    def test_reload_held_back_for_missing_books(self):
+        
+        # Test that a changed metadata.db is not reloaded while its book files are missing, until the maximum wait passes.
+        
+        library_index = MagicMock()
+        library_index.wait.return_value = ["Author/Book (1)/Book 1.epub"]
+        self.onedrive_server.library_index = library_index
+        with patch.object(self.utils, 'log') as mock_log, \
+             patch.object(self.onedrive_server, '_detect_change', return_value=True), \
+             patch.object(self.onedrive_server, '_accept_change'), \
+             patch.object(self.calibre_server, 'reconnect') as mock_reconnect:
+            self.onedrive_server._reload_if_changed()
+            mock_reconnect.assert_not_called()
+            self.assertFalse(self.onedrive_server.checked)
+            self.assertEqual(self.onedrive_server.status()["missing_files"], 1)
+            mock_log.assert_any_call("1 book files referenced by metadata.db are missing or incomplete (Author/Book (1)/Book 1.epub). Will check again later.", logging.WARNING)
+
+            self.onedrive_server._incomplete_since -= self.config.IntegrityMaxWaitSecond
+            self.onedrive_server._reload_if_changed()
+            mock_reconnect.assert_called_once()
+
+            library_index.wait.return_value = []
+            self.onedrive_server._reload_if_changed()
+            self.assertEqual(mock_reconnect.call_count, 2)
+            self.assertEqual(self.onedrive_server.missing_files, [])
+
+    def test_parsed_paths_are_noted(self):
+        
+        # Test that the paths onedrive reports are handed to the library index.
+        
+        parser = MagicMock()
+        parser.parse.return_value = MagicMock(path="./Calibre Library/a.epub", target=None, failed=False)
+        server = OneDriveServer(util=self.utils, config=self.config, calibre_server=self.calibre_server,
+                                parser=parser, library_index=MagicMock())
+        server._parse("Downloading file ./Calibre Library/a.epub ... done")
+        server.library_index.note.assert_called_once_with("./Calibre Library/a.epub")
+
+    def test_reload_now_and_status(self):
+        
+        # Test that a requested reload reconnects although metadata.db did not change, and the status reports it.
+        
+        with patch.object(self.utils, 'log'), \
+             patch.object(self.calibre_server, 'reconnect', return_value=True) as mock_reconnect, \
+             patch.object(self.onedrive_server, '_detect_change', return_value=False), \
+             patch.object(self.onedrive_server, '_accept_change') as mock_accept:
+            self.assertTrue(self.onedrive_server.reload_now())
+            mock_reconnect.assert_called_once()
+            mock_accept.assert_not_called()
+        status = self.onedrive_server.status()
+        self.assertEqual((status["phase"], status["reload_count"]), ("idle", 1))
+
+    def test_reload_now_deferred_by_settle_gate(self):
+        
+        # Test that a reload held back until metadata.db settles is reported as pending, not with an earlier result.
+        
+        self.onedrive_server._last_reconnect = True
+        self.onedrive_server.settle_gate = MagicMock()
+        self.onedrive_server.settle_gate.wait.return_value = False
+        with patch.object(self.utils, 'log'), \
+             patch.object(self.calibre_server, 'reconnect', return_value=True) as mock_reconnect:
+            self.assertIsNone(self.onedrive_server.reload_now())
+            mock_reconnect.assert_not_called()
+
+            # The request is kept for the next check.
+            self.onedrive_server.settle_gate.wait.return_value = True
+            with patch.object(self.onedrive_server, '_detect_change', return_value=False):
+                self.onedrive_server._check_and_reload_calibre()
+            mock_reconnect.assert_called_once()
+
+    def test_reload_now_waits_for_running_check(self):
+        
+        # Test that a reload requested during a check is left to that check instead of reconnecting alongside it.
+        
+        self.onedrive_server._checking = True
+        with patch.object(self.utils, 'log'), \
+             patch.object(self.calibre_server, 'reconnect', return_value=True) as mock_reconnect, \
+             patch.object(self.onedrive_server, '_detect_change', return_value=False):
+            self.assertIsNone(self.onedrive_server.reload_now())
+            mock_reconnect.assert_not_called()
+            self.assertTrue(self.onedrive_server._recheck)
+
+            # The running check picks the request up in its follow-up.
+            self.onedrive_server._checking = False
+            self.onedrive_server._check_and_reload_calibre()
+            mock_reconnect.assert_called_once()
+
+    def test_onedrive_command_confdir(self):
+        
+        # Test that the configuration directory of the library is passed to the onedrive client.
+        
+        self.assertEqual(self.onedrive_server._onedrive_command("--synchronize"), ["onedrive", "--synchronize"])
+        self.config.OneDriveConfDir = "/config/onedrive-work"
+        try:
+            self.assertEqual(self.onedrive_server._onedrive_command("--monitor"),
+                             ["onedrive", "--monitor", "--confdir", "/config/onedrive-work"])
+        finally:
+            self.config.OneDriveConfDir = ""
+
+    def test_onedrive_command_resyncs_after_sync_list_change(self):
+        
+        # Test that the sync after a rewrite of the sync_list runs with --resync, and the ones after a successful sync do not.
+        
+        sync_list = MagicMock()
+        sync_list.resync_required = True
+        self.onedrive_server.sync_list = sync_list
+        with patch.object(self.onedrive_server, '_execute', return_value=iter([])) as mock_execute, \
+             patch.object(self.onedrive_server, '_check_and_reload_calibre'), \
+             patch.object(self.utils, 'log'):
+            self.onedrive_server.call_onedrive(onFinish=MagicMock())
+            self.assertEqual(mock_execute.call_args[0][0], ["onedrive", "--synchronize", "--resync", "--resync-auth"])
+            sync_list.update.assert_called_once()
+            self.assertFalse(sync_list.resync_required)
+            self.assertEqual(self.onedrive_server._onedrive_command("--synchronize"), ["onedrive", "--synchronize"])
 
     @patch("subprocess.Popen")
     def test_execute_success(self, mock_popen):
@@ -95,7 +435,28 @@ class TestOneDriveServer(unittest.TestCase):
 
         output = list(self.onedrive_server._execute(['some', 'command']))
         self.assertEqual(output, ['line1', 'line2'])
-        mock_popen.assert_called_with(['some', 'command'], stdout=subprocess.PIPE, universal_newlines=True)
+        mock_popen.assert_called_with(['some', 'command'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def test_execute_timeout_kills_process(self):
+        
+        #Test that a command running longer than the timeout is killed and reported.
+        
+        started = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            list(self.onedrive_server._execute(['sleep', '30'], timeout=0.2))
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertIsNone(self.onedrive_server.process)
+
+    def test_execute_terminates_abandoned_process(self):
+        
+        #Test that closing the output early terminates the command instead of leaving it running.
+        
+        output = self.onedrive_server._execute(['sh', '-c', 'echo started; sleep 30'])
+        self.assertEqual(next(output), "started")
+        process = self.onedrive_server.process
+        output.close()
+        self.assertIsNotNone(process.poll())
+        self.assertIsNone(self.onedrive_server.process)
 
     @patch("subprocess.Popen")
     def test_execute_failure(self, mock_popen):
@@ -111,5 +472,100 @@ class TestOneDriveServer(unittest.TestCase):
         with self.assertRaises(subprocess.CalledProcessError):
             output = list(self.onedrive_server._execute(['some', 'command']))
 
+    def test_run_monitor_reloads_on_metadata_download(self):
+        
+        # Test that the monitor checks metadata.db when onedrive reports downloading it.
+        
+        def execute(cmd):
+            self.assertEqual(cmd, ["onedrive", "--monitor"])
+            self.onedrive_server._stop_event.set()
+            yield "Processing ./Calibre Library/cover.jpg"
+            yield "Downloading file ./Calibre Library/metadata.db ... done."
+
+        with patch.object(self.onedrive_server, '_execute', side_effect=execute), \
+             patch.object(self.onedrive_server, '_check_and_reload_calibre') as mock_check, \
+             patch.object(self.utils, 'log'):
+            self.onedrive_server.run_monitor()
+
+            # Once at startup, once for the metadata.db download.
+            self.assertEqual(mock_check.call_count, 2)
+
+    def test_run_monitor_restarts_with_backoff(self):
+        
+        # Test that the monitor process is restarted with growing delays when it exits.
+        
+        calls = []
+
+        def execute(cmd):
+            calls.append(cmd)
+            if len(calls) == 3:
+                self.onedrive_server._stop_event.set()
+            raise subprocess.CalledProcessError(1, cmd)
+            yield
+
+        with patch.object(self.config, 'MonitorRestartMinSecond', 0.01), \
+             patch.object(self.config, 'MonitorRestartMaxSecond', 10), \
+             patch.object(self.onedrive_server, '_execute', side_effect=execute), \
+             patch.object(self.onedrive_server, '_check_and_reload_calibre'), \
+             patch.object(self.utils, 'log') as mock_log:
+            self.onedrive_server.run_monitor()
+
+            self.assertEqual(len(calls), 3)
+            mock_log.assert_any_call("Restarting OneDrive monitor in 0.01 seconds...", logging.WARNING)
+            mock_log.assert_any_call("Restarting OneDrive monitor in 0.02 seconds...", logging.WARNING)
+
+    def test_run_monitor_follows_sync_list(self):
+        
+        # Test that a changed sync_list restarts the monitor at once, with --resync, which a successful run clears.
+        
+        sync_list = MagicMock()
+        sync_list.resync_required = False
+        # Rewritten when the first monitor starts and again after its first download, then unchanged.
+        rewrites = [True, True, False, False]
+
+        def update():
+            rewritten = rewrites.pop(0)
+            sync_list.resync_required = sync_list.resync_required or rewritten
+            return rewritten
+
+        sync_list.update.side_effect = update
+        self.onedrive_server.sync_list = sync_list
+        calls = []
+
+        def execute(cmd):
+            calls.append(cmd)
+            if len(calls) == 2:
+                self.onedrive_server._stop_event.set()
+            yield "Downloading file ./Calibre Library/metadata.db ... done."
+            if len(calls) == 1:
+                # Terminated for the restart.
+                raise subprocess.CalledProcessError(-15, cmd)
+
+        with patch.object(self.onedrive_server, '_execute', side_effect=execute), \
+             patch.object(self.onedrive_server, '_check_and_reload_calibre'), \
+             patch.object(self.onedrive_server, '_terminate') as mock_terminate, \
+             patch.object(self.utils, 'log') as mock_log:
+            self.onedrive_server.run_monitor()
+
+        self.assertIn("--resync", calls[0])
+        self.assertIn("--resync", calls[1])
+        self.assertFalse(sync_list.resync_required)
+        mock_terminate.assert_called_once()
+        mock_log.assert_any_call("sync_list changed. Restarting OneDrive monitor...")
+        self.assertFalse(any("Restarting OneDrive monitor in" in call.args[0] for call in mock_log.call_args_list))
+
+    def test_stop_terminates_running_process(self):
+        
+        # Test that stop() terminates the onedrive child process.
+        
+        process_mock = MagicMock()
+        process_mock.poll.return_value = None
+        self.onedrive_server.process = process_mock
+
+        self.onedrive_server.stop()
+
+        process_mock.terminate.assert_called_once()
+        self.assertTrue(self.onedrive_server._stop_event.is_set())
+
 if __name__ == '__main__':
     unittest.main()
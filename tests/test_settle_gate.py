@@ -0,0 +1,122 @@
+# test_settle_gate.py
+
+import copy
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from settle_gate import JOURNAL_MAGIC, SettleGate
+from utils import Utils
+from default_config import default_config
+
+class TestSettleGate(unittest.TestCase):
+    def setUp(self):
+        self.config = copy.copy(default_config)
+        self.config.SettleWindowSecond = 0.2
+        self.config.SettlePollSecond = 0.05
+        self.config.SettleTimeoutSecond = 2
+        self.config.SettleQuickCheck = False
+        self.utils = Utils(self.config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "metadata.db")
+        connection = sqlite3.connect(self.db_path)
+        connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY)")
+        connection.commit()
+        connection.close()
+        self.gate = SettleGate(util=self.utils, config=self.config, db_path=self.db_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_wait_returns_after_settle_window(self):
+
+        # Test that wait() succeeds once the files stayed unchanged for the settle window.
+
+        started = time.monotonic()
+        self.assertTrue(self.gate.wait())
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    def test_wait_is_immediate_when_already_settled(self):
+
+        # Test that nothing is waited for when the files did not change since they last settled.
+
+        self.gate.wait()
+        with patch("time.sleep") as mock_sleep:
+            self.assertTrue(self.gate.wait())
+            mock_sleep.assert_not_called()
+
+    def test_wait_restarts_window_on_writes(self):
+
+        # Test that writes during the window postpone the result until they stop.
+
+        def writer():
+            for _ in range(4):
+                time.sleep(0.1)
+                with open(self.db_path + "-wal", "a") as f:
+                    f.write("x")
+
+        thread = threading.Thread(target=writer)
+        started = time.monotonic()
+        thread.start()
+        self.assertTrue(self.gate.wait())
+        thread.join()
+        self.assertGreaterEqual(time.monotonic() - started, 0.6)
+
+    def write_journal(self, header):
+        with open(self.db_path + "-journal", "wb") as f:
+            f.write(header + bytes(504))
+
+    def test_wait_times_out_while_journal_exists(self):
+
+        # Test that a hot rollback journal keeps the gate closed until the timeout.
+
+        self.config.SettleTimeoutSecond = 0.3
+        self.write_journal(JOURNAL_MAGIC)
+        with patch.object(self.utils, 'log') as mock_log:
+            self.assertFalse(self.gate.wait())
+            mock_log.assert_called_with("metadata.db did not settle within 0.3 seconds.", logging.WARNING)
+
+    def test_finished_journal_does_not_block(self):
+
+        # Test that a rollback journal whose header was zeroed or truncated at commit does not count as a transaction.
+
+        self.write_journal(bytes(8))
+        self.assertTrue(self.gate.wait())
+        open(self.db_path + "-journal", "w").close()
+        self.assertTrue(self.gate.wait())
+
+    def test_stale_hot_journal_settles(self):
+
+        # Test that a hot journal still unchanged after a wait timed out on it is treated as a leftover at the next check.
+
+        self.config.SettleTimeoutSecond = 0.3
+        self.write_journal(JOURNAL_MAGIC)
+        with patch.object(self.utils, 'log'):
+            self.gate.wait()
+            self.assertTrue(self.gate.wait())
+
+    def test_quick_check_rejects_corrupt_database(self):
+
+        # Test that a corrupt database fails the optional quick check.
+
+        self.config.SettleQuickCheck = True
+        with open(self.db_path, "wb") as f:
+            f.write(b"not a database" * 100)
+        with patch.object(self.utils, 'log') as mock_log:
+            self.assertFalse(self.gate.wait())
+            mock_log.assert_called_once()
+
+    def test_quick_check_accepts_valid_database(self):
+
+        # Test that a valid database passes the optional quick check.
+
+        self.config.SettleQuickCheck = True
+        self.assertTrue(self.gate.wait())
+
+if __name__ == '__main__':
+    unittest.main()
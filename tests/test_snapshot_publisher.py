@@ -0,0 +1,110 @@
+# test_snapshot_publisher.py
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from snapshot_publisher import SnapshotPublisher
+from utils import Utils
+from default_config import default_config
+
+class TestSnapshotPublisher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.staging_dir = os.path.join(self.tmpdir.name, "staging")
+        self.published_dir = os.path.join(self.tmpdir.name, "published")
+        os.makedirs(os.path.join(self.staging_dir, "Author"))
+        os.makedirs(self.published_dir)
+        self.config = default_config
+        self.config.StagingMetadataDBPath = os.path.join(self.staging_dir, "metadata.db")
+        self.config.MetadataDBPath = os.path.join(self.published_dir, "metadata.db")
+        self.config.PublishPagesPerStep = 1
+        self.config.PublishStepSleepSecond = 0
+        self.config.PublishLinkBooks = True
+        self.utils = Utils(self.config)
+        self.publisher = SnapshotPublisher(util=self.utils, config=self.config)
+
+        connection = sqlite3.connect(self.config.StagingMetadataDBPath)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT)")
+        connection.executemany("INSERT INTO books (title) VALUES (?)", [(f"Book {i}",) for i in range(500)])
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        self.config.StagingMetadataDBPath = ""
+        self.config.MetadataDBPath = "path/to/metadata.db"
+        self.tmpdir.cleanup()
+
+    def count_published_books(self):
+        connection = sqlite3.connect(self.config.MetadataDBPath)
+        try:
+            return connection.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_publish_copies_database(self):
+
+        # Test that the staging database is copied to the published path as a single rollback-journal file.
+
+        with patch.object(self.utils, 'log'):
+            self.assertTrue(self.publisher.publish())
+        self.assertEqual(self.count_published_books(), 500)
+        self.assertFalse(os.path.exists(self.config.MetadataDBPath + ".publishing"))
+        connection = sqlite3.connect(self.config.MetadataDBPath)
+        self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+        connection.close()
+
+    def test_publish_replaces_file_atomically(self):
+
+        # Test that a republish swaps in a new file, so open readers keep their consistent old snapshot.
+
+        with patch.object(self.utils, 'log'):
+            self.publisher.publish()
+        old_inode = os.stat(self.config.MetadataDBPath).st_ino
+        reader = sqlite3.connect(self.config.MetadataDBPath)
+
+        connection = sqlite3.connect(self.config.StagingMetadataDBPath)
+        connection.execute("DELETE FROM books WHERE id > 100")
+        connection.commit()
+        connection.close()
+        with patch.object(self.utils, 'log'):
+            self.assertTrue(self.publisher.publish())
+
+        self.assertNotEqual(os.stat(self.config.MetadataDBPath).st_ino, old_inode)
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM books").fetchone()[0], 500)
+        reader.close()
+        self.assertEqual(self.count_published_books(), 100)
+
+    def test_publish_links_book_folders(self):
+
+        # Test that book folders of the staging library are linked next to the published database.
+
+        with patch.object(self.utils, 'log'):
+            self.publisher.publish()
+        link = os.path.join(self.published_dir, "Author")
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(os.readlink(link), os.path.join(self.staging_dir, "Author"))
+        self.assertFalse(os.path.exists(os.path.join(self.published_dir, "metadata.db-wal")))
+
+        os.rmdir(os.path.join(self.staging_dir, "Author"))
+        with patch.object(self.utils, 'log'):
+            self.publisher.publish()
+        self.assertFalse(os.path.lexists(link))
+
+    def test_publish_failure_keeps_previous_snapshot(self):
+
+        # Test that a failed publish leaves the previously published database in place.
+
+        with patch.object(self.utils, 'log'):
+            self.publisher.publish()
+        os.remove(self.config.StagingMetadataDBPath)
+        with patch.object(self.utils, 'log') as mock_log:
+            self.assertFalse(self.publisher.publish())
+            self.assertTrue(mock_log.call_args[0][0].startswith("Failed to publish metadata.db snapshot"))
+        self.assertEqual(self.count_published_books(), 500)
+
+if __name__ == '__main__':
+    unittest.main()
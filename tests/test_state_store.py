@@ -0,0 +1,54 @@
+# test_state_store.py
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from state_store import StateStore
+from utils import Utils
+from default_config import default_config
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.config = default_config
+        self.utils = Utils(self.config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "sync_state.db")
+        self.store = StateStore(util=self.utils, config=self.config, library="home", path=self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_values_survive_reopening(self):
+        
+        # Test that stored values are read back by a new store on the same file.
+        
+        self.assertTrue(self.store.update({"last_sync_time": 1700000000.5, "change_detector": {"stat": [1, 2, None]}}))
+        reopened = StateStore(util=self.utils, config=self.config, library="home", path=self.path)
+        self.assertEqual(reopened.get("last_sync_time"), 1700000000.5)
+        self.assertEqual(reopened.load()["change_detector"], {"stat": [1, 2, None]})
+        self.assertIsNone(reopened.get("missing"))
+
+    def test_libraries_are_kept_apart(self):
+        
+        # Test that libraries sharing the file do not see each other's values.
+        
+        other = StateStore(util=self.utils, config=self.config, library="work", path=self.path)
+        self.store.set("last_modified_time", 1.0)
+        other.set("last_modified_time", 2.0)
+        self.assertEqual(self.store.get("last_modified_time"), 1.0)
+        self.assertEqual(other.get("last_modified_time"), 2.0)
+
+    def test_unwritable_path(self):
+        
+        # Test that an unusable state file is logged and treated as empty.
+        
+        store = StateStore(util=self.utils, config=self.config, library="home", path=os.path.join(self.tmpdir.name, "missing", "state.db"))
+        with patch.object(self.utils, 'log') as mock_log:
+            self.assertFalse(store.set("last_sync_time", 1.0))
+            self.assertEqual(store.load(), {})
+            self.assertEqual(mock_log.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# test_sync_list.py
+
+import copy
+import datetime
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from sync_list import SyncListGenerator
+from utils import Utils
+from default_config import default_config
+
+def create_library(path, books):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS books (id INTEGER PRIMARY KEY, title TEXT, path TEXT, last_modified TEXT)")
+    connection.execute("CREATE TABLE IF NOT EXISTS data (id INTEGER PRIMARY KEY, book INTEGER, format TEXT, name TEXT, uncompressed_size INTEGER)")
+    for book_id, path, last_modified, formats in books:
+        connection.execute("INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?)", (book_id, f"Book {book_id}", path, last_modified))
+        for book_format in formats:
+            connection.execute("INSERT INTO data (book, format, name, uncompressed_size) VALUES (?, ?, ?, 1)", (book_id, book_format, f"Book {book_id}"))
+    connection.commit()
+    connection.close()
+
+class TestSyncListGenerator(unittest.TestCase):
+    def setUp(self):
+        # A copy, so the settings changed by the tests do not leak into other test modules.
+        self.config = copy.copy(default_config)
+        self.config.OneDriveLibraryFolder = ""
+        self.config.SyncListFormats = ""
+        self.config.SyncListRecentDays = 0
+        self.utils = Utils(self.config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        library_dir = os.path.join(self.tmpdir.name, "Calibre Library")
+        os.makedirs(library_dir)
+        self.db_path = os.path.join(library_dir, "metadata.db")
+        recent = datetime.datetime.now(datetime.timezone.utc).isoformat(sep=" ")
+        create_library(self.db_path, [(1, "Author/Old (1)", "2000-01-01 00:00:00+00:00", ["EPUB", "PDF"]),
+                                      (2, "Author/New (2)", recent, ["EPUB", "MOBI"])])
+        self.sync_list_path = os.path.join(self.tmpdir.name, "sync_list")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def generator(self):
+        return SyncListGenerator(util=self.utils, config=self.config, db_path=self.db_path, path=self.sync_list_path)
+
+    def test_whole_library(self):
+        
+        # Test that without filters the list names the library folder.
+        
+        self.assertEqual(self.generator().generate()[1:], ["/Calibre Library/"])
+
+    def test_formats(self):
+        
+        # Test that a format filter keeps metadata.db, the covers and the selected formats.
+        
+        self.config.SyncListFormats = "epub, PDF"
+        self.assertEqual(self.generator().generate()[1:], ["/Calibre Library/metadata.db", "/Calibre Library/*/*/cover.jpg",
+                                                           "/Calibre Library/*/*/*.epub", "/Calibre Library/*/*/*.pdf"])
+
+    def test_recent_books(self):
+        
+        # Test that only the files of recently modified books are listed.
+        
+        self.config.SyncListRecentDays = 30
+        self.assertEqual(self.generator().generate()[3:], ["/Calibre Library/Author/New (2)/"])
+        self.config.SyncListFormats = "epub"
+        self.assertEqual(self.generator().generate()[3:], ["/Calibre Library/Author/New (2)/Book 2.epub"])
+
+    def test_rewritten_only_when_content_changes(self):
+        
+        # Test that the file is only rewritten when the rules change, and that every rewrite requests a resync.
+        
+        self.config.SyncListRecentDays = 30
+        generator = self.generator()
+        with patch.object(self.utils, 'log'):
+            self.assertTrue(generator.update())
+            self.assertTrue(generator.resync_required)
+            generator.resync_required = False
+
+            # Nothing changed since the last generation.
+            with patch.object(generator, 'generate') as mock_generate:
+                self.assertFalse(generator.update())
+                mock_generate.assert_not_called()
+
+            # The library changed, but not the books the list names.
+            generator.invalidate()
+            self.assertFalse(generator.update())
+            self.assertFalse(generator.resync_required)
+
+            # onedrive refuses a list with an added rule, e.g. for a newly synced book, until it resynced.
+            create_library(self.db_path, [(3, "Author/Newer (3)", datetime.datetime.now(datetime.timezone.utc).isoformat(sep=" "), ["EPUB"])])
+            generator.invalidate()
+            self.assertTrue(generator.update())
+            self.assertTrue(generator.resync_required)
+            generator.resync_required = False
+            with open(self.sync_list_path) as sync_list:
+                self.assertIn("/Calibre Library/Author/Newer (3)/\n", sync_list.read())
+
+            # Likewise for a book leaving the recent window, which removes a rule.
+            create_library(self.db_path, [(3, "Author/Newer (3)", "2000-01-01 00:00:00+00:00", ["EPUB"])])
+            generator.invalidate()
+            self.assertTrue(generator.update())
+            self.assertTrue(generator.resync_required)
+
+if __name__ == '__main__':
+    unittest.main()
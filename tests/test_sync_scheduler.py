@@ -0,0 +1,240 @@
+# test_sync_scheduler.py
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from sync_scheduler import SyncScheduler
+from utils import Utils
+from default_config import Config, default_config
+
+class TestSyncScheduler(unittest.TestCase):
+    def setUp(self):
+        self.config = default_config
+        self.utils = Utils(self.config)
+        self.scheduler = SyncScheduler(util=self.utils, config=self.config)
+        self.thread = threading.Thread(target=self.scheduler.run, daemon=True)
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.thread.join(timeout=5)
+
+    def test_jobs_run_at_their_own_interval(self):
+        
+        # Test that a job with a shorter interval runs more often than one with a longer interval.
+        
+        runs = {"fast": 0, "slow": 0}
+        self.scheduler.add_job("fast", lambda: runs.__setitem__("fast", runs["fast"] + 1), 0.05, delay=0)
+        self.scheduler.add_job("slow", lambda: runs.__setitem__("slow", runs["slow"] + 1), 10, delay=0)
+        self.thread.start()
+        time.sleep(0.5)
+        self.assertGreater(runs["fast"], 3)
+        self.assertEqual(runs["slow"], 1)
+
+    def test_failing_job_is_rescheduled(self):
+        
+        # Test that a job raising an error is logged and runs again.
+        
+        runs = []
+
+        def fail():
+            runs.append(time.monotonic())
+            raise RuntimeError("boom")
+
+        with patch.object(self.utils, 'log') as mock_log:
+            job = self.scheduler.add_job("broken", fail, 0.05, delay=0)
+            self.thread.start()
+            time.sleep(0.3)
+        self.assertGreater(len(runs), 1)
+        self.assertIsInstance(job.last_error, RuntimeError)
+        mock_log.assert_any_call("Sync job broken failed: boom", logging.ERROR)
+
+    def test_slow_job_does_not_delay_others(self):
+        
+        # Test that a long-running job does not block the other jobs.
+        
+        release = threading.Event()
+        runs = []
+        self.scheduler.add_job("slow", lambda: release.wait(5), 10, delay=0)
+        self.scheduler.add_job("fast", lambda: runs.append(1), 0.05, delay=0.05)
+        self.thread.start()
+        time.sleep(0.4)
+        release.set()
+        self.assertGreater(len(runs), 2)
+
+    def test_trigger_runs_job_now(self):
+        
+        # Test that a triggered job runs right away instead of at its next due time.
+        
+        ran = threading.Event()
+        self.scheduler.add_job("library", ran.set, 60)
+        self.thread.start()
+        self.assertTrue(self.scheduler.trigger("library"))
+        self.assertTrue(ran.wait(2))
+        self.assertFalse(self.scheduler.trigger("missing"))
+
+    def test_repeated_triggers_run_once(self):
+        
+        # Test that triggers of a waiting job replace its queued run instead of adding runs.
+        
+        runs = []
+        self.scheduler.add_job("library", lambda: runs.append(1), 60)
+        for _ in range(5):
+            self.scheduler.trigger("library")
+        self.thread.start()
+        time.sleep(0.3)
+        self.assertEqual(len(runs), 1)
+
+    def test_triggers_during_run_are_coalesced(self):
+        
+        # Test that triggers arriving while the job runs lead to exactly one more run.
+        
+        started, release = threading.Event(), threading.Event()
+        runs = []
+
+        def run():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+
+        self.scheduler.add_job("library", run, 60, delay=0)
+        self.thread.start()
+        self.assertTrue(started.wait(2))
+        for _ in range(5):
+            self.scheduler.trigger("library")
+        release.set()
+        time.sleep(0.3)
+        self.assertEqual(len(runs), 2)
+
+    def test_pause_and_resume(self):
+        
+        # Test that no job starts while paused and due jobs run after resuming.
+        
+        ran = threading.Event()
+        self.scheduler.pause()
+        self.scheduler.add_job("library", ran.set, 60, delay=0)
+        self.thread.start()
+        self.assertFalse(ran.wait(0.2))
+        self.assertEqual(self.scheduler.status()["queue_depth"], 1)
+        self.scheduler.resume()
+        self.assertTrue(ran.wait(2))
+
+class TestAdaptiveInterval(unittest.TestCase):
+    def setUp(self):
+        self.config = default_config
+        self.config.SyncJitterRatio = 0
+        self.utils = Utils(self.config)
+        self.scheduler = SyncScheduler(util=self.utils, config=self.config)
+        self.job = self.scheduler.add_job("library", lambda: None, 60, min_interval=15, max_interval=200)
+
+    def tearDown(self):
+        self.config.SyncJitterRatio = 0.1
+        self.scheduler.stop()
+
+    def test_idle_runs_back_off_to_maximum(self):
+        
+        # Test that runs without changes double the interval until it reaches the maximum.
+        
+        delays = [self.scheduler._next_delay(self.job, False) for _ in range(3)]
+        self.assertEqual(delays, [120, 200, 200])
+
+    def test_changes_shorten_interval(self):
+        
+        # Test that a run with changes drops the interval to the minimum, from where it backs off again.
+        
+        self.scheduler._next_delay(self.job, False)
+        self.assertEqual(self.scheduler._next_delay(self.job, True), 15)
+        self.assertEqual(self.scheduler._next_delay(self.job, False), 30)
+
+    def test_failures_retry_with_backoff(self):
+        
+        # Test that consecutive failures are retried with doubling delays, and a success resets them.
+        
+        self.config.SyncFailureRetrySecond = 30
+        delays = [self.scheduler._next_delay(self.job, None) for _ in range(4)]
+        self.assertEqual(delays, [30, 60, 120, 200])
+        self.scheduler._next_delay(self.job, False)
+        self.assertEqual(self.job.failures, 0)
+
+    def test_jitter(self):
+        
+        # Test that jitter keeps the delay within the configured ratio.
+        
+        self.config.SyncJitterRatio = 0.5
+        delays = {self.scheduler._next_delay(self.job, True) for _ in range(20)}
+        self.assertTrue(all(7.5 <= delay <= 22.5 for delay in delays))
+        self.assertGreater(len(delays), 1)
+
+class TestLibraries(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.config = Config()
+        self.config.LibrariesPath = os.path.join(self.tmpdir.name, "libraries.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_libraries(self, libraries):
+        with open(self.config.LibrariesPath, "w") as f:
+            json.dump(libraries, f)
+
+    def test_single_library_without_file(self):
+        
+        # Test that the configuration itself is the only library when no libraries file is set.
+        
+        self.config.LibrariesPath = ""
+        self.assertEqual(self.config.libraries(), [self.config])
+
+    def test_libraries_override_settings(self):
+        
+        # Test that each library overrides the base settings and gets its own book index.
+        
+        self.config.BookIndexPath = "book_index.db"
+        self.config.LibraryIndexPath = "library_index.db"
+        self.write_libraries([
+            {"LibraryName": "home", "MetadataDBPath": "/home/metadata.db"},
+            {"MetadataDBPath": "/work/metadata.db", "OneDriveConfDir": "/config/work", "TimeCheckOneDriveSecond": 60},
+        ])
+        home, work = self.config.libraries()
+        self.assertEqual((home.LibraryName, home.MetadataDBPath), ("home", "/home/metadata.db"))
+        self.assertEqual((work.LibraryName, work.OneDriveConfDir, work.TimeCheckOneDriveSecond), ("library2", "/config/work", 60))
+        self.assertEqual(home.BookIndexPath, "book_index_home.db")
+        self.assertEqual(work.BookIndexPath, "book_index_library2.db")
+        self.assertEqual(home.LibraryIndexPath, "library_index_home.db")
+        self.assertEqual(home.PortCalibreWeb, self.config.PortCalibreWeb)
+
+    def test_unknown_setting(self):
+        
+        # Test that a misspelled setting is rejected.
+        
+        self.write_libraries([{"MetadataDbPath": "/home/metadata.db"}])
+        with self.assertRaises(ValueError):
+            self.config.libraries()
+
+    def test_duplicate_names(self):
+        
+        # Test that two libraries cannot share a name.
+        
+        self.write_libraries([{"LibraryName": "home", "OneDriveConfDir": "/config/home"}, {"LibraryName": "home", "OneDriveConfDir": "/config/work"}])
+        with self.assertRaises(ValueError):
+            self.config.libraries()
+
+    def test_duplicate_confdirs(self):
+        
+        # Test that two libraries cannot sync through one onedrive confdir, including the default one.
+        
+        self.write_libraries([{"LibraryName": "home"}, {"LibraryName": "work"}])
+        with self.assertRaises(ValueError):
+            self.config.libraries()
+        self.write_libraries([{"LibraryName": "home", "OneDriveConfDir": "/config/shared"},
+                              {"LibraryName": "work", "OneDriveConfDir": "/config/shared/"}])
+        with self.assertRaises(ValueError):
+            self.config.libraries()
+
+if __name__ == '__main__':
+    unittest.main()
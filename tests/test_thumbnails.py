@@ -0,0 +1,148 @@
+# test_thumbnails.py
+
+import copy
+import os
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import Future
+from contextlib import closing
+from unittest.mock import patch
+
+import thumbnails
+from thumbnails import CoverThumbnailer, render_thumbnail, thumbnail_path
+from book_index import Changeset
+from utils import Utils
+from default_config import default_config
+
+class TestCoverThumbnailer(unittest.TestCase):
+    def setUp(self):
+        self.config = copy.copy(default_config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.library = os.path.join(self.tmpdir.name, "Calibre Library")
+        self.config.ThumbnailCacheDir = os.path.join(self.tmpdir.name, "cache")
+        self.config.CalibreWebAppDBPath = os.path.join(self.tmpdir.name, "app.db")
+        self.config.ThumbnailResolutions = "1,2"
+        self.config.ThumbnailWorkers = 2
+        with closing(sqlite3.connect(self.config.CalibreWebAppDBPath)) as connection:
+            # Schema of Calibre-Web's thumbnail table.
+            connection.execute("CREATE TABLE thumbnail (id INTEGER PRIMARY KEY, entity_id INTEGER, uuid VARCHAR, format VARCHAR, "
+                               "type SMALLINT, resolution SMALLINT, filename VARCHAR, generated_at DATETIME, expiration DATETIME)")
+        self.utils = Utils(self.config)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_cover(self, book_path, data=b"cover"):
+        os.makedirs(os.path.join(self.library, book_path), exist_ok=True)
+        cover = os.path.join(self.library, book_path, "cover.jpg")
+        with open(cover, "wb") as f:
+            f.write(data)
+        return cover
+
+    def thumbnailer(self):
+        return CoverThumbnailer(util=self.utils, config=self.config, db_path=os.path.join(self.library, "metadata.db"))
+
+    def rows(self):
+        with closing(sqlite3.connect(self.config.CalibreWebAppDBPath)) as connection:
+            return connection.execute("SELECT id, entity_id, uuid, format, type, resolution, filename FROM thumbnail ORDER BY id").fetchall()
+
+    def test_queues_covers_of_changed_books(self):
+        
+        # Test that only existing covers of added and modified books are queued, once per resolution, into Calibre-Web's cache.
+        
+        self.write_cover("Author/New (1)")
+        self.write_cover("Author/Removed (3)")
+        thumbnailer = self.thumbnailer()
+        with patch.object(thumbnails, "ProcessPoolExecutor") as mock_pool:
+            thumbnailer(Changeset(added=[1], removed=[3], modified=[2],
+                                  paths={1: "Author/New (1)", 2: "Author/No Cover (2)", 3: "Author/Removed (3)"}))
+            submitted = [call.args[1:] for call in mock_pool.return_value.submit.call_args_list]
+        self.assertEqual([(cover, height) for cover, _, height, _ in submitted],
+                         [(os.path.join(self.library, "Author/New (1)", "cover.jpg"), 225),
+                          (os.path.join(self.library, "Author/New (1)", "cover.jpg"), 450)])
+        for _, path, _, _ in submitted:
+            self.assertEqual(os.path.dirname(os.path.dirname(path)), os.path.join(self.config.ThumbnailCacheDir, "thumbnails"))
+            self.assertEqual(os.path.basename(os.path.dirname(path)), os.path.basename(path)[:2])
+        self.assertEqual(mock_pool.call_args.kwargs["max_workers"], 2)
+
+    def test_up_to_date_thumbnail_is_skipped(self):
+        
+        # Test that a thumbnail Calibre-Web already has, generated after the cover changed, is not rendered again.
+        
+        self.write_cover("Author/Book (1)")
+        path = thumbnail_path(os.path.join(self.config.ThumbnailCacheDir, "thumbnails"), "abcd.jpg")
+        os.makedirs(os.path.dirname(path))
+        open(path, "wb").close()
+        with closing(sqlite3.connect(self.config.CalibreWebAppDBPath)) as connection, connection:
+            connection.execute("INSERT INTO thumbnail (entity_id, uuid, format, type, resolution, filename, generated_at) "
+                               "VALUES (1, 'abcd', 'jpeg', 1, 1, 'abcd.jpg', datetime('now', '+1 minute'))")
+        thumbnailer = self.thumbnailer()
+        with patch.object(thumbnails, "ProcessPoolExecutor") as mock_pool:
+            thumbnailer(Changeset(added=[], removed=[], modified=[1], paths={1: "Author/Book (1)"}))
+            heights = [call.args[3] for call in mock_pool.return_value.submit.call_args_list]
+        self.assertEqual(heights, [450])
+        self.assertEqual(thumbnailer.cached, 1)
+
+    def test_rendered_thumbnail_is_recorded(self):
+        
+        # Test that a rendered thumbnail is added to Calibre-Web's thumbnail table, and an existing row is updated in place.
+        
+        thumbnailer = self.thumbnailer()
+        future = Future()
+        future.set_result(None)
+        thumbnailer._rendered(1, 2, None, "cover.jpg", "abcd.jpg", future)
+        self.assertEqual(self.rows(), [(1, 1, "abcd", "jpeg", 1, 2, "abcd.jpg")])
+        thumbnailer._rendered(1, 2, 1, "cover.jpg", "abcd.jpg", future)
+        self.assertEqual(len(self.rows()), 1)
+        self.assertEqual(thumbnailer.rendered, 2)
+
+    def test_failed_render_is_not_recorded(self):
+        
+        # Test that a thumbnail that could not be rendered is logged and not recorded.
+        
+        thumbnailer = self.thumbnailer()
+        future = Future()
+        future.set_exception(OSError("cannot identify image file"))
+        with patch.object(self.utils, "log") as mock_log:
+            thumbnailer._rendered(1, 1, None, "cover.jpg", "abcd.jpg", future)
+        mock_log.assert_called_once()
+        self.assertEqual(self.rows(), [])
+
+    def test_missing_app_db(self):
+        
+        # Test that a missing app.db is logged and not created.
+        
+        os.remove(self.config.CalibreWebAppDBPath)
+        self.write_cover("Author/Book (1)")
+        with patch.object(self.utils, "log") as mock_log, patch.object(thumbnails, "ProcessPoolExecutor") as mock_pool:
+            self.thumbnailer()(Changeset(added=[1], removed=[], modified=[], paths={1: "Author/Book (1)"}))
+        mock_log.assert_called_once()
+        mock_pool.assert_not_called()
+        self.assertFalse(os.path.exists(self.config.CalibreWebAppDBPath))
+
+    def test_missing_pillow(self):
+        
+        # Test that rendering fails clearly when Pillow is not installed.
+        
+        cover = self.write_cover("Author/Book (1)")
+        with patch.object(thumbnails, "Image", None):
+            self.assertFalse(CoverThumbnailer.is_available())
+            with self.assertRaises(RuntimeError):
+                render_thumbnail(cover, os.path.join(self.tmpdir.name, "thumbnail.jpg"), 225, 85)
+
+    @unittest.skipUnless(CoverThumbnailer.is_available(), "Pillow is not installed")
+    def test_render_thumbnail(self):
+        
+        # Test that a thumbnail is rendered at the requested height, keeping the aspect ratio of the cover.
+        
+        cover = os.path.join(self.tmpdir.name, "cover.jpg")
+        thumbnails.Image.new("RGB", (400, 600), "red").save(cover)
+        path = os.path.join(self.tmpdir.name, "ab", "abcd.jpg")
+        render_thumbnail(cover, path, 225, 85)
+        with thumbnails.Image.open(path) as thumbnail:
+            self.assertEqual(thumbnail.size, (150, 225))
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["abcd.jpg"])
+
+if __name__ == '__main__':
+    unittest.main()
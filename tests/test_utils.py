@@ -1,8 +1,12 @@
+import gzip
+import logging
+import queue
+import tempfile
 import unittest
-from unittest.mock import patch, mock_open
+from unittest.mock import patch
 import os
 
-from utils import Utils
+from utils import Utils, DroppingQueueHandler
 from default_config import default_config
 
 class TestUtils(unittest.TestCase):
@@ -10,36 +14,78 @@ class TestUtils(unittest.TestCase):
         # Create a config object with logging enabled
         self.config = default_config
         self.config.Log = True
+        self.config.LogLevel = "INFO"
+        self.config.LogMaxBytes = 10 * 1024 * 1024
+        self.config.LogRotateWhen = ""
+        self.config.LogCompress = True
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.config.LogPath = os.path.join(self.tmpdir.name, "sync.log")
         self.utils = Utils(self.config)
 
-    @patch("builtins.open", new_callable=mock_open)
-    def test_open_log_success(self, mock_file):
+    def tearDown(self):
+        self.utils.close_log()
+        self.config.LogLevel = "INFO"
+        self.config.LogPath = "sync.log"
+        self.tmpdir.cleanup()
+
+    def read_log(self):
+        with open(self.config.LogPath) as f:
+            return f.read()
+
+    def test_open_log_success(self):
         
-        #Test that the log file opens successfully.
+        #Test that messages are written to the log file by the background writer.
         
-        self.utils.open_log()
-        mock_file.assert_called_with("sync.log", "a")
-        self.assertIsNotNone(self.utils.log_file)
+        with patch('sys.stderr'):
+            self.utils.open_log()
+            self.assertIsNotNone(self.utils.log_file)
+            self.utils.log("Test message")
+            self.utils.close_log()
+        self.assertRegex(self.read_log(), r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} - Test message\n$")
+
+    def test_for_library_prefixes_messages(self):
+        
+        #Test that a library logger writes through the same log file with the library name prepended.
+        
+        with patch('sys.stderr'):
+            self.utils.open_log()
+            self.utils.for_library("work").log("Test message")
+            self.utils.close_log()
+        self.assertRegex(self.read_log(), r" - \[work\] Test message\n$")
 
-    @patch("builtins.open", side_effect=IOError("Cannot open file"))
-    def test_open_log_failure(self, mock_file):
+    def test_open_log_failure(self):
         
         #Test handling of an error when opening the log file.
         
+        self.config.LogPath = os.path.join(self.tmpdir.name, "missing", "sync.log")
         with patch('builtins.print') as mock_print:
             self.utils.open_log()
-            mock_print.assert_called_with("Failed to open log file: Cannot open file")
+            self.assertTrue(mock_print.call_args[0][0].startswith("Failed to open log file:"))
             self.assertIsNone(self.utils.log_file)
 
-    @patch("builtins.open", new_callable=mock_open)
-    def test_close_log_success(self, mock_file):
+    def test_open_log_twice_keeps_one_file(self):
         
-        #Test that the log file closes successfully.
+        #Test that the log file is opened once for the life of the process.
         
-        self.utils.open_log()
-        self.utils.close_log()
-        if(self.utils.log_file):
-            self.assertTrue(self.utils.log_file.closed)
+        with patch('sys.stderr'):
+            self.utils.open_log()
+            log_file = self.utils.log_file
+            self.utils.open_log()
+            self.assertIs(self.utils.log_file, log_file)
+
+    def test_close_log_success(self):
+        
+        #Test that closing the log flushes pending messages and closes the file.
+        
+        with patch('sys.stderr'):
+            self.utils.open_log()
+            for i in range(100):
+                self.utils.log(f"Message {i}")
+            log_file = self.utils.log_file
+            self.utils.close_log()
+        self.assertIsNone(self.utils.log_file)
+        self.assertIsNone(log_file.stream)
+        self.assertEqual(len(self.read_log().splitlines()), 100)
 
     def test_close_log_no_file(self):
         
@@ -51,16 +97,80 @@ class TestUtils(unittest.TestCase):
             mock_print.assert_not_called()
 
     @patch("time.strftime", return_value="2023-08-15 12:00:00")
-    def test_log(self, mock_strftime):
+    def test_log_before_open(self, mock_strftime):
         
-        #Test the logging functionality, ensuring messages are logged with timestamps.
+        #Test that messages logged before the log is opened are printed with timestamps.
         
-        with patch('builtins.print') as mock_print, \
-             patch("builtins.open", mock_open()) as mock_file:
-            self.utils.open_log()
+        with patch('builtins.print') as mock_print:
             self.utils.log("Test message")
             mock_print.assert_called_with("2023-08-15 12:00:00 - Test message")
-            mock_file().write.assert_called_with("2023-08-15 12:00:00 - Test message\n")
+
+    def test_debug_filtered_by_level(self):
+        
+        #Test that debug messages are discarded below the configured level and kept at DEBUG.
+        
+        with patch('builtins.print') as mock_print:
+            self.utils.debug("onedrive output")
+            mock_print.assert_not_called()
+
+        self.config.LogLevel = "DEBUG"
+        utils = Utils(self.config)
+        with patch('builtins.print') as mock_print:
+            utils.debug("onedrive output")
+            mock_print.assert_called_once()
+
+    def test_failures_kept_above_info(self):
+        
+        #Test that errors are logged at LOG_LEVEL=WARNING while informational messages are discarded.
+        
+        self.config.LogLevel = "WARNING"
+        utils = Utils(self.config)
+        with patch('builtins.print') as mock_print:
+            utils.log("OneDrive sync finished.")
+            utils.log("OneDrive sync failed: exit code 1", logging.ERROR)
+        mock_print.assert_called_once()
+        self.assertIn("OneDrive sync failed", mock_print.call_args.args[0])
+
+    def test_invalid_log_level(self):
+        
+        #Test that an invalid LOG_LEVEL falls back to INFO with a warning instead of failing at startup.
+        
+        self.config.LogLevel = "VERBOSE"
+        with patch('builtins.print') as mock_print:
+            utils = Utils(self.config)
+        self.assertEqual(utils.logger.level, logging.INFO)
+        self.assertIn("Invalid LOG_LEVEL 'VERBOSE'", mock_print.call_args.args[0])
+
+    def test_full_queue_drops_and_summarizes(self):
+        
+        #Test that messages are dropped instead of blocking when the queue is full, and the loss is reported.
+        
+        log_queue = queue.Queue(maxsize=2)
+        handler = DroppingQueueHandler(log_queue)
+        record = logging.LogRecord("test", logging.INFO, __file__, 0, "message", None, None)
+        for _ in range(5):
+            handler.enqueue(record)
+        self.assertEqual(handler.dropped, 3)
+        log_queue.get_nowait()
+        log_queue.get_nowait()
+        handler.enqueue(record)
+        self.assertEqual(log_queue.get_nowait().getMessage(), "3 log messages dropped because the log queue was full.")
+        self.assertEqual(handler.dropped, 0)
+        self.assertEqual(handler.dropped_total, 3)
+
+    def test_rotation_compresses_old_files(self):
+        
+        #Test that the log file is rotated by size and the rotated file is gzipped.
+        
+        self.config.LogMaxBytes = 200
+        with patch('sys.stderr'):
+            self.utils.open_log()
+            for i in range(20):
+                self.utils.log(f"Message number {i}")
+            self.utils.close_log()
+        with gzip.open(self.config.LogPath + ".1.gz", "rt") as rotated:
+            self.assertIn("Message number", rotated.read())
+        self.assertFalse(os.path.exists(self.config.LogPath + ".1"))
 
     @patch("os.path.getmtime", return_value=1625068800.0)  # Mocked timestamp
     def test_get_last_modified_time_success(self, mock_getmtime):
@@ -79,7 +189,7 @@ class TestUtils(unittest.TestCase):
         with patch.object(self.utils, 'log') as mock_log:
             modified_time = self.utils.get_last_modified_time("/path/to/nonexistent/file")
             self.assertIsNone(modified_time)
-            mock_log.assert_called_with("Error getting last modified time for /path/to/nonexistent/file: File not found")
+            mock_log.assert_called_with("Error getting last modified time for /path/to/nonexistent/file: File not found", logging.ERROR)
 
 if __name__ == '__main__':
     unittest.main()